@@ -1,6 +1,56 @@
 """Build a book with Jupyter Notebooks and Sphinx."""
 from .toc import update_indexname, add_toctree
 from .yaml import add_yaml_config
+from .utils import init_cache_path
+from .draft import init_draft_config, init_draft_builder
+from .mathrender import setup_math_rendering, init_math_cache
+from .bibcache import note_bibfiles, load_bibtex_cache
+from .jupytextcache import (
+    init_jupytext_cache,
+    finish_jupytext_cache,
+)
+from .discovery import init_discovery
+from .doctrees import init_doctree_storage
+from .images import init_image_optimization, add_image_srcset
+from .assets import init_asset_copying, finish_asset_copying
+from .outputs import init_output_limits
+from .pagescripts import init_page_scripts, prune_page_scripts, report_page_scripts
+from .kernelpool import init_kernel_pool, shutdown_kernel_pool
+from .memprofile import init_memory_profile, write_memory_profile, profiled_step
+from .memory import (
+    init_memory_scheduler,
+    execute_notebooks,
+    record_page_start,
+    record_page_end,
+    merge_page_memory,
+    finish_memory_scheduler,
+)
+from .shard import init_shards, filter_shard_docs
+from .partial import init_partial_build, filter_partial_docs
+from .pagecache import (
+    init_page_cache,
+    record_read_docs,
+    store_read_pages,
+    report_page_cache,
+)
+from .checkpoint import (
+    init_checkpoints,
+    checkpoint_doc_read,
+    checkpoint_docs_merged,
+    finish_checkpoints,
+)
+from .plan import (
+    init_build_records,
+    record_read_start,
+    record_read_end,
+    purge_build_records,
+    merge_build_records,
+    get_toc_outdated,
+)
+from .highlight import (
+    init_highlight_cache,
+    finish_highlight_cache,
+)
 
 
 __version__ = "0.0.1dev0"
@@ -9,7 +59,10 @@ __version__ = "0.0.1dev0"
 # We connect this function to the step after the builder is initialized
 def setup(app):
     app.connect("config-inited", update_indexname)
-    app.connect("source-read", add_toctree)
+    app.connect(
+        "source-read",
+        profiled_step("add_toctree", lambda app, docname, source: docname)(add_toctree),
+    )
 
     app.add_config_value("globaltoc_path", "toc.yml", "env")
 
@@ -18,6 +71,123 @@ def setup(app):
 
     app.connect("config-inited", add_yaml_config)
 
+    # Keeping caches in a folder that is shared by several builds
+    app.add_config_value("cache_path", "", "")
+    app.connect("config-inited", init_cache_path)
+
+    # Fast draft builds, that skip execution, highlighting and the search index
+    app.add_config_value("draft", False, "")
+    app.connect("config-inited", init_draft_config)
+    app.connect("builder-inited", init_draft_builder)
+
+    # Pre-rendering math at build time instead of with MathJax
+    app.add_config_value("prerender_math", False, "html")
+    app.connect("config-inited", setup_math_rendering)
+    app.connect("builder-inited", init_math_cache)
+
+    # Caching highlighted code blocks across builds
+    app.add_config_value("highlight_cache_size", 100, "html")
+    app.connect("builder-inited", init_highlight_cache)
+    app.connect("build-finished", finish_highlight_cache)
+
+    # Caching the Jupytext conversion of text notebooks across builds
+    app.add_config_value("jupytext_cache", True, "")
+    app.connect("builder-inited", init_jupytext_cache)
+    app.connect("build-finished", finish_jupytext_cache)
+
+    # Finding source files with one snapshot of the book's folder
+    app.add_config_value("discovery_cache", True, "")
+    app.connect("builder-inited", init_discovery)
+
+    # Compressing doctrees
+    app.add_config_value("doctree_compression", None, "")
+    app.connect("builder-inited", init_doctree_storage)
+
+    # Optimizing images, and making responsive variants of them
+    app.add_config_value("optimize_images", False, "html")
+    app.add_config_value("image_quality", None, "html")
+    app.add_config_value("image_widths", [], "html")
+    app.add_config_value("latex_image_max_width", None, "")
+    app.connect("builder-inited", init_image_optimization)
+    app.connect("html-page-context", add_image_srcset)
+
+    # Copying static files, images and downloads incrementally
+    app.connect("builder-inited", init_asset_copying)
+    app.connect("build-finished", finish_asset_copying)
+
+    # Only loading the scripts of runtime features on pages that use them
+    app.add_config_value("page_scripts", "all", "html")
+    app.connect("builder-inited", init_page_scripts)
+    app.connect("html-page-context", prune_page_scripts)
+    app.connect("build-finished", report_page_scripts)
+
+    # Loading pre-parsed bibliographies before documents are read
+    app.connect("env-get-outdated", note_bibfiles)
+    app.connect("env-before-read-docs", load_bibtex_cache)
+
+    # Truncating large notebook outputs
+    app.add_config_value("max_output_size", None, "env")
+    app.add_config_value("max_output_lines", None, "env")
+    app.add_config_value("save_full_outputs", False, "env")
+    app.connect("builder-inited", init_output_limits)
+
+    # Re-using warm kernels between notebooks
+    app.add_config_value("kernel_pool_size", 0, "")
+    app.add_config_value("kernel_warmup", "", "")
+    app.add_config_value("kernel_max_uses", 20, "")
+    app.add_config_value("kernel_max_memory_growth", 500, "")
+    app.connect("builder-inited", init_kernel_pool)
+    app.connect("build-finished", shutdown_kernel_pool)
+
+    # Profiling the memory of documents, steps and the build environment
+    app.add_config_value("profile_memory", False, "")
+    app.connect("builder-inited", init_memory_profile)
+    app.connect("build-finished", write_memory_profile)
+
+    # Sharded builds, and merging shards
+    app.add_config_value("shard", None, "")
+    app.add_config_value("merge_shards", [], "")
+    app.connect("builder-inited", init_shards)
+    app.connect("env-before-read-docs", filter_shard_docs)
+
+    # Building only one entry of the TOC and the pages under it
+    app.add_config_value("only", None, "")
+    app.connect("builder-inited", init_partial_build)
+    app.connect("env-before-read-docs", filter_partial_docs)
+
+    # Saving checkpoints while reading, to resume interrupted builds
+    app.add_config_value("checkpoint_interval", 60, "")
+    app.connect("env-before-read-docs", init_checkpoints)
+    app.connect("source-read", checkpoint_doc_read)
+    app.connect("env-merge-info", checkpoint_docs_merged)
+    app.connect("env-updated", finish_checkpoints)
+
+    # Tracking TOC dependencies and read times, to plan minimal rebuilds
+    app.connect("builder-inited", init_build_records)
+    app.connect("source-read", record_read_start)
+    app.connect("doctree-read", record_read_end)
+    app.connect("env-purge-doc", purge_build_records)
+    app.connect("env-merge-info", merge_build_records)
+    app.connect("env-get-outdated", get_toc_outdated)
+
+    # Sharing read and written pages with other builds
+    app.add_config_value("page_cache", "", "")
+    app.add_config_value("page_cache_backend", "", "")
+    app.connect("builder-inited", init_page_cache)
+    app.connect("env-before-read-docs", record_read_docs)
+    app.connect("env-updated", store_read_pages)
+    app.connect("build-finished", report_page_cache)
+
+    # Executing notebooks (or reading pages) in parallel within a memory budget (in
+    # MB), once the pages to read are known, e.g. after a shard's pages are picked
+    app.add_config_value("max_memory", None, "")
+    app.connect("builder-inited", init_memory_scheduler)
+    app.connect("env-before-read-docs", execute_notebooks)
+    app.connect("source-read", record_page_start)
+    app.connect("doctree-read", record_page_end)
+    app.connect("env-merge-info", merge_page_memory)
+    app.connect("env-updated", finish_memory_scheduler)
+
     return {
         "version": __version__,
         "parallel_read_safe": True,
@@ -0,0 +1,252 @@
+"""Copy static files, images and downloads into the output folder incrementally.
+
+Sphinx copies these assets at the end of every build. Files whose content hasn't
+changed are left alone, the others are copied in parallel. New files are
+hard-linked from a store of files keyed by their content, so that the build after
+`jupyter-book clean`, or another build that shares the cache folder, doesn't write
+them again. Since output files may be hard links, they are always replaced rather
+than written in place.
+"""
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import sphinx.builders.html
+import sphinx.util.fileutil
+from sphinx.util import logging
+from sphinx.util.osutil import copyfile
+
+from .publish import _hash_file
+from .utils import cache_folder
+
+logger = logging.getLogger(__name__)
+
+# The folder (relative to the `_build` folder) of the store of asset files
+ASSET_STORE_FOLDER = ".asset_store"
+
+# The ioctl that makes a copy-on-write clone of a file, on Linux
+FICLONE = 0x40049409
+
+
+def _clone(source, dest):
+    """Copy a file, as a copy-on-write clone if the filesystem supports it.
+
+    Returns whether the contents of the file had to be written.
+    """
+    with open(source, "rb") as fsrc, open(dest, "wb") as fdst:
+        try:
+            import fcntl
+
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return False
+        except (ImportError, OSError):
+            shutil.copyfileobj(fsrc, fdst)
+            return True
+
+
+def _tmp_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+class AssetCopier:
+    """Copy files into the output folder, skipping those that haven't changed.
+
+    Files are unchanged if their size and modification time are the same as the
+    source, or else if their contents are. Copies made in a `batch` are run in a
+    pool of threads at the end of the batch.
+    """
+
+    def __init__(self, path_store, jobs=None):
+        self.path_store = Path(path_store)
+        self.jobs = jobs
+        # Turned off if the store can't be hard-linked, e.g. on another disk
+        self.use_store = True
+        self.counts = {"unchanged": 0, "linked": 0, "copied": 0}
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def copy(self, source, dest):
+        """Copy a file, or queue the copy if in a batch."""
+        if self._pending is not None:
+            # A later copy to the same file replaces an earlier one
+            self._pending[os.path.abspath(dest)] = str(source)
+        else:
+            self._copy(str(source), str(dest))
+
+    @contextmanager
+    def batch(self):
+        """Queue the copies made in this block, and run them when it ends."""
+        if self._pending is not None:
+            yield
+            return
+        self._pending = {}
+        try:
+            yield
+            pending = self._pending
+        finally:
+            self._pending = None
+        if len(pending) < 2:
+            for dest, source in pending.items():
+                self._copy(source, dest)
+            return
+        with ThreadPoolExecutor(self.jobs) as pool:
+            list(pool.map(self._copy, pending.values(), pending.keys()))
+
+    def _count(self, kind, written=0):
+        with self._lock:
+            self.counts[kind] += 1
+            self.bytes_written += written
+
+    def _copy(self, source, dest):
+        stat_src = os.stat(source)
+        try:
+            stat_dest = os.stat(dest)
+        except FileNotFoundError:
+            stat_dest = None
+        times = (stat_src.st_atime_ns, stat_src.st_mtime_ns)
+        if stat_dest is not None and stat_dest.st_size == stat_src.st_size:
+            if stat_dest.st_mtime_ns == stat_src.st_mtime_ns:
+                self._count("unchanged")
+                return
+            if _hash_file(source) == _hash_file(dest):
+                os.utime(dest, ns=times)
+                self._count("unchanged")
+                return
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        path_tmp = _tmp_path(dest)
+        try:
+            kind, written = self._link_or_copy(source, path_tmp, stat_src.st_size)
+            os.utime(path_tmp, ns=times)
+            os.replace(path_tmp, dest)
+        finally:
+            if os.path.lexists(path_tmp):
+                os.unlink(path_tmp)
+        self._count(kind, written)
+
+    def _link_or_copy(self, source, dest, size):
+        """Hard-link a file from the store, or else clone or copy it.
+
+        Returns how the file was made, and the number of bytes written.
+        """
+        written = 0
+        if self.use_store:
+            digest = _hash_file(source)
+            path_stored = self.path_store.joinpath(digest[:2], digest)
+            # Try again if another build prunes the file in the meantime
+            for _ in range(3):
+                if not path_stored.exists():
+                    path_stored.parent.mkdir(parents=True, exist_ok=True)
+                    path_tmp = _tmp_path(path_stored)
+                    shutil.copyfile(source, path_tmp)
+                    os.replace(path_tmp, path_stored)
+                    written += size
+                try:
+                    os.link(path_stored, dest)
+                    return "linked", written
+                except FileNotFoundError:
+                    continue
+                except OSError:
+                    self.use_store = False
+                    break
+        if _clone(source, dest):
+            return "copied", written + size
+        return "linked", written
+
+    def prune(self):
+        """Remove the stored files that no output folder links to any more."""
+        removed = 0
+        if not self.path_store.is_dir():
+            return removed
+        for path in self.path_store.glob("*/*"):
+            if path.name.endswith(".tmp"):
+                continue
+            try:
+                if path.stat().st_nlink == 1:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def copy_file(app, source, dest):
+    """Copy a file into the output folder, with the builder's `AssetCopier` if any."""
+    copier = getattr(app.builder, "_jb_assets", None)
+    if copier is None:
+        copyfile(str(source), str(dest))
+    else:
+        copier.copy(source, dest)
+
+
+@contextmanager
+def _copy_with(copier):
+    """Make the asset copies of Sphinx's HTML builder go through `copier`.
+
+    Sphinx copies every asset with `copyfile`, one folder at a time with
+    `copy_asset`. Each folder is copied in a batch, so that files of later folders
+    (e.g. `html_static_path`) still replace those of earlier ones (e.g. the theme).
+    """
+    copy_asset = sphinx.builders.html.copy_asset
+
+    def copy_asset_batch(*args, **kwargs):
+        with copier.batch():
+            copy_asset(*args, **kwargs)
+
+    patches = [
+        (sphinx.util.fileutil, "copyfile", copier.copy),
+        (sphinx.builders.html, "copyfile", copier.copy),
+        (sphinx.builders.html, "copy_asset", copy_asset_batch),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+
+def init_asset_copying(app):
+    """Copy the assets of HTML builds incrementally."""
+    builder = app.builder
+    if builder.format != "html":
+        return
+    copier = AssetCopier(cache_folder(app, ASSET_STORE_FOLDER))
+    builder._jb_assets = copier
+
+    def batched(copy_files):
+        def copy_files_batched():
+            with copier.batch():
+                copy_files()
+
+        return copy_files_batched
+
+    builder.copy_image_files = batched(builder.copy_image_files)
+    builder.copy_download_files = batched(builder.copy_download_files)
+    finish = builder.finish
+
+    def finish_incremental():
+        with _copy_with(copier):
+            finish()
+
+    builder.finish = finish_incremental
+
+
+def finish_asset_copying(app, exc):
+    """Report how many bytes of assets were written, and prune the store."""
+    copier = getattr(app.builder, "_jb_assets", None)
+    if copier is None or exc is not None:
+        return
+    counts = copier.counts
+    if sum(counts.values()):
+        logger.info(
+            f"Copied assets: {counts['unchanged']} unchanged, {counts['linked']} "
+            f"linked, {counts['copied']} copied "
+            f"({copier.bytes_written / 1024 / 1024:.1f}MB written)"
+        )
+    copier.prune()
@@ -0,0 +1,112 @@
+"""Cache parsed bibliographies so that large .bib files are only parsed once."""
+import os
+import pickle
+from hashlib import sha256
+from pathlib import Path
+from sphinx.util import logging
+from .utils import cache_folder
+
+logger = logging.getLogger(__name__)
+
+# The folder (relative to the `_build` folder) where parsed bibliographies are stored
+BIBTEX_CACHE_FOLDER = ".bibtex_cache"
+
+
+def note_bibfiles(app, builder, added, changed, removed):
+    """Note the .bib files of the `bibliography` directives of the last build.
+
+    This runs before the documents that changed are purged from the environment,
+    which removes their bibliographies.
+    """
+    cache = getattr(app.env, "bibtex_cache", None)
+    bibfiles = set()
+    if hasattr(cache, "get_all_bibliography_caches"):
+        for bibcache in cache.get_all_bibliography_caches():
+            bibfiles.update(bibcache.bibfiles)
+    builder._jb_bibfiles = sorted(bibfiles)
+    return []
+
+
+def _find_bibfiles(app):
+    """The .bib files that the book's `bibliography` directives use.
+
+    A new environment doesn't know them yet, so it uses the .bib files that were
+    found with the book's documents, which leaves out excluded folders.
+    """
+    bibfiles = getattr(app.builder, "_jb_bibfiles", None)
+    if bibfiles:
+        return bibfiles
+    files = getattr(app.project, "files", [])
+    return [
+        os.path.normpath(os.path.join(app.srcdir, ii))
+        for ii in files
+        if ii.endswith(".bib")
+    ]
+
+
+def _cache_name(path_bib, encoding):
+    """The name of the cache file for a .bib file, from a hash of its content."""
+    from pybtex import __version__ as pybtex_version
+
+    content = Path(path_bib).read_bytes()
+    key = content + f"{encoding}\n{pybtex_version}".encode()
+    return sha256(key).hexdigest() + ".pickle"
+
+
+def _load_bibfile(path_bib, path_pickle, encoding):
+    """Load the parsed data for a .bib file from the cache, parsing it if needed."""
+    from pybtex.database.input import bibtex
+
+    if path_pickle.exists():
+        try:
+            with open(path_pickle, "rb") as ff:
+                return pickle.load(ff)
+        except Exception:
+            logger.warning(f"Could not load cached bibliography, re-parsing {path_bib}")
+
+    parser = bibtex.Parser(encoding)
+    parser.parse_file(path_bib)
+    path_tmp = path_pickle.with_suffix(f".{os.getpid()}.tmp")
+    with open(path_tmp, "wb") as ff:
+        pickle.dump(parser.data, ff, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path_tmp, path_pickle)
+    return parser.data
+
+
+def load_bibtex_cache(app, env, docnames):
+    """Fill the `sphinxcontrib.bibtex` cache with pre-parsed .bib files.
+
+    This runs in the main process before documents are read, so that parallel
+    read workers inherit the parsed data instead of each parsing it again.
+    Parsed data is stored in `_build/.bibtex_cache/`, keyed by a hash of the
+    .bib file's content, so that new environments (e.g. fresh builds or
+    `jupyter-book page`) don't need to parse it either.
+    """
+    cache = getattr(env, "bibtex_cache", None)
+    if not docnames or cache is None or not hasattr(cache, "bibfiles"):
+        return
+    from sphinxcontrib.bibtex.cache import BibfileCache
+
+    path_cache = cache_folder(app, BIBTEX_CACHE_FOLDER)
+    path_cache.mkdir(parents=True, exist_ok=True)
+    encoding = app.config.source_encoding
+    used = set()
+    for path_bib in _find_bibfiles(app):
+        if not os.path.isfile(path_bib):
+            # sphinxcontrib.bibtex warns about it, if a directive still uses it
+            continue
+        name = _cache_name(path_bib, encoding)
+        used.add(name)
+        mtime = os.path.getmtime(path_bib)
+        if path_bib in cache.bibfiles and cache.bibfiles[path_bib].mtime == mtime:
+            continue
+        data = _load_bibfile(path_bib, path_cache.joinpath(name), encoding)
+        cache.bibfiles[path_bib] = BibfileCache(mtime=mtime, data=data)
+
+    # Remove cached data for .bib files that have since changed, unless the
+    # cache is shared with other books
+    if app.config["cache_path"]:
+        return
+    for path in path_cache.iterdir():
+        if path.name not in used:
+            path.unlink()
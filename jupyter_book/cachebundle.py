@@ -0,0 +1,282 @@
+"""Export the execution cache of a book to an archive, and import it elsewhere.
+
+Notebooks are cached by the hash of their code and kernel, which doesn't depend on
+where the book is. An archive holds every cached notebook (with its artifacts),
+under its hash, after a manifest with a fingerprint of the Python environment
+that executed them. Archives are read as a stream, one notebook at a time, and
+notebooks that are already cached aren't written again.
+"""
+import io
+import os
+import re
+import sys
+import json
+import shutil
+import tarfile
+import platform
+import tempfile
+from hashlib import sha256
+from pathlib import Path, PurePosixPath
+import yaml
+import nbformat as nbf
+
+# The first file of an archive, with its version and the environment it comes from
+MANIFEST_NAME = "manifest.json"
+BUNDLE_VERSION = 1
+
+# Compression of archives, by their file extension
+COMPRESSIONS = {".gz": "gz", ".tgz": "gz", ".bz2": "bz2", ".xz": "xz"}
+
+# The hash of a notebook, that its files are stored under in an archive
+_HASHKEY = re.compile(r"[0-9a-f]{32,128}")
+
+
+def environment_info():
+    """The Python version, platform and packages that notebooks are executed with.
+
+    Cached outputs can only be re-used if these are the same.
+    """
+    import pkg_resources
+
+    packages = sorted(
+        f"{dist.project_name.lower()}=={dist.version}"
+        for dist in pkg_resources.working_set
+    )
+    return {
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "packages": packages,
+    }
+
+
+def environment_fingerprint(info=None):
+    """A short hash of `environment_info`."""
+    if info is None:
+        info = environment_info()
+    return sha256(json.dumps(info, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def find_cache_path(path_book, path_output=None, path_cache=None, config=None):
+    """The execution cache of a book, as `jupyter-book build` would use it.
+
+    This is `execute.cache` in the book's configuration if it is set, or else the
+    `.jupyter_cache` folder of the shared cache folder or of the `_build` folder.
+    """
+    if config is None and Path(path_book).joinpath("_config.yml").exists():
+        config = Path(path_book).joinpath("_config.yml")
+    if config is not None:
+        config_yaml = yaml.safe_load(Path(config).read_text()) or {}
+        path = (config_yaml.get("execute") or {}).get("cache")
+        if path:
+            return Path(path).absolute()
+    if path_cache is None:
+        path_cache = Path(path_output or path_book).joinpath("_build")
+    return Path(path_cache).absolute().joinpath(".jupyter_cache")
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _relative_uri(uri, path_book):
+    """The path of a notebook relative to the book, if it is in the book."""
+    if path_book is None:
+        return uri
+    try:
+        return Path(uri).relative_to(Path(path_book).absolute()).as_posix()
+    except ValueError:
+        return uri
+
+
+def export_cache(path_cache, path_archive, path_book=None):
+    """Write every notebook of an execution cache into one compressed archive.
+
+    Parameters
+    ----------
+    path_cache : str | Path
+        The folder of the execution cache, e.g. `_build/.jupyter_cache`.
+    path_archive : str | Path
+        The archive to write. It is compressed with gzip, unless its name ends
+        in `.bz2` or `.xz`.
+    path_book : str | Path | None
+        The book's folder. The paths of notebooks in the book are stored
+        relative to it.
+
+    Returns
+    -------
+    n_exported : int
+    """
+    from jupyter_cache import get_cache
+
+    cache = get_cache(str(path_cache))
+    path_archive = Path(path_archive)
+    compression = COMPRESSIONS.get(path_archive.suffix, "gz")
+    info = environment_info()
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "fingerprint": environment_fingerprint(info),
+        "environment": info,
+    }
+
+    records = cache.list_cache_records()
+    path_tmp = path_archive.with_name(f"{path_archive.name}.{os.getpid()}.tmp")
+    try:
+        with tarfile.open(path_tmp, f"w:{compression}") as tar:
+            _add_bytes(tar, MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+            for record in records:
+                bundle = cache.get_cache_bundle(record.pk)
+                entry = {
+                    "uri": _relative_uri(record.uri, path_book),
+                    "description": record.description,
+                    "data": record.data,
+                }
+                prefix = record.hashkey
+                _add_bytes(tar, f"{prefix}/record.json", json.dumps(entry).encode())
+                notebook = nbf.writes(bundle.nb, nbf.NO_CONVERT).encode()
+                _add_bytes(tar, f"{prefix}/base.ipynb", notebook)
+                artifacts = bundle.artifacts
+                for path, rel_path in zip(artifacts.paths, artifacts.relative_paths):
+                    name = f"{prefix}/artifacts/{rel_path.as_posix()}"
+                    tar.add(str(path), arcname=name, recursive=False)
+        os.replace(path_tmp, path_archive)
+    finally:
+        if path_tmp.exists():
+            path_tmp.unlink()
+    return len(records)
+
+
+def _is_cached(cache, hashkey):
+    from jupyter_cache.cache.db import NbCacheRecord
+
+    try:
+        NbCacheRecord.record_from_hashkey(hashkey, cache.db)
+    except KeyError:
+        return False
+    return True
+
+
+def _cache_entry(cache, path_entry, path_book):
+    """Add a notebook that was extracted from an archive to the cache.
+
+    Returns whether it was added, rather than already cached.
+    """
+    from jupyter_cache.base import CachingError, NbBundleIn
+    from jupyter_cache.cache.main import NbArtifacts
+
+    entry = json.loads(path_entry.joinpath("record.json").read_text())
+    notebook = nbf.read(str(path_entry.joinpath("base.ipynb")), nbf.NO_CONVERT)
+    path_artifacts = path_entry.joinpath("artifacts")
+    artifacts = [path for path in path_artifacts.rglob("*") if path.is_file()]
+    uri = entry["uri"]
+    if path_book is not None and not Path(uri).is_absolute():
+        uri = str(Path(path_book).absolute().joinpath(uri))
+    bundle = NbBundleIn(
+        notebook,
+        uri,
+        artifacts=NbArtifacts(artifacts, in_folder=path_artifacts),
+        data=entry.get("data") or {},
+    )
+    try:
+        # The hash is computed again, in case it is different with this nbformat
+        cache.cache_notebook_bundle(
+            bundle, check_validity=False, description=entry.get("description", "")
+        )
+    except CachingError:
+        return False
+    return True
+
+
+def import_cache(path_cache, path_archive, path_book=None, any_environment=False):
+    """Add the notebooks of an archive from `export_cache` to an execution cache.
+
+    The archive is read as a stream, so it can be large, or come from a pipe.
+    Notebooks that are already in the cache are skipped.
+
+    Parameters
+    ----------
+    path_cache : str | Path
+        The folder of the execution cache, e.g. `_build/.jupyter_cache`.
+    path_archive : str | Path | file
+        The archive, or a binary file object to read it from.
+    path_book : str | Path | None
+        The book's folder, that paths of notebooks are relative to.
+    any_environment : bool
+        Import the notebooks even if they were executed in a different Python
+        environment than this one.
+
+    Returns
+    -------
+    summary : dict
+        The number of notebooks that were ``imported`` and ``skipped``.
+    """
+    from jupyter_cache import get_cache
+
+    cache = get_cache(str(path_cache))
+    summary = {"imported": 0, "skipped": 0}
+    if hasattr(path_archive, "read"):
+        tar = tarfile.open(fileobj=path_archive, mode="r|*")
+    else:
+        tar = tarfile.open(str(path_archive), mode="r|*")
+
+    with tar, tempfile.TemporaryDirectory() as path_tmp:
+        members = iter(tar)
+        member = next(members, None)
+        if member is None or member.name != MANIFEST_NAME:
+            raise ValueError(f"Not an execution cache archive: {path_archive}")
+        manifest = json.loads(tar.extractfile(member).read())
+        if manifest.get("version") != BUNDLE_VERSION:
+            version = manifest.get("version")
+            raise ValueError(f"Unsupported execution cache archive version: {version}")
+        fingerprint = environment_fingerprint()
+        if not any_environment and manifest["fingerprint"] != fingerprint:
+            info = manifest.get("environment", {})
+            raise ValueError(
+                "The notebooks of this archive were executed in a different "
+                f"environment (Python {info.get('python')} on {info.get('platform')}, "
+                f"fingerprint {manifest['fingerprint']}) than this one "
+                f"(fingerprint {fingerprint})."
+            )
+
+        # Members are grouped by notebook, so each is cached once it is complete
+        hashkey = path_entry = None
+
+        def finish_entry():
+            if path_entry is not None and _cache_entry(cache, path_entry, path_book):
+                summary["imported"] += 1
+            else:
+                summary["skipped"] += 1
+            if path_entry is not None:
+                shutil.rmtree(path_entry)
+
+        path_root = Path(path_tmp).resolve()
+        for member in members:
+            name = PurePosixPath(member.name)
+            parts = name.parts
+            if name.is_absolute() or ".." in parts or not _HASHKEY.fullmatch(parts[0]):
+                raise ValueError(
+                    f"Unsafe file in execution cache archive: {member.name!r}"
+                )
+            if not member.isfile() or len(parts) < 2:
+                continue
+            if parts[0] != hashkey:
+                if hashkey is not None:
+                    finish_entry()
+                hashkey = parts[0]
+                path_entry = None
+                if not _is_cached(cache, hashkey):
+                    path_entry = Path(path_tmp).joinpath(hashkey)
+            if path_entry is None:
+                continue
+            path_file = path_entry.joinpath(*parts[1:])
+            if path_root not in path_file.resolve().parents:
+                raise ValueError(
+                    f"Unsafe file in execution cache archive: {member.name!r}"
+                )
+            path_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(path_file, "wb") as ff:
+                shutil.copyfileobj(tar.extractfile(member), ff)
+        if hashkey is not None:
+            finish_entry()
+    return summary
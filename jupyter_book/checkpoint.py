@@ -0,0 +1,117 @@
+"""Save the environment while reading, so that interrupted builds can be resumed."""
+import os
+import pickle
+from time import perf_counter
+from pathlib import Path
+from sphinx.application import ENV_PICKLE_FILENAME
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+# The checkpoint file, in the doctrees folder
+CHECKPOINT_FILENAME = "environment.checkpoint.pickle"
+
+
+def init_checkpoints(app, env, docnames):
+    """Start keeping track of which documents have been read."""
+    if not app.config["checkpoint_interval"]:
+        return
+    app._jb_checkpoint = {
+        "pid": os.getpid(),
+        "pending": set(docnames),
+        "current": None,
+        "saved": perf_counter(),
+    }
+
+
+def _checkpoint_state(app):
+    state = getattr(app, "_jb_checkpoint", None)
+    # Parallel read workers are forked, and only the main process saves checkpoints
+    if state is None or state["pid"] != os.getpid():
+        return None
+    return state
+
+
+def _maybe_save(app, state):
+    if perf_counter() - state["saved"] >= app.config["checkpoint_interval"]:
+        save_checkpoint(app)
+
+
+def checkpoint_doc_read(app, docname, source):
+    """Note that the previous document has been read, since this one has started.
+
+    A document is only complete once its doctree is written, which happens after
+    the `doctree-read` event, so the document that is being read stays pending.
+    """
+    state = _checkpoint_state(app)
+    if state is None:
+        return
+    if state["current"] is not None:
+        state["pending"].discard(state["current"])
+    state["current"] = docname
+    _maybe_save(app, state)
+
+
+def checkpoint_docs_merged(app, env, docnames, other):
+    """Note that documents read by a parallel worker are complete."""
+    state = _checkpoint_state(app)
+    if state is None:
+        return
+    state["pending"].difference_update(docnames)
+    _maybe_save(app, state)
+
+
+def save_checkpoint(app):
+    """Save the environment, with every document that isn't fully read removed.
+
+    The removed documents will be read again when the build is resumed.
+    """
+    state = _checkpoint_state(app)
+    if state is None:
+        return
+    env = app.env
+    path_checkpoint = Path(app.doctreedir).joinpath(CHECKPOINT_FILENAME)
+    pending = {
+        docname: env.all_docs.pop(docname)
+        for docname in state["pending"]
+        if docname in env.all_docs
+    }
+    # The data of the document that is being read can't always be pickled
+    temp_data, ref_context = env.temp_data, env.ref_context
+    env.temp_data, env.ref_context = {}, {}
+    try:
+        path_tmp = path_checkpoint.with_suffix(f".{os.getpid()}.tmp")
+        with open(path_tmp, "wb") as ff:
+            pickle.dump(env, ff, pickle.HIGHEST_PROTOCOL)
+        os.replace(path_tmp, path_checkpoint)
+    finally:
+        env.all_docs.update(pending)
+        env.temp_data, env.ref_context = temp_data, ref_context
+    state["saved"] = perf_counter()
+    n_done = len(env.all_docs) - len(pending)
+    logger.verbose(f"Saved a checkpoint of {n_done} read documents")
+
+
+def finish_checkpoints(app, env):
+    """Remove the checkpoint once reading is done, since Sphinx saves the env."""
+    if _checkpoint_state(app) is None:
+        return
+    app._jb_checkpoint = None
+    path_checkpoint = Path(app.doctreedir).joinpath(CHECKPOINT_FILENAME)
+    if path_checkpoint.exists():
+        path_checkpoint.unlink()
+
+
+def resume_from_checkpoint(doctreedir):
+    """Use the last checkpoint as the environment of the next build, if there is one.
+
+    Returns
+    -------
+    resumed : bool
+        Whether a checkpoint was found.
+    """
+    path_checkpoint = Path(doctreedir).joinpath(CHECKPOINT_FILENAME)
+    if not path_checkpoint.exists():
+        return False
+    os.replace(path_checkpoint, Path(doctreedir).joinpath(ENV_PICKLE_FILENAME))
+    return True
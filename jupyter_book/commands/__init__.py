@@ -13,7 +13,20 @@ import yaml
 from ..sphinx import build_sphinx
 from ..toc import build_toc
 from ..pdf import html_to_pdf
-from ..utils import _message_box, _error, init_myst_file
+from ..mathrender import MATH_CACHE_FOLDER
+from ..highlight import HIGHLIGHT_CACHE_FOLDER
+from ..bibcache import BIBTEX_CACHE_FOLDER
+from ..jupytextcache import JUPYTEXT_CACHE_FOLDER
+from ..draft import DRAFT_FOLDER
+from ..images import IMAGE_CACHE_FOLDER
+from ..assets import ASSET_STORE_FOLDER
+from ..cachebundle import find_cache_path, export_cache, import_cache
+from ..memory import parse_memory
+from ..metrics import BuildMetrics
+from ..publish import is_rsync_target, publish_book
+from ..shard import parse_shard
+from ..targets import load_targets, build_targets
+from ..utils import _message_box, _error, init_myst_files, clear_outputs
 
 
 @click.group()
@@ -24,6 +37,17 @@ def main():
 
 BUILDER_OPTIONS = ["html", "pdfhtml", "latex", "pdflatex"]
 
+# Folders in `_build` that are kept by `jupyter-book clean`
+CACHE_FOLDERS = [
+    ".jupyter_cache",
+    MATH_CACHE_FOLDER,
+    HIGHLIGHT_CACHE_FOLDER,
+    BIBTEX_CACHE_FOLDER,
+    JUPYTEXT_CACHE_FOLDER,
+    IMAGE_CACHE_FOLDER,
+    ASSET_STORE_FOLDER,
+]
+
 
 @main.command()
 @click.argument("path-book")
@@ -36,8 +60,128 @@ BUILDER_OPTIONS = ["html", "pdfhtml", "latex", "pdflatex"]
     default="html",
     help="Which builder to use. Must be one of {BUILDER_OPTIONS}",
 )
-def build(path_book, path_output, config, toc, warningiserror, builder):
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Show which pages would be re-read and why, without building.",
+)
+@click.option(
+    "--metrics-file",
+    multiple=True,
+    help="Write build metrics to this file, as JSON or as Prometheus text if it "
+    "ends in `.prom`. Can be given more than once.",
+)
+@click.option(
+    "--shard",
+    default=None,
+    help="Only read the chapters of shard i of N, given as `i/N`. "
+    "Combine the shards with `jupyter-book merge`.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue reading from where an interrupted build stopped.",
+)
+@click.option(
+    "--path-cache",
+    default=None,
+    help="Keep build caches in this folder instead of `_build`, e.g. to share "
+    "them between books.",
+)
+@click.option(
+    "--draft",
+    is_flag=True,
+    help="Build quickly while writing: no execution, highlighting or search, "
+    "into `_build/draft/`.",
+)
+@click.option(
+    "--only",
+    default=None,
+    help="Only build this file of the Table of Contents and the pages under it, "
+    "re-using the last build for the rest of the book.",
+)
+@click.option(
+    "--page-cache",
+    default=None,
+    help="Restore pages that another build has read and written from this folder, "
+    "and store the pages this build makes in it, e.g. to share them between CI/CD "
+    "runners.",
+)
+@click.option(
+    "--max-memory",
+    default=None,
+    help="Execute notebooks in parallel, with as many workers as fit in this much "
+    "memory, e.g. `12G`. Uses the memory each page needed in earlier builds.",
+)
+@click.option(
+    "--profile-memory",
+    is_flag=True,
+    help="Trace the memory that each page, step and part of the build uses, and "
+    "write a ranked report to `_build/memory_profile.txt`. Makes the build slower.",
+)
+def build(
+    path_book,
+    path_output,
+    config,
+    toc,
+    warningiserror,
+    builder,
+    plan,
+    metrics_file,
+    shard,
+    resume,
+    path_cache,
+    draft,
+    only,
+    page_cache,
+    max_memory,
+    profile_memory,
+):
     """Convert your book's content to HTML or a PDF."""
+    build_book(
+        path_book,
+        path_output=path_output,
+        config=config,
+        toc=toc,
+        warningiserror=warningiserror,
+        builder=builder,
+        plan=plan,
+        metrics_file=metrics_file,
+        shard=shard,
+        resume=resume,
+        path_cache=path_cache,
+        draft=draft,
+        only=only,
+        page_cache=page_cache,
+        max_memory=max_memory,
+        profile_memory=profile_memory,
+    )
+
+
+def build_book(
+    path_book,
+    path_output=None,
+    config=None,
+    toc=None,
+    warningiserror=False,
+    builder="html",
+    plan=False,
+    metrics_file=(),
+    shard=None,
+    resume=False,
+    path_cache=None,
+    draft=False,
+    only=None,
+    page_cache=None,
+    max_memory=None,
+    profile_memory=False,
+    merge_from=(),
+):
+    """Build a book, for `jupyter-book build` and `jupyter-book merge`.
+
+    `merge_from` are the `_build` folders of shards to combine, instead of
+    reading the book's pages.
+    """
     # Paths for our notebooks
     PATH_BOOK = Path(path_book).absolute()
     if not PATH_BOOK.is_dir():
@@ -54,6 +198,12 @@ def build(path_book, path_output, config, toc, warningiserror, builder):
         allowed_keys = tuple(builder_dict.keys())
         _error(f"Value for --builder must be one of {allowed_keys}. Got '{builder}'")
     sphinx_builder = builder_dict[builder]
+    if draft and builder != "html":
+        _error(f"Draft builds can only build HTML. Got --builder {builder}")
+    if only is not None and builder != "html":
+        _error(f"--only can only build HTML. Got --builder {builder}")
+    if only is not None and shard is not None:
+        _error("--only can't be combined with --shard.")
 
     # Table of contents
     if toc is None:
@@ -66,17 +216,44 @@ def build(path_book, path_output, config, toc, warningiserror, builder):
             )
     book_config["globaltoc_path"] = str(toc)
 
+    # Sharded builds
+    if shard is not None:
+        try:
+            parse_shard(shard)
+        except ValueError as err:
+            _error(str(err))
+        book_config["shard"] = shard
+    if only is not None:
+        book_config["only"] = only
+    if merge_from:
+        book_config["merge_shards"] = [str(Path(ii).absolute()) for ii in merge_from]
+    if page_cache is not None:
+        book_config["page_cache"] = page_cache
+    if max_memory is not None:
+        try:
+            book_config["max_memory"] = parse_memory(max_memory)
+        except ValueError as err:
+            _error(str(err))
+    if profile_memory:
+        book_config["profile_memory"] = True
+    if path_cache is not None:
+        book_config["cache_path"] = str(Path(path_cache).absolute())
+
     # Configuration file
     if config is None:
         if PATH_BOOK.joinpath("_config.yml").exists():
             config = PATH_BOOK.joinpath("_config.yml")
+    else:
+        config = Path(config)
 
     extra_extensions = None
+    prerender_math = False
     if config is not None:
         book_config["yaml_config_path"] = str(config)
         config_yaml = yaml.safe_load(config.read_text())
         # Pop the extra extensions since we need to append, not replace
         extra_extensions = config_yaml.pop("sphinx", {}).get("extra_extensions")
+        prerender_math = (config_yaml.get("html") or {}).get("prerender_math", False)
         # Support Top Level config Passthrough
         # https://www.sphinx-doc.org/en/latest/usage/configuration.html#project-information
         sphinx_options = ["project", "author", "copyright"]
@@ -104,11 +281,22 @@ def build(path_book, path_output, config, toc, warningiserror, builder):
 
     BUILD_PATH = path_output if path_output is not None else PATH_BOOK
     BUILD_PATH = Path(BUILD_PATH).joinpath("_build")
-    if builder in ["html", "pdfhtml"]:
+    if draft:
+        # Draft builds have their own doctrees, so they don't invalidate full builds
+        OUTPUT_PATH = BUILD_PATH.joinpath(DRAFT_FOLDER, "html")
+    elif builder in ["html", "pdfhtml"]:
         OUTPUT_PATH = BUILD_PATH.joinpath("html")
     elif builder in ["latex", "pdflatex"]:
         OUTPUT_PATH = BUILD_PATH.joinpath("latex")
 
+    metrics = BuildMetrics() if metrics_file and not plan else None
+
+    def write_metrics(status):
+        if metrics is not None:
+            metrics.status = status
+            for path_metrics in metrics_file:
+                metrics.write(path_metrics)
+
     # Now call the Sphinx commands to build
     exc = build_sphinx(
         PATH_BOOK,
@@ -119,13 +307,40 @@ def build(path_book, path_output, config, toc, warningiserror, builder):
         builder=sphinx_builder,
         warningiserror=warningiserror,
         extra_extensions=extra_extensions,
+        quiet=plan,
+        plan=plan,
+        metrics=metrics,
+        force_all=bool(merge_from),
+        freshenv=bool(merge_from),
+        resume=resume,
+        draft=draft,
+        jobs=os.cpu_count() if max_memory is not None else None,
     )
 
     if exc:
+        write_metrics("failed")
         _error(
             "There was an error in building your book. "
             "Look above for the error message."
         )
+    elif plan:
+        return
+    elif shard:
+        write_metrics("succeeded")
+        path_build_rel = Path(op.relpath(BUILD_PATH, Path()))
+        _message_box(
+            f"""\
+        Finished reading shard {shard} of your book.
+
+        To combine the shards into one book, collect the `_build` folders of all
+        shards and run:
+
+            jupyter-book merge {path_book} <shard _build folders>
+
+        This shard's `_build` folder is:
+            {path_build_rel}{os.sep}\
+        """
+        )
     else:
         # Builder-specific options
         if builder == "html":
@@ -151,7 +366,15 @@ def build(path_book, path_output, config, toc, warningiserror, builder):
             path_pdf_output = OUTPUT_PATH.parent.joinpath("pdf")
             path_pdf_output.mkdir(exist_ok=True)
             path_pdf_output = path_pdf_output.joinpath("book.pdf")
-            html_to_pdf(OUTPUT_PATH.joinpath("index.html"), path_pdf_output)
+            if metrics is not None:
+                metrics.start("pdf")
+            html_to_pdf(
+                OUTPUT_PATH.joinpath("index.html"),
+                path_pdf_output,
+                wait_for_mathjax=not prerender_math,
+            )
+            if metrics is not None:
+                metrics.stop("pdf")
             path_pdf_output_rel = Path(op.relpath(path_pdf_output, Path()))
             _message_box(
                 f"""\
@@ -169,8 +392,12 @@ def build(path_book, path_output, config, toc, warningiserror, builder):
             else:
                 makecmd = os.environ.get("MAKE", "make")
             try:
+                if metrics is not None:
+                    metrics.start("pdf")
                 with cd(OUTPUT_PATH):
                     subprocess.run([makecmd, "all-pdf"])
+                if metrics is not None:
+                    metrics.stop("pdf")
                 _message_box(
                     f"""\
                 A PDF of your book can be found at:
@@ -179,8 +406,83 @@ def build(path_book, path_output, config, toc, warningiserror, builder):
                 """
                 )
             except OSError:
+                write_metrics("failed")
                 _error("Error: Failed to run: %s" % makecmd)
                 return 1
+        write_metrics("succeeded")
+
+
+@main.command()
+@click.argument("path-book")
+@click.argument("path-shards", nargs=-1, required=True)
+@click.option("--path-output", default=None, help="Path to the output artifacts")
+@click.option("--config", default=None, help="Path to the YAML configuration file")
+@click.option("--toc", default=None, help="Path to the Table of Contents YAML file")
+@click.option("-W", "--warningiserror", is_flag=True, help="Error on warnings.")
+@click.option(
+    "--metrics-file",
+    multiple=True,
+    help="Write build metrics to this file, as JSON or as Prometheus text if it "
+    "ends in `.prom`. Can be given more than once.",
+)
+def merge(
+    path_book, path_shards, path_output, config, toc, warningiserror, metrics_file
+):
+    """Combine shards built with `build --shard` into one HTML book.
+
+    PATH_SHARDS are the `_build` folders (or output folders) of each shard.
+    """
+    build_book(
+        path_book,
+        path_output=path_output,
+        config=config,
+        toc=toc,
+        warningiserror=warningiserror,
+        metrics_file=metrics_file,
+        merge_from=path_shards,
+    )
+
+
+@main.command("build-targets")
+@click.argument("path-targets")
+@click.option(
+    "--jobs",
+    default=None,
+    type=int,
+    help="The number of targets to build at once. Defaults to the number of CPUs.",
+)
+@click.option("-W", "--warningiserror", is_flag=True, help="Error on warnings.")
+def build_targets_(path_targets, jobs, warningiserror):
+    """Build several versions or languages of a book, sharing their caches.
+
+    PATH_TARGETS is a YAML file that lists the books (or configurations of a
+    book) to build.
+    """
+    try:
+        targets, path_cache, jobs_targets = load_targets(path_targets)
+    except (OSError, ValueError, yaml.YAMLError) as err:
+        _error(str(err))
+
+    def report(target, returncode, seconds, path_log):
+        status = "failed" if returncode else "succeeded"
+        print(f"{target['name']}: {status} in {seconds:.1f}s (log: {path_log})")
+
+    extra_args = ["-W"] if warningiserror else []
+    failed = build_targets(
+        targets, path_cache, jobs or jobs_targets, extra_args, callback=report
+    )
+    if failed:
+        _error(
+            f"{len(failed)} of {len(targets)} targets failed to build: "
+            f"{', '.join(failed)}\n\nLook at their logs for the error messages."
+        )
+    _message_box(
+        f"Finished building {len(targets)} targets. Their output is in:\n\n"
+        + "\n".join(
+            f"    {target['name']}: {target['path_output'].joinpath('_build')}"
+            for target in targets
+        )
+    )
 
 
 @main.command()
@@ -284,7 +586,7 @@ def toc(path, filename_split_char, skip_text, output_folder):
 @click.argument("path-book")
 @click.option("-a", "--all", "all_", is_flag=True, help="Remove build directory.")
 def clean(path_book, all_):
-    """Empty build directory except jupyter_cache subdirectory."""
+    """Empty build directory except cache subdirectories."""
 
     PATH_OUTPUT = Path(path_book).absolute()
     if not PATH_OUTPUT.is_dir():
@@ -299,19 +601,145 @@ def clean(path_book, all_):
         sh.rmtree(build_path)
         _message_box(f"Your _build directory has been removed")
     else:
-        # Empty _build except .jupyter_cache
+        # Empty _build except cache folders
         to_remove = [
             dd
             for dd in build_path.iterdir()
-            if dd.is_dir() and dd.name != ".jupyter_cache"
+            if dd.is_dir() and dd.name not in CACHE_FOLDERS
         ]
         for dd in to_remove:
             sh.rmtree(build_path.joinpath(dd.name))
+        cache_folders = ", ".join(CACHE_FOLDERS)
         _message_box(
-            f"Your _build directory has been emptied except for .jupyter_cache"
+            f"Your _build directory has been emptied except for {cache_folders}"
         )
 
 
+@main.command()
+@click.argument("path-book")
+@click.option(
+    "--to",
+    "target",
+    required=True,
+    help="The folder, or rsync destination like `host:path`, to publish to",
+)
+@click.option("--path-output", default=None, help="Path to the output artifacts")
+@click.option(
+    "--jobs",
+    default=None,
+    type=int,
+    help="The number of files to copy at once.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Only list the files that would be published."
+)
+def publish(path_book, target, path_output, jobs, dry_run):
+    """Copy the HTML of your book to where it is hosted, if it has changed."""
+    PATH_BOOK = Path(path_book).absolute()
+    if not PATH_BOOK.is_dir():
+        _error(f"Path to book isn't a directory: {PATH_BOOK}")
+    BUILD_PATH = path_output if path_output is not None else PATH_BOOK
+    OUTPUT_PATH = Path(BUILD_PATH).absolute().joinpath("_build", "html")
+    if not is_rsync_target(target) and Path(target).absolute() == OUTPUT_PATH:
+        _error("You can't publish your book to its own build folder.")
+
+    try:
+        changed, stale = publish_book(OUTPUT_PATH, target, jobs, dry_run)
+    except (FileNotFoundError, RuntimeError) as err:
+        _error(str(err))
+    if dry_run:
+        for name in changed:
+            print(f"copy: {name}")
+        for name in stale:
+            print(f"delete: {name}")
+        return
+    _message_box(
+        f"Published your book to {target}\n\n"
+        f"{len(changed)} files copied, {len(stale)} files deleted."
+    )
+
+
+@main.group()
+def cache():
+    """Share the execution cache of a book, e.g. between CI/CD runs."""
+    pass
+
+
+@cache.command("export")
+@click.argument("path-book")
+@click.argument("path-archive")
+@click.option("--path-output", default=None, help="Path to the output artifacts")
+@click.option(
+    "--path-cache", default=None, help="The shared cache folder, if the book uses one"
+)
+def export_(path_book, path_archive, path_output, path_cache):
+    """Write the executed notebooks of a book's cache into an archive.
+
+    PATH_ARCHIVE is compressed with gzip, unless it ends in `.bz2` or `.xz`.
+    """
+    path_jupyter_cache = find_cache_path(path_book, path_output, path_cache)
+    if not path_jupyter_cache.is_dir():
+        _error(f"There is no execution cache at {path_jupyter_cache}")
+    n_exported = export_cache(path_jupyter_cache, path_archive, path_book)
+    _message_box(f"Exported {n_exported} notebooks to {path_archive}")
+
+
+@cache.command("import")
+@click.argument("path-book")
+@click.argument("path-archive", type=click.File("rb"))
+@click.option("--path-output", default=None, help="Path to the output artifacts")
+@click.option(
+    "--path-cache", default=None, help="The shared cache folder, if the book uses one"
+)
+@click.option(
+    "--any-environment",
+    is_flag=True,
+    help="Import notebooks even if they were executed with other Python packages.",
+)
+def import_(path_book, path_archive, path_output, path_cache, any_environment):
+    """Add the executed notebooks of an archive to a book's cache.
+
+    Notebooks that are already cached are skipped. PATH_ARCHIVE may be `-` to
+    read the archive from standard input.
+    """
+    path_jupyter_cache = find_cache_path(path_book, path_output, path_cache)
+    try:
+        summary = import_cache(
+            path_jupyter_cache, path_archive, path_book, any_environment
+        )
+    except ValueError as err:
+        _error(str(err))
+    _message_box(
+        f"Imported {summary['imported']} notebooks into {path_jupyter_cache}\n"
+        f"Already cached: {summary['skipped']}"
+    )
+
+
+@main.command("clear-outputs")
+@click.argument("path", nargs=-1, required=True)
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Only list the notebooks that have outputs, and fail if there are any.",
+)
+@click.option(
+    "--jobs",
+    default=None,
+    type=int,
+    help="The number of notebooks to process in parallel. Defaults to the number "
+    "of CPUs.",
+)
+def clear_outputs_(path, check, jobs):
+    """Remove the outputs of notebooks, e.g. before committing them.
+
+    PATH may be one or more notebooks, folders (searched for notebooks)
+    or glob patterns.
+    """
+    summary = clear_outputs(path, jobs=jobs, check=check, verbose=True)
+    if summary["failed"] or (check and summary["cleared"]):
+        sys.exit(1)
+
+
 @main.group()
 def myst():
     """Manipulate MyST markdown files."""
@@ -319,12 +747,22 @@ def myst():
 
 
 @myst.command()
-@click.argument("path", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.argument("path", nargs=-1)
 @click.option(
     "--kernel", help="The name of the Jupyter kernel to attach to this markdown file."
 )
-def init(path, kernel):
+@click.option(
+    "--jobs",
+    default=None,
+    type=int,
+    help="The number of files to convert in parallel. Defaults to the number of CPUs.",
+)
+def init(path, kernel, jobs):
     """Add Jupytext metadata for your markdown file(s), with optional Kernel name.
+
+    PATH may be one or more files, folders (searched for markdown files)
+    or glob patterns.
     """
-    for ipath in path:
-        init_myst_file(ipath, kernel, verbose=True)
+    summary = init_myst_files(path, kernel, jobs=jobs, verbose=True)
+    if summary["failed"]:
+        sys.exit(1)
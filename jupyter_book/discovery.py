@@ -0,0 +1,283 @@
+"""Find the source files of a book with a single pass over its folder."""
+import os
+import re
+import pickle
+import posixpath
+from time import time
+from sphinx.locale import __
+from sphinx.project import EXCLUDE_PATHS, Project
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+# The file (in the doctrees folder) where folder listings are saved between builds
+SNAPSHOT_FILENAME = "discovery.pickle"
+
+# Folders modified this recently (in seconds) may still be changing in the same
+# tick of the file system's clock, so their listings aren't re-used.
+RACY_SECONDS = 2
+
+_glob_chars = re.compile(r"[*?\[]")
+
+
+def _translate_pattern(pattern):
+    """Translate a glob pattern to a regular expression, like Sphinx does.
+
+    Copied from `sphinx.util.matching._translate_pattern` (Sphinx 2.4), which is
+    private, so that paths are excluded exactly as Sphinx's own discovery does:
+    `**` matches across folders, while `*`, `?` and `[!...]` don't match `/`.
+    """
+    ii, n_chars = 0, len(pattern)
+    res = ""
+    while ii < n_chars:
+        char = pattern[ii]
+        ii += 1
+        if char == "*":
+            if ii < n_chars and pattern[ii] == "*":
+                ii += 1
+                res += ".*"
+            else:
+                res += "[^/]*"
+        elif char == "?":
+            res += "[^/]"
+        elif char == "[":
+            jj = ii
+            if jj < n_chars and pattern[jj] == "!":
+                jj += 1
+            if jj < n_chars and pattern[jj] == "]":
+                jj += 1
+            while jj < n_chars and pattern[jj] != "]":
+                jj += 1
+            if jj >= n_chars:
+                res += "\\["
+            else:
+                stuff = pattern[ii:jj].replace("\\", "\\\\")
+                ii = jj + 1
+                if stuff[0] == "!":
+                    stuff = "^/" + stuff[1:]
+                elif stuff[0] == "^":
+                    stuff = "\\" + stuff
+                res += f"[{stuff}]"
+        else:
+            res += re.escape(char)
+    return res + "$"
+
+
+class ExcludeMatcher:
+    """Match paths against many exclude patterns at once.
+
+    Patterns without wildcards (e.g. the files that `jupyter-book page` excludes)
+    are looked up in a set, and the others are compiled into one regular
+    expression, so that checking a path doesn't loop over the patterns. Paths are
+    matched like Sphinx's `exclude_patterns`, relative and with `/` separators.
+    """
+
+    def __init__(self, patterns):
+        self.literals = set()
+        regexes = []
+        for pattern in dict.fromkeys(patterns):
+            if _glob_chars.search(pattern):
+                regexes.append(_translate_pattern(pattern))
+            else:
+                self.literals.add(pattern)
+        self.regex = None
+        if regexes:
+            self.regex = re.compile("|".join(f"(?:{ii})" for ii in regexes))
+
+    def __call__(self, path):
+        if path in self.literals:
+            return True
+        return self.regex is not None and self.regex.match(path) is not None
+
+
+def _scan_folder(path):
+    """The names of the sub-folders and files in a folder."""
+    folders = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                # Follows symlinks, like Sphinx does
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            (folders if is_dir else files).append(entry.name)
+    return folders, files
+
+
+def _load_snapshot(path_snapshot, srcdir):
+    try:
+        with open(path_snapshot, "rb") as ff:
+            snapshot = pickle.load(ff)
+    except Exception:
+        return {}
+    if not isinstance(snapshot, dict) or snapshot.get("srcdir") != srcdir:
+        return {}
+    return snapshot.get("folders", {})
+
+
+def _save_snapshot(path_snapshot, srcdir, folders):
+    path_tmp = f"{path_snapshot}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path_snapshot), exist_ok=True)
+        with open(path_tmp, "wb") as ff:
+            pickle.dump({"srcdir": srcdir, "folders": folders}, ff)
+        os.replace(path_tmp, path_snapshot)
+    except OSError as err:
+        logger.verbose(f"Could not save the source folder snapshot: {err}")
+
+
+def snapshot_files(srcdir, matcher, path_snapshot=None):
+    """List the files in `srcdir` that aren't excluded by `matcher`.
+
+    Each folder is listed with one `os.scandir` call, and excluded folders are
+    never entered. If `path_snapshot` is given, the listings are saved there, and
+    in the next build a folder is only listed again if its modification time has
+    changed, which costs one `stat` per folder instead of one per file.
+
+    Returns
+    -------
+    files : list
+        The paths of the files, relative to `srcdir` with `/` separators.
+    """
+    srcdir = os.path.normpath(os.path.abspath(srcdir))
+    cached = _load_snapshot(path_snapshot, srcdir) if path_snapshot else {}
+    folders = {}
+    files = []
+    n_scanned = 0
+    now = time()
+    to_visit = [""]
+    while to_visit:
+        relfolder = to_visit.pop()
+        path_folder = os.path.join(srcdir, relfolder)
+        try:
+            mtime = os.stat(path_folder).st_mtime
+        except OSError:
+            continue
+        listing = cached.get(relfolder)
+        if listing is None or listing[0] != mtime:
+            try:
+                subfolders, subfiles = _scan_folder(path_folder)
+            except OSError:
+                continue
+            n_scanned += 1
+            if now - mtime < RACY_SECONDS:
+                # Don't trust this listing next time, since the folder may change
+                # again without its modification time changing.
+                mtime = None
+            listing = (mtime, subfolders, subfiles)
+        folders[relfolder] = listing
+
+        _, subfolders, subfiles = listing
+        for name in subfolders:
+            path = posixpath.join(relfolder, name) if relfolder else name
+            if not matcher(path):
+                to_visit.append(path)
+        for name in subfiles:
+            path = posixpath.join(relfolder, name) if relfolder else name
+            if not matcher(path):
+                files.append(path)
+
+    logger.verbose(
+        f"Found {len(files)} source files in {len(folders)} folders "
+        f"({n_scanned} listed again)"
+    )
+    if path_snapshot:
+        _save_snapshot(path_snapshot, srcdir, folders)
+    return sorted(files)
+
+
+class SnapshotProject(Project):
+    """A Sphinx `Project` that finds its documents with `snapshot_files`.
+
+    Like `Project.discover`, documents that can't be read are left out, and a
+    warning lists the files of documents that were found more than once (e.g.
+    `page.md` and `page.ipynb`). All the files that aren't excluded are kept in
+    `files`, for the build's other uses (e.g. finding .bib files).
+    """
+
+    def __init__(self, srcdir, source_suffix, path_snapshot=None):
+        super().__init__(srcdir, source_suffix)
+        self.path_snapshot = path_snapshot
+        self.files = []
+
+    def __getstate__(self):
+        # The environment is pickled with its project, but the files are found
+        # again in each build
+        state = self.__dict__.copy()
+        state["files"] = []
+        return state
+
+    def discover(self, exclude_paths=[]):
+        self.docnames = set()
+        matcher = ExcludeMatcher(list(exclude_paths) + EXCLUDE_PATHS)
+        self.files = snapshot_files(self.srcdir, matcher, self.path_snapshot)
+        found = {}
+        for filename in self.files:
+            docname = self.path2doc(filename)
+            if not docname:
+                continue
+            if docname in found:
+                found[docname].append(filename)
+            elif os.access(os.path.join(self.srcdir, filename), os.R_OK):
+                found[docname] = [filename]
+                self.docnames.add(docname)
+            else:
+                logger.warning(__("document not readable. Ignored."), location=docname)
+        for docname, filenames in sorted(found.items()):
+            if len(filenames) > 1:
+                logger.warning(
+                    __(
+                        'multiple files found for the document "%s": %r\nUse %r for '
+                        "the build."
+                    ),
+                    docname,
+                    sorted(filenames),
+                    self.doc2path(docname),
+                )
+        return self.docnames
+
+
+class ExecutionExcludes(set):
+    """The paths of notebooks that myst-nb shouldn't execute.
+
+    myst-nb adds the files that match `execution_excludepatterns` from the current
+    folder. The paths of documents relative to the book are also matched, in any
+    sub-folder, so that the patterns work wherever the book is built from.
+    """
+
+    def __init__(self, paths=(), srcdir="", patterns=()):
+        super().__init__(paths)
+        self.srcdir = srcdir
+        patterns = list(patterns)
+        self.matcher = ExcludeMatcher(patterns + [f"**/{ii}" for ii in patterns])
+
+    def __contains__(self, path):
+        if super().__contains__(path):
+            return True
+        relpath = os.path.relpath(path, self.srcdir)
+        if relpath.startswith(os.pardir):
+            return False
+        return self.matcher(relpath.replace(os.sep, "/"))
+
+
+def init_discovery(app):
+    """Find the book's documents with `snapshot_files`, and match the patterns of
+    notebooks not to execute against the book's folder.
+
+    This runs after myst-nb has found the notebooks not to execute.
+    """
+    path_snapshot = None
+    if app.config["discovery_cache"]:
+        path_snapshot = os.path.join(app.doctreedir, SNAPSHOT_FILENAME)
+    project = SnapshotProject(
+        app.project.srcdir, app.project.source_suffix, path_snapshot
+    )
+    project.restore(app.project)
+    app.project = app.env.project = project
+
+    patterns = app.config["execution_excludepatterns"] or []
+    if patterns:
+        app.env.excluded_nb_exec_paths = ExecutionExcludes(
+            getattr(app.env, "excluded_nb_exec_paths", ()), app.srcdir, patterns
+        )
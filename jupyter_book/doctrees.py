@@ -0,0 +1,113 @@
+"""Store the doctrees of a build compressed, to make the `.doctrees` folder smaller."""
+import pickle
+from functools import partial
+from os import path
+from sphinx.util import logging
+from sphinx.util.docutils import LoggingReporter
+from sphinx.util.osutil import ensuredir
+
+logger = logging.getLogger(__name__)
+
+# The bytes that compressed doctree files start with, for each compression. Sphinx
+# writes doctrees as plain pickles, which start with b"\x80".
+MAGIC_BYTES = {"zlib": b"JBZL", "lz4": b"JBL4", "zstd": b"JBZS"}
+MAGIC_LENGTH = 4
+
+
+def _codec(compression):
+    """The (compress, decompress) functions of a compression."""
+    if compression == "zlib":
+        import zlib
+
+        return zlib.compress, zlib.decompress
+    try:
+        if compression == "lz4":
+            import lz4.frame
+
+            return lz4.frame.compress, lz4.frame.decompress
+        if compression == "zstd":
+            import zstandard
+
+            return (
+                zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompress,
+            )
+    except ImportError:
+        package = {"lz4": "lz4", "zstd": "zstandard"}[compression]
+        raise ImportError(
+            f"`doctree_compression: {compression}` requires the {package} package. "
+            "Install it with `pip install jupyter-book[compression]`."
+        )
+    raise ValueError(
+        f"`doctree_compression` must be one of {list(MAGIC_BYTES)}, "
+        f"got {compression!r}"
+    )
+
+
+def dump_doctree(doctree, path_doctree, compression=None):
+    """Pickle a doctree to a file, compressed if `compression` is given."""
+    data = pickle.dumps(doctree, pickle.HIGHEST_PROTOCOL)
+    if compression:
+        compress, _ = _codec(compression)
+        data = MAGIC_BYTES[compression] + compress(data)
+    with open(path_doctree, "wb") as ff:
+        ff.write(data)
+
+
+def load_doctree(path_doctree):
+    """Load a doctree from a file, whether it is compressed or not."""
+    with open(path_doctree, "rb") as ff:
+        data = ff.read()
+    for compression, magic in MAGIC_BYTES.items():
+        if data[:MAGIC_LENGTH] == magic:
+            _, decompress = _codec(compression)
+            data = decompress(data[MAGIC_LENGTH:])
+            break
+    return pickle.loads(data)
+
+
+def get_doctree(env, docname):
+    """Read the doctree for a file from the pickle and return it.
+
+    This replaces the build environment's `get_doctree`, to also read compressed
+    doctrees.
+    """
+    doctree = load_doctree(path.join(env.doctreedir, docname + ".doctree"))
+    doctree.settings.env = env
+    doctree.reporter = LoggingReporter(env.doc2path(docname))
+    return doctree
+
+
+def _compressed_write_doctree(builder, compression):
+    """A `Builder.write_doctree` that writes compressed doctrees."""
+
+    def write_doctree(docname, doctree):
+        # make it picklable, like Sphinx does
+        doctree.reporter = None
+        doctree.transformer = None
+        doctree.settings.warning_stream = None
+        doctree.settings.env = None
+        doctree.settings.record_dependencies = None
+
+        path_doctree = path.join(builder.doctreedir, docname + ".doctree")
+        ensuredir(path.dirname(path_doctree))
+        dump_doctree(doctree, path_doctree, compression)
+
+    return write_doctree
+
+
+def init_doctree_storage(app):
+    """Compress doctrees as they are written, if `doctree_compression` is set.
+
+    Doctrees are always read with `load_doctree`, so books can switch between
+    compressed and plain doctrees without rebuilding.
+    """
+    # Only this build's environment is changed. A partial (unlike a closure) can
+    # be pickled with it, and is still bound to it once unpickled
+    app.env.get_doctree = partial(get_doctree, app.env)
+    compression = app.config["doctree_compression"]
+    if not compression:
+        return
+    # Fail early if the compression isn't available
+    _codec(compression)
+    app.builder.write_doctree = _compressed_write_doctree(app.builder, compression)
@@ -0,0 +1,161 @@
+"""A fast profile for draft builds, that skips the slow parts of a full build.
+
+This module is also a Sphinx extension, that draft builds load instead of
+`sphinxcontrib.bibtex`, so that citations don't break pages.
+"""
+import json
+import posixpath
+from docutils import nodes
+from docutils.parsers.rst import Directive, directives
+from sphinx.util.osutil import relative_uri
+
+# The folder (relative to the `_build` folder) that draft builds are written to,
+# with their own doctrees so that the environment of full builds is kept
+DRAFT_FOLDER = "draft"
+
+# Extensions that draft builds don't load, and what they are replaced with
+DRAFT_EXTENSIONS = {
+    "sphinx_togglebutton": None,
+    "sphinx_copybutton": None,
+    "sphinxcontrib.bibtex": "jupyter_book.draft",
+}
+
+# Configuration that draft builds use, whatever the book's configuration says
+DRAFT_CONFIG = {
+    "jupyter_execute_notebooks": "off",
+    "prerender_math": False,
+    "html_math_renderer": "mathjax",
+    "optimize_images": False,
+    "highlight_cache_size": 0,
+    "html_copy_source": False,
+    "html_use_index": False,
+    "doctree_compression": None,
+    "checkpoint_interval": 0,
+}
+
+
+def draft_extensions(extensions):
+    """The extensions of a draft build, from those of a full build."""
+    draft = []
+    for ext in extensions:
+        ext = DRAFT_EXTENSIONS.get(ext, ext)
+        if ext is not None and ext not in draft:
+            draft.append(ext)
+    return draft
+
+
+def init_draft_config(app, config):
+    """Override the book's configuration with `DRAFT_CONFIG`, for draft builds."""
+    if not config["draft"]:
+        return
+    for key, val in DRAFT_CONFIG.items():
+        config[key] = val
+
+
+def init_draft_builder(app):
+    """Skip the search index and syntax highlighting, and resolve the navigation
+    once, for draft builds."""
+    if not app.config["draft"]:
+        return
+    builder = app.builder
+    builder.search = False
+    highlighter = getattr(builder, "highlighter", None)
+    if highlighter is not None:
+        highlight_block = highlighter.highlight_block
+
+        def highlight_plain(source, lang, *args, **kwargs):
+            return highlight_block(source, "none", *args, **kwargs)
+
+        highlighter.highlight_block = highlight_plain
+    builder._jb_navs = {}
+    # Connected now, so that this runs after the theme adds `get_nav_object`
+    app.connect("html-page-context", reuse_navigation)
+
+
+def _absolute_nav(nav, uri_page):
+    """Resolve the URLs of a navigation object, which are relative to a page."""
+    items = []
+    for item in nav:
+        if item is None:
+            # The theme leaves out links to sections, but keeps their place
+            items.append(None)
+            continue
+        target = uri_page
+        if item["url"]:
+            path = posixpath.join(posixpath.dirname(uri_page), item["url"])
+            target = posixpath.normpath(path)
+        children = _absolute_nav(item["children"], uri_page)
+        items.append({"title": item["title"], "target": target, "children": children})
+    return items
+
+
+def _relative_nav(nav, uri_page):
+    """Make a navigation object for a page, from one with resolved URLs."""
+    items = []
+    for item in nav:
+        if item is None:
+            items.append(None)
+            continue
+        children = _relative_nav(item["children"], uri_page)
+        url = relative_uri(uri_page, item["target"])
+        # Pages are active if they are this page, or one of its parents
+        active = not url or any(child and child["active"] for child in children)
+        items.append(
+            {"title": item["title"], "url": url, "active": active, "children": children}
+        )
+    return items
+
+
+def reuse_navigation(app, pagename, templatename, context, doctree):
+    """Resolve the book's navigation once, rather than for every page.
+
+    The full navigation (as the theme's `get_nav_object(collapse=False)` returns
+    it) is the same on every page, apart from its links and active items. Sphinx
+    resolves the whole table of contents for every page, which takes longer than
+    writing the page itself in large books.
+    """
+    get_nav_object = context.get("get_nav_object")
+    if get_nav_object is None:
+        return
+    navs = app.builder._jb_navs
+    uri_page = app.builder.get_target_uri(pagename)
+
+    def get_nav_object_reused(maxdepth=None, collapse=True, **kwargs):
+        if collapse:
+            return get_nav_object(maxdepth=maxdepth, collapse=collapse, **kwargs)
+        key = json.dumps([maxdepth, kwargs], sort_keys=True)
+        if key not in navs:
+            nav = get_nav_object(maxdepth=maxdepth, collapse=collapse, **kwargs)
+            navs[key] = _absolute_nav(nav, uri_page)
+        return _relative_nav(navs[key], uri_page)
+
+    context["get_nav_object"] = get_nav_object_reused
+
+
+def cite_role(name, rawtext, text, lineno, inliner, options={}, content=[]):
+    """Show citations as their keys, e.g. `[author2020]`."""
+    return [nodes.literal(rawtext, f"[{text}]")], []
+
+
+# The options of the `bibliography` directive of `sphinxcontrib.bibtex`
+_BIBLIOGRAPHY_OPTIONS = (
+    "style list enumtype start labelprefix keyprefix all cited notcited filter encoding"
+).split()
+
+
+class BibliographyDirective(Directive):
+    """Leave out bibliographies, since citations aren't resolved."""
+
+    required_arguments = 1
+    final_argument_whitespace = True
+    has_content = True
+    option_spec = {name: directives.unchanged for name in _BIBLIOGRAPHY_OPTIONS}
+
+    def run(self):
+        return []
+
+
+def setup(app):
+    app.add_role("cite", cite_role)
+    app.add_directive("bibliography", BibliographyDirective)
+    return {"parallel_read_safe": True, "parallel_write_safe": True}
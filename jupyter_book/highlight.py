@@ -0,0 +1,168 @@
+"""A persistent cache of highlighted code blocks, shared across builds."""
+import os
+import json
+from hashlib import sha1
+from logging import WARNING
+from pathlib import Path
+import pygments
+from sphinx import highlighting
+from sphinx.util import logging
+from .utils import ProcessStats, cache_folder
+
+logger = logging.getLogger(__name__)
+
+# The folder (relative to the `_build` folder) where highlighted code is stored
+HIGHLIGHT_CACHE_FOLDER = ".highlight_cache"
+
+# The folder (relative to the doctrees folder) where each process saves its counts
+STATS_FOLDER = "highlight_stats"
+
+
+class HighlightCache(ProcessStats):
+    """Wrap a Sphinx `PygmentsBridge` so that highlighted code is cached on disk.
+
+    Each highlighted block is stored in its own file, named by a hash of the code,
+    lexer, style and options. Files are written atomically, so this is safe to use
+    with parallel writes. Blocks that raise a highlighting warning are not cached,
+    so that the warning is shown again on the next build.
+
+    Hit counts are saved in `path_stats`, which belongs to one build, since the
+    cache itself may be shared by builds that run at the same time.
+    """
+
+    def __init__(self, path, highlighter, path_stats):
+        super().__init__(path_stats)
+        self.path = Path(path)
+        self.highlighter = highlighter
+        self._highlight_block = highlighter.highlight_block
+
+    def _reset(self):
+        self.hits = 0
+        self.misses = 0
+
+    def _stats(self):
+        if self.hits or self.misses:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def key(self, source, lang, opts, force, kwargs):
+        style = self.highlighter.formatter_args.get("style")
+        style = getattr(style, "__name__", str(style))
+        parts = [
+            sha1(source.encode()).hexdigest(),
+            str(lang),
+            json.dumps(opts or {}, sort_keys=True, default=str),
+            str(force),
+            style,
+            self.highlighter.dest,
+            str(self.highlighter.trim_doctest_flags),
+            json.dumps(kwargs, sort_keys=True, default=str),
+            pygments.__version__,
+        ]
+        return sha1("\n".join(parts).encode()).hexdigest()
+
+    def highlight_block(self, source, lang, opts=None, force=False, **kwargs):
+        if not isinstance(source, str):
+            source = source.decode()
+        self._check_process()
+        location = kwargs.pop("location", None)
+        key = self.key(source, lang, opts, force, kwargs)
+        path_block = self.path.joinpath(key[:2], key)
+        try:
+            hlsource = path_block.read_text(encoding="utf-8")
+            os.utime(path_block)
+            self.hits += 1
+            return hlsource
+        except OSError:
+            pass
+
+        self.misses += 1
+        # Lexing errors are logged as warnings by `sphinx.highlighting`
+        warnings = []
+
+        def count_warnings(record):
+            if record.levelno >= WARNING:
+                warnings.append(record)
+            return True
+
+        highlighting.logger.logger.addFilter(count_warnings)
+        try:
+            hlsource = self._highlight_block(
+                source, lang, opts=opts, force=force, location=location, **kwargs
+            )
+        finally:
+            highlighting.logger.logger.removeFilter(count_warnings)
+        if not warnings:
+            path_block.parent.mkdir(exist_ok=True)
+            # Write a temporary file first so parallel writers never see partial files
+            path_tmp = path_block.with_name(f"{key}.{os.getpid()}.tmp")
+            path_tmp.write_text(hlsource, encoding="utf-8")
+            os.replace(path_tmp, path_block)
+        return hlsource
+
+    def read_stats(self):
+        """Combine and remove the hit counts of all processes."""
+        hits = misses = 0
+        for stats in self.iter_stats():
+            hits += stats["hits"]
+            misses += stats["misses"]
+        return hits, misses
+
+    def prune(self, max_size):
+        """Remove the least recently used blocks until the cache is under max_size."""
+        entries = []
+        total = 0
+        for folder in self.path.iterdir():
+            if not folder.is_dir():
+                continue
+            for path in folder.iterdir():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= max_size:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            if total <= max_size:
+                break
+        return removed
+
+
+def init_highlight_cache(app):
+    """Wrap the builder's highlighter with a cache, if it has one."""
+    max_size = app.config["highlight_cache_size"]
+    highlighter = getattr(app.builder, "highlighter", None)
+    if not max_size or highlighter is None:
+        return
+
+    path_cache = cache_folder(app, HIGHLIGHT_CACHE_FOLDER)
+    path_cache.mkdir(parents=True, exist_ok=True)
+    cache = HighlightCache(path_cache, highlighter, Path(app.doctreedir, STATS_FOLDER))
+    # Remove counts that an earlier, failed, build left behind
+    cache.read_stats()
+    highlighter.highlight_block = cache.highlight_block
+    app.builder._jb_highlight_cache = cache
+
+
+def finish_highlight_cache(app, exc):
+    """Report the cache hit rate and keep the cache under its size limit."""
+    cache = getattr(app.builder, "_jb_highlight_cache", None)
+    if cache is None or exc is not None:
+        return
+    cache.write_stats()
+    hits, misses = cache.read_stats()
+    if hits + misses:
+        rate = 100 * hits / (hits + misses)
+        logger.info(
+            f"Highlighted code cache: {hits} hits, {misses} misses "
+            f"({rate:.1f}% hit rate)"
+        )
+    cache.prune(app.config["highlight_cache_size"] * 1024 * 1024)
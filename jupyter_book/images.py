@@ -0,0 +1,348 @@
+"""Optimize the images of a book as they are copied into the output folder."""
+import os
+import re
+import json
+import shutil
+import posixpath
+from hashlib import sha256
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from sphinx.util import logging
+from .assets import copy_file
+from .utils import cache_folder
+
+logger = logging.getLogger(__name__)
+
+# The folder (relative to the `_build` folder) where optimized images are stored
+IMAGE_CACHE_FOLDER = ".image_cache"
+
+# Bump this when the way images are optimized changes, to invalidate the cache
+IMAGE_CACHE_VERSION = "1"
+
+# The image formats that are optimized, by file extension. Other images are copied.
+IMAGE_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+
+# The builders whose images are optimized
+IMAGE_BUILDERS = ["html", "dirhtml", "singlehtml", "latex"]
+
+
+def _variant_name(name, width):
+    """The file name of an image resized to `width` pixels."""
+    root, ext = posixpath.splitext(name)
+    return f"{root}-{width}w{ext}"
+
+
+def _resize(img, width):
+    from PIL import Image
+
+    height = max(1, round(img.height * width / img.width))
+    return img.resize((width, height), Image.LANCZOS)
+
+
+def _save(img, path, image_format, quality=None, keep=False):
+    """Save an image, compressed as much as `quality` (1-100, or None) allows.
+
+    Without a quality, PNGs are compressed losslessly, and JPEGs keep their
+    original quality if `keep` is True.
+    """
+    from PIL import Image
+
+    if image_format == "PNG":
+        if quality and quality < 100 and img.mode in ("RGB", "RGBA"):
+            img = img.quantize(256, method=Image.FASTOCTREE)
+        img.save(path, "PNG", optimize=True)
+    else:
+        if keep and not quality:
+            quality = "keep"
+        img.save(path, "JPEG", quality=quality or 90, optimize=True, progressive=True)
+
+
+def optimize_image(path_src, path_out, quality=None, widths=(), max_width=None):
+    """Optimize an image, and save it and its variants into the folder `path_out`.
+
+    The image is saved as `image.<ext>`, downscaled to `max_width` pixels if it is
+    wider. A variant `image-<width>w.<ext>` is saved for each of `widths` that is
+    smaller than the image, if its file is smaller too. The original is kept if its
+    file is smaller than the result.
+
+    Returns
+    -------
+    info : dict
+        The `width` of the image, and the widths of its `variants`.
+    """
+    from PIL import Image
+
+    path_src = Path(path_src)
+    path_out = Path(path_out)
+    path_out.mkdir(parents=True, exist_ok=True)
+    ext = path_src.suffix.lower()
+    image_format = IMAGE_FORMATS[ext]
+    path_image = path_out.joinpath("image" + ext)
+
+    with Image.open(path_src) as img:
+        img.load()
+        resized = img
+        if max_width and img.width > max_width:
+            resized = _resize(img, max_width)
+        _save(resized, path_image, image_format, quality, keep=resized is img)
+    if path_image.stat().st_size >= path_src.stat().st_size:
+        shutil.copyfile(path_src, path_image)
+        resized = img
+
+    variants = []
+    for width in sorted(set(widths or [])):
+        if width < resized.width:
+            path_variant = path_out.joinpath(_variant_name(path_image.name, width))
+            _save(_resize(resized, width), path_variant, image_format, quality)
+            # Resampling can add colors that make PNGs larger, so only keep
+            # variants that are cheaper to download than the full image.
+            if path_variant.stat().st_size < path_image.stat().st_size:
+                variants.append(width)
+            else:
+                path_variant.unlink()
+
+    info = {"width": resized.width, "variants": variants}
+    path_out.joinpath("info.json").write_text(json.dumps(info))
+    return info
+
+
+def _optimize_cached(path_src, path_cached, settings):
+    """Optimize an image into a temporary folder, then move it into the cache."""
+    path_tmp = f"{path_cached}.{os.getpid()}.tmp"
+    try:
+        optimize_image(path_src, path_tmp, **settings)
+        os.replace(path_tmp, path_cached)
+    except OSError:
+        # Another process has cached the same image in the meantime
+        if not Path(path_cached).is_dir():
+            raise
+    finally:
+        shutil.rmtree(path_tmp, ignore_errors=True)
+
+
+class ImageOptimizer:
+    """Optimize images into a cache folder, keyed by their content and settings.
+
+    Images that aren't in the cache are optimized in a pool of processes, so that
+    unchanged images are never processed again. The cache folder of each image
+    is remembered, so images are only hashed once per build.
+    """
+
+    def __init__(self, path_cache, quality=None, widths=(), max_width=None):
+        self.path_cache = Path(path_cache)
+        self.settings = {"quality": quality, "widths": widths, "max_width": max_width}
+        self.folders = {}
+        self.infos = {}
+
+    def key(self, path_src):
+        from PIL import __version__ as pil_version
+
+        key = sha256(Path(path_src).read_bytes())
+        key.update(json.dumps(self.settings, sort_keys=True).encode())
+        key.update(f"{pil_version}\n{IMAGE_CACHE_VERSION}".encode())
+        return key.hexdigest()
+
+    def optimize(self, paths, parallel=None):
+        """Optimize images that aren't cached, and return the cache folder of each.
+
+        Images that can't be optimized are left out of the results, with a warning.
+        """
+        missing = {}
+        for path_src in paths:
+            if path_src in self.folders:
+                continue
+            folder = self.path_cache.joinpath(self.key(path_src))
+            self.folders[path_src] = folder
+            if not folder.joinpath("info.json").exists():
+                missing[path_src] = folder
+        if missing:
+            logger.info(f"Optimizing {len(missing)} images...")
+        workers = min(len(missing), parallel or os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = {
+                    path_src: pool.submit(
+                        _optimize_cached, str(path_src), str(folder), self.settings
+                    )
+                    for path_src, folder in missing.items()
+                }
+            errors = {path: future.exception() for path, future in futures.items()}
+        else:
+            errors = {}
+            for path_src, folder in missing.items():
+                try:
+                    _optimize_cached(str(path_src), str(folder), self.settings)
+                    errors[path_src] = None
+                except Exception as err:
+                    errors[path_src] = err
+        for path_src, err in errors.items():
+            if err is not None:
+                logger.warning(f"Could not optimize image {path_src}: {err}")
+                self.folders[path_src] = None
+        return {
+            path_src: self.folders[path_src]
+            for path_src in paths
+            if self.folders[path_src] is not None
+        }
+
+    def info(self, path_src):
+        """The `width` and `variants` of an optimized image, or None."""
+        folder = self.folders.get(path_src)
+        if folder is None:
+            return None
+        if path_src not in self.infos:
+            self.infos[path_src] = json.loads(folder.joinpath("info.json").read_text())
+        return self.infos[path_src]
+
+
+def _image_widths(app):
+    """The widths of the responsive variants of images, for HTML builders."""
+    if app.builder.format != "html":
+        return []
+    return app.config["image_widths"] or []
+
+
+def _optimizable(builder, images):
+    """The full paths of the images that can be optimized, and their names."""
+    return {
+        Path(os.path.normpath(os.path.join(builder.srcdir, src))): src
+        for src in images
+        if posixpath.splitext(src)[1].lower() in IMAGE_FORMATS
+    }
+
+
+def _notebook_output_images(app, docnames):
+    """The images that myst-nb has saved from the outputs of pages.
+
+    They are only added to the pages when they are written.
+    """
+    path_outputs = Path(app.outdir).parent.joinpath("jupyter_execute")
+    for docname in docnames:
+        path_doc = path_outputs.joinpath(docname)
+        for path in path_doc.parent.glob(f"{path_doc.name}_*"):
+            if path.suffix.lower() in IMAGE_FORMATS:
+                yield Path(os.path.normpath(path))
+
+
+def _parallel(app):
+    # Use all CPUs for images, unless the build is limited to fewer processes
+    return app.parallel if app.parallel > 1 else None
+
+
+def _optimized_prepare_writing(app, optimizer, prepare_writing):
+    """Wrap `Builder.prepare_writing`, to optimize the images of pages first.
+
+    Pages need to know which variants of their images exist, but Sphinx only
+    copies images after all pages are written.
+    """
+
+    def prepare_writing_optimized(docnames):
+        docnames = set(docnames)
+        images = [
+            src
+            for src, (image_docnames, _) in app.env.images.items()
+            if image_docnames & docnames
+        ]
+        paths = list(_optimizable(app.builder, images))
+        paths.extend(_notebook_output_images(app, docnames))
+        optimizer.optimize(paths, _parallel(app))
+        return prepare_writing(docnames)
+
+    return prepare_writing_optimized
+
+
+def _optimized_copy_image_files(app, optimizer, copy_image_files):
+    """Wrap `Builder.copy_image_files`, to copy optimized images from the cache."""
+    builder = app.builder
+
+    def copy_optimized_image_files():
+        images = builder.images
+        to_optimize = _optimizable(builder, images)
+        folders = optimizer.optimize(to_optimize, _parallel(app))
+        path_images = Path(builder.outdir, getattr(builder, "imagedir", ""))
+        path_images.mkdir(parents=True, exist_ok=True)
+        for path_src, folder in folders.items():
+            dest = images[to_optimize[path_src]]
+            name = "image" + path_src.suffix.lower()
+            copy_file(app, folder.joinpath(name), path_images.joinpath(dest))
+            for width in optimizer.info(path_src)["variants"]:
+                copy_file(
+                    app,
+                    folder.joinpath(_variant_name(name, width)),
+                    path_images.joinpath(_variant_name(dest, width)),
+                )
+
+        # Sphinx copies everything else, e.g. SVGs and the LaTeX logo
+        optimized = {to_optimize[path_src] for path_src in folders}
+        builder.images = {
+            src: dest for src, dest in images.items() if src not in optimized
+        }
+        try:
+            copy_image_files()
+        finally:
+            builder.images = images
+
+    return copy_optimized_image_files
+
+
+def init_image_optimization(app):
+    """Optimize images when they are copied, if `optimize_images` is set."""
+    config = app.config
+    builder = app.builder
+    if not config["optimize_images"] or builder.name not in IMAGE_BUILDERS:
+        return
+    quality = config["image_quality"]
+    valid = isinstance(quality, int) and 1 <= quality <= 100
+    if quality is not None and not valid:
+        raise ValueError(f"`image_quality` must be between 1 and 100, got {quality!r}")
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        logger.warning(
+            "Optimizing images requires the Pillow package. Install it with "
+            "`pip install jupyter-book[images]`."
+        )
+        return
+
+    max_width = config["latex_image_max_width"]
+    optimizer = ImageOptimizer(
+        cache_folder(app, IMAGE_CACHE_FOLDER),
+        quality=quality,
+        widths=_image_widths(app),
+        max_width=max_width if builder.format == "latex" else None,
+    )
+    builder._jb_image_optimizer = optimizer
+    if optimizer.settings["widths"]:
+        builder.prepare_writing = _optimized_prepare_writing(
+            app, optimizer, builder.prepare_writing
+        )
+    builder.copy_image_files = _optimized_copy_image_files(
+        app, optimizer, builder.copy_image_files
+    )
+
+
+_img_src = re.compile(r'<img ([^>]*?)src="([^"]+)"')
+
+
+def add_image_srcset(app, pagename, templatename, context, doctree):
+    """Add a `srcset` of the responsive variants of images to the page's HTML."""
+    optimizer = getattr(app.builder, "_jb_image_optimizer", None)
+    if optimizer is None or not optimizer.settings["widths"] or "body" not in context:
+        return
+    builder = app.builder
+    dest_to_src = {dest: src for src, dest in builder.images.items()}
+
+    def add_srcset(match):
+        attrs, uri = match.groups()
+        if "srcset=" in attrs or not uri.startswith(builder.imgpath + "/"):
+            return match.group(0)
+        src = dest_to_src.get(uri[len(builder.imgpath) + 1 :])
+        path_src = os.path.normpath(os.path.join(builder.srcdir, src or ""))
+        info = src and optimizer.info(Path(path_src))
+        if not info or not info["variants"]:
+            return match.group(0)
+        srcset = [f"{_variant_name(uri, ww)} {ww}w" for ww in info["variants"]]
+        srcset.append(f"{uri} {info['width']}w")
+        return f'<img {attrs}srcset="{", ".join(srcset)}" src="{uri}"'
+
+    context["body"] = _img_src.sub(add_srcset, context["body"])
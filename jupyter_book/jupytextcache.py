@@ -0,0 +1,161 @@
+"""A persistent cache of text notebooks (e.g. MyST markdown) converted by Jupytext.
+
+Text notebooks are converted each time myst-nb reads them, and again when they are
+looked up in the execution cache or executed. This wraps `jupytext.reads`, so that
+each conversion is done once and kept across builds.
+"""
+import os
+import json
+import time
+import pickle
+from hashlib import sha256
+from pathlib import Path
+from sphinx.util import logging
+from .utils import ProcessStats, cache_folder
+
+logger = logging.getLogger(__name__)
+
+# The folder (relative to the `_build` folder) where converted notebooks are stored
+JUPYTEXT_CACHE_FOLDER = ".jupytext_cache"
+
+# The folder (relative to the doctrees folder) where each process saves its counts
+STATS_FOLDER = "jupytext_stats"
+
+
+class JupytextCache(ProcessStats):
+    """Wrap `jupytext.reads` so that converted notebooks are cached on disk.
+
+    Each notebook is stored in its own file, named by a hash of the text, the
+    format, the options and the version of Jupytext, along with the time it took
+    to convert. Notebooks are kept in memory as they are loaded, and each call
+    returns a new copy, since myst-nb modifies the notebooks it reads. `.ipynb`
+    notebooks are only parsed as JSON, so they are never cached.
+
+    Counts are saved in `path_stats`, which belongs to one build, since the cache
+    itself may be shared by builds that run at the same time.
+    """
+
+    def __init__(self, path, reads, version, path_stats):
+        super().__init__(path_stats)
+        self.path = Path(path)
+        self._reads = reads
+        self.version = version
+        self._entries = {}
+
+    def _reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0
+
+    def _stats(self):
+        if self.hits or self.misses:
+            return {"hits": self.hits, "misses": self.misses, "saved": self.saved}
+
+    def key(self, text, fmt, args, kwargs):
+        parts = [
+            sha256(text.encode()).hexdigest(),
+            json.dumps(fmt, sort_keys=True, default=str),
+            json.dumps([args, kwargs], sort_keys=True, default=str),
+            self.version,
+        ]
+        return sha256("\n".join(parts).encode()).hexdigest()
+
+    def _load(self, key):
+        if key not in self._entries:
+            path_entry = self.path.joinpath(key[:2], key)
+            try:
+                self._entries[key] = path_entry.read_bytes()
+            except OSError:
+                return None
+        return pickle.loads(self._entries[key])
+
+    def _store(self, key, entry):
+        data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        self._entries[key] = data
+        path_entry = self.path.joinpath(key[:2], key)
+        path_entry.parent.mkdir(exist_ok=True)
+        # Write a temporary file first so parallel writers never see partial files
+        path_tmp = path_entry.with_name(f"{key}.{os.getpid()}.tmp")
+        path_tmp.write_bytes(data)
+        os.replace(path_tmp, path_entry)
+
+    def reads(self, text, fmt=None, *args, **kwargs):
+        if not isinstance(text, str) or "ipynb" in str(fmt):
+            return self._reads(text, fmt, *args, **kwargs)
+        self._check_process()
+        start = time.perf_counter()
+        key = self.key(text, fmt, args, kwargs)
+        try:
+            entry = self._load(key)
+        except Exception:
+            logger.verbose(f"Could not load converted notebook {key}, converting it")
+            entry = None
+        if entry is not None:
+            self.hits += 1
+            self.saved += max(entry["seconds"] - (time.perf_counter() - start), 0)
+            return entry["notebook"]
+
+        self.misses += 1
+        start = time.perf_counter()
+        ntbk = self._reads(text, fmt, *args, **kwargs)
+        self._store(key, {"notebook": ntbk, "seconds": time.perf_counter() - start})
+        return ntbk
+
+    def read_stats(self):
+        """Combine and remove the counts of all processes."""
+        hits = misses = 0
+        saved = 0.0
+        for stats in self.iter_stats():
+            hits += stats["hits"]
+            misses += stats["misses"]
+            saved += stats["saved"]
+        return hits, misses, saved
+
+
+_cache = None
+
+
+def init_jupytext_cache(app):
+    """Wrap `jupytext.reads` with a cache, if `jupytext_cache` is enabled.
+
+    `jupytext.read` and the `reads` that `jupytext` exports both call this one.
+    """
+    global _cache
+    if not app.config["jupytext_cache"]:
+        return
+    try:
+        import jupytext
+        from jupytext import jupytext as jupytext_module
+    except ImportError:
+        return
+
+    reads = jupytext_module.reads
+    if getattr(reads, "_jb_cached", False):
+        reads = reads._jb_reads
+    path_cache = cache_folder(app, JUPYTEXT_CACHE_FOLDER)
+    path_cache.mkdir(parents=True, exist_ok=True)
+    _cache = JupytextCache(
+        path_cache, reads, jupytext.__version__, Path(app.doctreedir, STATS_FOLDER)
+    )
+    # Remove counts that an earlier, failed, build left behind
+    _cache.read_stats()
+
+    def cached_reads(text, fmt=None, *args, **kwargs):
+        return _cache.reads(text, fmt, *args, **kwargs)
+
+    cached_reads._jb_cached = True
+    cached_reads._jb_reads = reads
+    jupytext_module.reads = jupytext.reads = cached_reads
+
+
+def finish_jupytext_cache(app, exc):
+    """Report how much conversion time the cache saved."""
+    if _cache is None or exc is not None:
+        return
+    _cache.write_stats()
+    hits, misses, saved = _cache.read_stats()
+    if hits + misses:
+        logger.info(
+            f"Jupytext conversion cache: {hits} hits, {misses} misses "
+            f"({saved:.1f}s of conversion saved)"
+        )
@@ -0,0 +1,264 @@
+"""Re-use warm Jupyter kernels between notebooks instead of starting one per page."""
+import os
+from sphinx.util import logging
+from .memory import memory_over_budget
+
+logger = logging.getLogger(__name__)
+
+# The kernel pool of the current build, if it uses one
+_pool = None
+
+# Code that is run in a kernel before each notebook, to reset it to a clean state.
+# Modules that were imported stay in `sys.modules`, so importing them again is fast.
+RESET_CODE = """\
+get_ipython().reset(new_session=True)
+import os as _jb_os
+_jb_os.chdir({cwd!r})
+del _jb_os
+"""
+
+
+def _kernel_memory(km):
+    """The memory used by a kernel process in MB, or None if we can't tell."""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    provisioner = getattr(km, "provisioner", None)
+    pid = getattr(provisioner, "pid", None)
+    if pid is None:
+        pid = getattr(getattr(km, "kernel", None), "pid", None)
+    if pid is None:
+        return None
+    try:
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except psutil.Error:
+        return None
+
+
+class PooledKernel:
+    """A running kernel, and how much it has been used."""
+
+    def __init__(self, km):
+        self.km = km
+        self.uses = 0
+        self.memory_start = _kernel_memory(km)
+
+    def run(self, code, timeout=60):
+        """Run code in the kernel without adding to its history or outputs."""
+        # Each notebook's client talks to the kernel with its own channels, so we
+        # open new ones rather than keeping a client around between notebooks.
+        kc = self.km.client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=60)
+            reply = kc.execute_interactive(
+                code,
+                silent=True,
+                store_history=False,
+                timeout=timeout,
+                output_hook=lambda msg: None,
+            )
+        finally:
+            kc.stop_channels()
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(
+                f"Error running code in pooled kernel: {reply['content'].get('ename')}"
+            )
+
+    def shutdown(self):
+        try:
+            self.km.shutdown_kernel(now=True)
+        except Exception as err:
+            logger.verbose(f"Could not shut down pooled kernel: {err}")
+
+
+class KernelPool:
+    """A pool of warm kernels, per kernelspec, that are recycled between notebooks.
+
+    Kernels are started when they are first needed, and run the `warmup` code once
+    (e.g. to import heavy libraries). After a notebook is executed, the kernel goes
+    back into the pool, unless it has been used `max_uses` times or its memory has
+    grown by more than `max_memory_growth` MB, in which case it is shut down and a
+    fresh kernel is started next time. Before each notebook, the kernel's namespace
+    and execution count are reset.
+
+    Only Python kernels are pooled, since we need IPython to reset them.
+    """
+
+    def __init__(self, size, warmup="", max_uses=None, max_memory_growth=None):
+        self.size = size
+        self.warmup = warmup
+        self.max_uses = max_uses
+        self.max_memory_growth = max_memory_growth
+        self.idle = {}
+        self.pid = os.getpid()
+        self.started = 0
+        self.reused = 0
+
+    def _check_process(self):
+        if os.getpid() != self.pid:
+            # We're in a forked worker: the parent's kernels belong to the parent.
+            # Our own kernels exit with this process, since ipykernel polls its parent.
+            self.pid = os.getpid()
+            self.idle = {}
+            self.started = self.reused = 0
+
+    def _start(self, kernel_name, cwd):
+        from jupyter_client import KernelManager
+
+        km = KernelManager(kernel_name=kernel_name)
+        km.start_kernel(cwd=str(cwd))
+        kernel = PooledKernel(km)
+        if self.warmup:
+            kernel.run(self.warmup, timeout=None)
+        kernel.memory_start = _kernel_memory(km)
+        self.started += 1
+        return kernel
+
+    def acquire(self, kernel_name, cwd):
+        """Get a clean kernel for `kernel_name`, whose working directory is `cwd`."""
+        self._check_process()
+        idle = self.idle.setdefault(kernel_name, [])
+        while idle:
+            kernel = idle.pop()
+            try:
+                kernel.run(RESET_CODE.format(cwd=str(cwd)))
+                self.reused += 1
+                return kernel
+            except Exception as err:
+                logger.verbose(f"Discarding pooled kernel that failed to reset: {err}")
+                kernel.shutdown()
+        return self._start(kernel_name, cwd)
+
+    def release(self, kernel_name, kernel):
+        """Return a kernel to the pool, or shut it down if it should be recycled."""
+        kernel.uses += 1
+        idle = self.idle.setdefault(kernel_name, [])
+        recycle = len(idle) >= self.size or not kernel.km.is_alive()
+        if self.max_uses and kernel.uses >= self.max_uses:
+            recycle = True
+        memory = _kernel_memory(kernel.km)
+        if self.max_memory_growth and memory and kernel.memory_start:
+            if memory - kernel.memory_start > self.max_memory_growth:
+                logger.verbose(
+                    f"Restarting kernel after its memory grew to {memory:.0f}MB"
+                )
+                recycle = True
+        if not recycle and memory_over_budget():
+            logger.verbose("Shutting down kernel, since the build is over --max-memory")
+            recycle = True
+        if recycle:
+            kernel.shutdown()
+        else:
+            idle.append(kernel)
+
+    def shutdown(self):
+        """Shut down all idle kernels."""
+        self._check_process()
+        for kernels in self.idle.values():
+            for kernel in kernels:
+                kernel.shutdown()
+        self.idle = {}
+
+    def execute(self, nb, cwd=None, timeout=None, **kwargs):
+        """Execute a notebook in a pooled kernel, like `nbclient.execute`."""
+        from nbclient import NotebookClient
+
+        cwd = cwd or os.getcwd()
+        kernel_name = nb.metadata.get("kernelspec", {}).get("name", "python3")
+        kernel = self.acquire(kernel_name, cwd)
+        resources = {"metadata": {"path": cwd}}
+        client = NotebookClient(
+            nb, km=kernel.km, timeout=timeout, resources=resources, **kwargs
+        )
+        try:
+            # nbclient only starts a kernel client for kernels that it starts
+            client.kc = kernel.km.client()
+            client.kc.start_channels()
+            client.kc.wait_for_ready(timeout=60)
+            client.kc.allow_stdin = False
+            client.execute()
+        except Exception:
+            # The kernel may be in an unknown state, so don't put it back
+            kernel.shutdown()
+            raise
+        finally:
+            if client.kc is not None:
+                client.kc.stop_channels()
+        self.release(kernel_name, kernel)
+        return nb
+
+
+def _use_pool(nb):
+    """Whether a notebook may use a pooled kernel."""
+    language = nb.metadata.get("kernelspec", {}).get("language", "python")
+    if language != "python":
+        return False
+    return not nb.metadata.get("execution", {}).get("fresh_kernel", False)
+
+
+def _pooled(execute_notebook):
+    """Wrap a function that executes a notebook, so that it uses the kernel pool."""
+
+    def wrapped(nb, cwd=None, **kwargs):
+        if _pool is None or not _use_pool(nb):
+            if cwd is not None:
+                kwargs["cwd"] = cwd
+            return execute_notebook(nb, **kwargs)
+        return _pool.execute(nb, cwd=cwd, **kwargs)
+
+    wrapped._jb_pooled = True
+    return wrapped
+
+
+def init_kernel_pool(app):
+    """Execute notebooks with a pool of warm kernels, if `kernel_pool_size` is set.
+
+    This replaces the function that myst-nb uses to execute notebooks in `auto`
+    and `force` mode, and the one that jupyter-cache uses in `cache` mode.
+    """
+    global _pool
+    config = app.config
+    if not config["kernel_pool_size"]:
+        return
+    try:
+        from myst_nb import cache
+        from jupyter_cache.executors import basic
+    except ImportError:
+        return
+
+    if config["kernel_max_memory_growth"]:
+        try:
+            import psutil  # noqa: F401
+        except ImportError:
+            logger.warning(
+                "`kernel_max_memory_growth` requires the psutil package, so pooled "
+                "kernels won't be restarted when their memory grows. Install it "
+                "with `pip install jupyter-book[memory]`, or set "
+                "`kernel_max_memory_growth` to 0."
+            )
+    _pool = KernelPool(
+        config["kernel_pool_size"],
+        warmup=config["kernel_warmup"],
+        max_uses=config["kernel_max_uses"],
+        max_memory_growth=config["kernel_max_memory_growth"],
+    )
+    if not getattr(cache.execute, "_jb_pooled", False):
+        cache.execute = _pooled(cache.execute)
+    if not getattr(basic.executenb, "_jb_pooled", False):
+        basic.executenb = _pooled(basic.executenb)
+
+
+def shutdown_kernel_pool(app, exc):
+    """Shut down the pooled kernels when the build is finished."""
+    global _pool
+    if _pool is None:
+        return
+    if _pool.started:
+        logger.info(
+            f"Kernel pool: started {_pool.started} kernels, "
+            f"re-used kernels {_pool.reused} times"
+        )
+    _pool.shutdown()
+    _pool = None
@@ -0,0 +1,97 @@
+"""Pre-render math at build time, with a cache that persists across builds."""
+import os
+import shutil
+from hashlib import sha1
+from pathlib import Path
+from sphinx.ext import imgmath
+from sphinx.util import logging
+from .utils import cache_folder
+
+logger = logging.getLogger(__name__)
+
+# The folder (relative to the `_build` folder) where rendered math is stored
+MATH_CACHE_FOLDER = ".math_cache"
+
+# The original imgmath renderer, which we wrap with a cache
+_render_math = imgmath.render_math
+
+
+def _math_cache_key(latex, config):
+    """A hash of a math expression and all options that affect how it is rendered."""
+    image_format = config.imgmath_image_format.lower()
+    if image_format == "svg":
+        converter_args = [config.imgmath_dvisvgm] + list(config.imgmath_dvisvgm_args)
+    else:
+        converter_args = [config.imgmath_dvipng] + list(config.imgmath_dvipng_args)
+    key = "\n".join(
+        [
+            latex,
+            image_format,
+            str(config.imgmath_use_preview),
+            " ".join(converter_args),
+            " ".join([config.imgmath_latex] + list(config.imgmath_latex_args)),
+        ]
+    )
+    return sha1(key.encode()).hexdigest()
+
+
+def render_math_cached(self, math):
+    """Render math with `sphinx.ext.imgmath`, re-using images from the math cache.
+
+    This wraps `sphinx.ext.imgmath.render_math`. Before rendering, we look for
+    the image in the math cache and copy it to the output folder. After rendering,
+    new images are copied into the cache so that they are never rendered again.
+    """
+    builder = self.builder
+    path_cache = getattr(builder, "_jb_math_cache_path", None)
+    if path_cache is None:
+        return _render_math(self, math)
+
+    config = builder.config
+    image_format = config.imgmath_image_format.lower()
+    latex = imgmath.generate_latex_macro(image_format, math, config, builder.confdir)
+    path_cached = path_cache.joinpath(
+        f"{_math_cache_key(latex, config)}.{image_format}"
+    )
+    filename = f"{sha1(latex.encode()).hexdigest()}.{image_format}"
+    path_out = Path(builder.outdir, builder.imagedir, "math", filename)
+
+    if not path_out.exists() and path_cached.exists():
+        path_out.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path_cached, path_out)
+
+    relfn, depth = _render_math(self, math)
+
+    if relfn is not None and not path_cached.exists() and path_out.exists():
+        # Copy to a temporary file first so parallel writers never see partial files
+        path_tmp = path_cached.with_suffix(f".{os.getpid()}.tmp")
+        shutil.copyfile(path_out, path_tmp)
+        os.replace(path_tmp, path_cached)
+    return relfn, depth
+
+
+def setup_math_rendering(app, config):
+    """Load `sphinx.ext.imgmath`, only if math pre-rendering is enabled.
+
+    This runs once the book's configuration is loaded, so that other builds
+    neither load the extension nor pay for its setup.
+    """
+    if config["prerender_math"]:
+        app.setup_extension("sphinx.ext.imgmath")
+
+
+def init_math_cache(app):
+    """Prepare the math cache folder if math pre-rendering is enabled."""
+    if not app.config["prerender_math"]:
+        return
+    if app.config["html_math_renderer"] != "imgmath":
+        logger.warning(
+            "`prerender_math` is enabled but `html_math_renderer` is "
+            f"{app.config['html_math_renderer']!r}, so math will not be pre-rendered."
+        )
+        return
+
+    path_cache = cache_folder(app, MATH_CACHE_FOLDER)
+    path_cache.mkdir(parents=True, exist_ok=True)
+    app.builder._jb_math_cache_path = path_cache
+    imgmath.render_math = render_math_cached
@@ -0,0 +1,557 @@
+"""Execute notebooks in parallel so that a build stays under a memory budget.
+
+Sphinx only reads pages in parallel if all extensions allow it, which myst-nb
+doesn't, so with `max_memory` set the notebooks that reading would execute are
+executed first, by parallel worker processes, and reading then adds their outputs.
+(If all extensions allow parallel reads, pages are read by the workers instead.)
+Each worker measures how much memory each page needs, including the kernels that
+execute it, and these measurements are kept in the doctrees folder. The next build
+uses them to start with the pages that need the most memory, and only starts a
+worker when the memory that the running workers are expected to need, and the
+memory that the build uses right now, leave room for it. Pages that were never
+measured are expected to need as much as the typical page.
+"""
+import os
+import re
+import json
+import pickle
+import statistics
+import threading
+from functools import wraps
+from hashlib import sha256
+from pathlib import Path
+from sphinx.locale import __
+from sphinx.util import display_chunk, logging, status_iterator
+from sphinx.util.console import bold
+from sphinx.util.parallel import ParallelTasks, make_chunks, parallel_available
+from .metrics import _peak_rss
+
+logger = logging.getLogger(__name__)
+
+# The file (in the doctrees folder) where the memory each page needs is kept
+MEMORY_RECORDS_FILE = "memory.json"
+
+# The memory (in MB) that a page is expected to need, before any page was measured
+DEFAULT_PAGE_MEMORY = 200
+
+# How often (in seconds) the memory of a worker is sampled while it reads a page
+SAMPLE_INTERVAL = 0.1
+
+# The versions (major.minor) of myst-nb whose `cache.execute` and
+# `converter.path_to_notebook`, which are private, notebooks are executed with
+MYST_NB_VERSIONS = ["0.7"]
+
+_UNITS = {"": 1, "K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+# The scheduler of the current build, if it has a memory budget
+_scheduler = None
+
+
+def parse_memory(text):
+    """The size in MB of a memory budget like `12G`, `800M` or `800` (in MB)."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(text), re.I)
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Memory must be a size like 12G or 800M, got {text!r}")
+    return float(match.group(1)) * _UNITS[match.group(2).upper()]
+
+
+def _process_tree_memory(pid):
+    """The memory (in MB) of a process and its descendants, or None without psutil.
+
+    Descendants share memory with the process they were forked from, so only
+    their memory that isn't shared is counted.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        process = psutil.Process(pid)
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                info = child.memory_info()
+                total += info.rss - getattr(info, "shared", 0)
+            except psutil.Error:
+                continue
+    except psutil.Error:
+        return None
+    return total / 1024 / 1024
+
+
+def _peak_memory():
+    """The peak memory (in MB) of this process and of its finished subprocesses.
+
+    This is 0 if it can't be measured.
+    """
+    rss_self, rss_children = _peak_rss()
+    return (rss_self or 0) + (rss_children or 0)
+
+
+def _notebook_key(ntbk):
+    """A hash of the code and kernel of a notebook, to find it once it's executed."""
+    kernel = ntbk.metadata.get("kernelspec", {}).get("name")
+    code = [cell.source for cell in ntbk.cells if cell.cell_type == "code"]
+    return sha256(json.dumps([kernel, code]).encode()).hexdigest()
+
+
+def _merge_outputs(ntbk, executed):
+    """Add the outputs of an executed copy of a notebook to the notebook."""
+    cells = [cell for cell in ntbk.cells if cell.cell_type == "code"]
+    executed_cells = [cell for cell in executed.cells if cell.cell_type == "code"]
+    for cell, executed_cell in zip(cells, executed_cells):
+        cell.outputs = executed_cell.outputs
+        cell.execution_count = executed_cell.execution_count
+        cell.metadata = executed_cell.metadata
+    for key in ["language_info", "widgets"]:
+        if key in executed.metadata:
+            ntbk.metadata[key] = executed.metadata[key]
+    return ntbk
+
+
+def _notebook_to_execute(path, mode):
+    """The notebook of a page, if reading the page would execute it, else None.
+
+    Like myst-nb, notebooks whose code cells all have outputs aren't executed in
+    `auto` mode.
+    """
+    from myst_nb.converter import path_to_notebook
+
+    ntbk = path_to_notebook(path)
+    code_cells = [cell for cell in ntbk.cells if cell.cell_type == "code"]
+    if mode == "auto" and all(cell.get("outputs") for cell in code_cells):
+        return None
+    return ntbk
+
+
+class PageMemorySampler:
+    """Measure how much the memory of this process (and its kernels) grows while
+    it reads one page.
+
+    Memory is sampled in a thread with psutil. Without psutil, the growth of the
+    peak memory of the process is used, which misses pages that need less memory
+    than an earlier page did.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.start = _process_tree_memory(self.pid)
+        self.peak = self.start
+        self._peak_memory = _peak_memory()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            memory = _process_tree_memory(self.pid)
+            if memory is not None:
+                self.peak = max(self.peak, memory)
+
+    def stop(self):
+        """Stop sampling, and return how much memory (in MB) the page needed."""
+        if self._thread is None:
+            return max(_peak_memory() - self._peak_memory, 0)
+        self._stop.set()
+        self._thread.join()
+        memory = _process_tree_memory(self.pid)
+        if memory is not None:
+            self.peak = max(self.peak, memory)
+        return max(self.peak - self.start, 0)
+
+
+class MemoryAwareTasks(ParallelTasks):
+    """Sphinx's `ParallelTasks`, that only starts a task when it fits in `budget`.
+
+    Each task is added with the memory (in MB) it is expected to need, which is
+    reserved until it finishes. A task is started when the memory of the build,
+    either `base` plus what the running tasks reserved or what the build uses
+    right now (whichever is larger), leaves room for it. A task is always started
+    if no other task is running, even if it doesn't fit.
+    """
+
+    def __init__(self, nproc, budget, base, usage=None):
+        super().__init__(nproc)
+        self.budget = budget
+        self.base = base
+        self.usage = usage or (lambda: None)
+        self.reserved = {}
+        self.throttled = 0
+        self.most_workers = 0
+
+    def _release(self):
+        for tid in list(self.reserved):
+            if tid not in self._precvs and tid not in self._precvsWaiting:
+                del self.reserved[tid]
+
+    def fits(self, memory):
+        used = self.base + sum(self.reserved.values())
+        usage = self.usage()
+        if usage is not None:
+            used = max(used, usage)
+        return used + memory <= self.budget
+
+    def add_task(self, task_func, arg=None, result_func=None, memory=0):
+        throttled = False
+        while self._pworking and (
+            self._pworking >= self.nproc or not self.fits(memory)
+        ):
+            throttled = throttled or self._pworking < self.nproc
+            self._join_one()
+        self.throttled += throttled
+        self.reserved[self._taskid] = memory
+        super().add_task(task_func, arg, result_func)
+        self.most_workers = max(self.most_workers, self._pworking)
+
+    def _join_one(self):
+        super()._join_one()
+        self._release()
+
+
+class MemoryScheduler:
+    """Read pages, or execute their notebooks, in parallel within a memory budget,
+    learning from past builds."""
+
+    def __init__(self, app, budget):
+        self.app = app
+        self.budget = budget
+        self.pid = os.getpid()
+        self.path_records = Path(app.doctreedir, MEMORY_RECORDS_FILE)
+        self.records = {}
+        if self.path_records.exists():
+            try:
+                self.records = json.loads(self.path_records.read_text())
+            except ValueError:
+                logger.warning(f"Could not load {self.path_records}, ignoring it")
+        self.measured = {}
+        # Notebooks that were executed before they are read, by `_notebook_key`
+        self.executed = {}
+        self.n_executed = 0
+        self.pre_execute = False
+        self._samplers = {}
+        self.tasks = None
+
+    def usage(self):
+        """The memory (in MB) that the build uses right now, or None without psutil."""
+        return _process_tree_memory(self.pid)
+
+    def over_budget(self):
+        """Whether the build uses more memory than its budget right now."""
+        usage = self.usage()
+        return usage is not None and usage > self.budget
+
+    def estimate(self, docname):
+        """The memory (in MB) that reading a page is expected to need."""
+        if docname in self.records:
+            return self.records[docname]
+        if self.records:
+            return statistics.median(self.records.values())
+        return DEFAULT_PAGE_MEMORY
+
+    def chunks(self, docnames, nproc):
+        """Split pages into chunks for the workers, with the memory each needs.
+
+        Pages are ordered by the memory they need, largest first, and pages that
+        need more than a worker's share of the budget are read on their own.
+        """
+        share = self.budget / nproc
+        docnames = sorted(docnames, key=lambda docname: -self.estimate(docname))
+        large = [docname for docname in docnames if self.estimate(docname) > share]
+        chunks = [[docname] for docname in large]
+        chunks += make_chunks(docnames[len(large) :], nproc)
+        return [
+            (chunk, max(self.estimate(docname) for docname in chunk))
+            for chunk in chunks
+        ]
+
+    def read_parallel(self, docnames, nproc):
+        """Read pages like Sphinx's `Builder._read_parallel`, within the budget."""
+        app, builder = self.app, self.app.builder
+        for docname in docnames:
+            app.emit("env-purge-doc", builder.env, docname)
+            builder.env.clear_doc(docname)
+
+        def read_process(docs):
+            builder.env.app = app
+            for docname in docs:
+                builder.read_doc(docname)
+            # allow pickling self to send it back
+            return pickle.dumps(builder.env, pickle.HIGHEST_PROTOCOL)
+
+        def merge(docs, otherenv):
+            env = pickle.loads(otherenv)
+            builder.env.merge_info_from(docs, env, app)
+
+        self._start_tasks(nproc)
+        chunks = self.chunks(docnames, nproc)
+        self._warn_large(chunks, "read")
+        for chunk, memory in status_iterator(
+            chunks,
+            __("reading sources... "),
+            "purple",
+            len(chunks),
+            app.verbosity,
+            stringify_func=lambda item: display_chunk(item[0]),
+        ):
+            self.tasks.add_task(read_process, chunk, merge, memory)
+
+        # make sure all threads have finished
+        logger.info(bold(__("waiting for workers...")))
+        self.tasks.join()
+
+    def _start_tasks(self, nproc):
+        base = self.usage()
+        if base is None:
+            base = _peak_memory()
+        self.tasks = MemoryAwareTasks(nproc, self.budget, base, self.usage)
+
+    def _warn_large(self, chunks, action):
+        for chunk, memory in chunks:
+            if memory > self.budget - self.tasks.base:
+                logger.warning(
+                    f"{chunk[0]} needed {memory:.0f}MB in the last build, more than "
+                    f"the memory budget allows. It will be {action} on its own."
+                )
+
+    def execute_parallel(self, docnames, nproc):
+        """Execute the notebooks of pages in parallel, within the budget, before
+        the pages are read one at a time.
+
+        Each notebook is executed by its own worker, largest first, and reading its
+        page then takes the outputs from `executed` instead of executing it again.
+        Notebooks that fail are left to reading, which reports the error.
+        """
+        from myst_nb import cache
+        from myst_nb.converter import is_myst_file
+
+        app, env = self.app, self.app.env
+        mode = app.config["jupyter_execute_notebooks"]
+        docnames = [
+            docname
+            for docname in docnames
+            if cache.is_valid_exec_file(env, docname)
+            and is_myst_file(env.doc2path(docname))
+        ]
+        if not docnames:
+            return
+
+        def execute_process(docname):
+            # Only the notebook of this worker is executed
+            self.executed = {}
+            sampler = PageMemorySampler()
+            try:
+                ntbk = _notebook_to_execute(env.doc2path(docname), mode)
+                if ntbk is not None:
+                    ntbk = cache.execute(ntbk)
+            except Exception as err:
+                logger.warning(
+                    f"Could not execute {docname} in parallel, it will be executed "
+                    f"when it is read: {err}"
+                )
+                ntbk = None
+            return ntbk, sampler.stop()
+
+        def collect(docname, result):
+            ntbk, memory = result
+            self.measured[docname] = round(memory, 1)
+            if ntbk is not None:
+                self.executed[_notebook_key(ntbk)] = ntbk
+                self.n_executed += 1
+
+        self._start_tasks(nproc)
+        docnames = sorted(docnames, key=lambda docname: -self.estimate(docname))
+        chunks = [([docname], self.estimate(docname)) for docname in docnames]
+        self._warn_large(chunks, "executed")
+        for chunk, memory in status_iterator(
+            chunks,
+            __("executing notebooks... "),
+            "purple",
+            len(chunks),
+            app.verbosity,
+            stringify_func=lambda item: item[0][0],
+        ):
+            self.tasks.add_task(execute_process, chunk[0], collect, memory)
+        logger.info(bold(__("waiting for workers...")))
+        self.tasks.join()
+
+    def take_executed(self, ntbk):
+        """The executed copy of a notebook, if it was executed in parallel."""
+        return self.executed.pop(_notebook_key(ntbk), None)
+
+    def start_page(self, docname):
+        self._samplers[docname] = PageMemorySampler()
+
+    def end_page(self, env, docname):
+        sampler = self._samplers.pop(docname, None)
+        if sampler is None:
+            return
+        memory = round(sampler.stop(), 1)
+        if os.getpid() == self.pid:
+            # Its notebook may have been executed (and measured) before it was read
+            self.measured[docname] = max(memory, self.measured.get(docname, 0))
+        else:
+            # Sent back to the main process with the worker's environment
+            if not hasattr(env, "jb_page_memory"):
+                env.jb_page_memory = {}
+            env.jb_page_memory[docname] = memory
+
+    def save_records(self):
+        """Keep the memory that pages needed, for the next build."""
+        env = self.app.env
+        self.records.update(self.measured)
+        for docname in list(self.records):
+            if docname not in env.found_docs:
+                del self.records[docname]
+        path_tmp = self.path_records.with_suffix(f".{os.getpid()}.tmp")
+        path_tmp.write_text(json.dumps(self.records, indent=2, sort_keys=True))
+        os.replace(path_tmp, self.path_records)
+
+
+def _pre_executed(execute_notebook):
+    """Wrap the function that myst-nb executes notebooks with, to take the outputs
+    of notebooks that were executed in parallel instead."""
+
+    def wrapped(ntbk, *args, **kwargs):
+        executed = None if _scheduler is None else _scheduler.take_executed(ntbk)
+        if executed is None:
+            return execute_notebook(ntbk, *args, **kwargs)
+        return _merge_outputs(ntbk, executed)
+
+    wrapped._jb_pre_executed = True
+    return wrapped
+
+
+def _serial_reason(app):
+    """Why notebooks can't be executed in parallel before pages are read, or None."""
+    import myst_nb
+
+    mode = app.config["jupyter_execute_notebooks"]
+    if not parallel_available or app.parallel <= 1:
+        return "only one process can be used"
+    version = ".".join(str(myst_nb.__version__).split(".")[:2])
+    if version not in MYST_NB_VERSIONS:
+        return (
+            f"myst-nb {myst_nb.__version__} isn't supported (only versions "
+            f"{', '.join(MYST_NB_VERSIONS)} are)"
+        )
+    if mode == "cache":
+        return "jupyter-cache executes notebooks one at a time"
+    if mode not in ["auto", "force"]:
+        return "notebooks aren't executed"
+    return None
+
+
+def init_memory_scheduler(app):
+    """Read pages or execute notebooks within the `max_memory` budget (in MB), if it
+    is set.
+
+    Sphinx only calls `_read_parallel` if all extensions allow parallel reads.
+    Otherwise, notebooks are executed in parallel before pages are read.
+    """
+    global _scheduler
+    if not app.config["max_memory"]:
+        return
+    _scheduler = MemoryScheduler(app, float(app.config["max_memory"]))
+    try:
+        import psutil  # noqa: F401
+    except ImportError:
+        logger.warning(
+            "`max_memory` needs the psutil package to measure memory as pages are "
+            "read. Without it, the budget is only kept by what pages needed in "
+            "earlier builds. Install it with `pip install jupyter-book[memory]`."
+        )
+    app.builder._read_parallel = _scheduler.read_parallel
+    if all(ext.parallel_read_safe for ext in app.extensions.values()):
+        return
+    try:
+        from myst_nb import cache
+    except ImportError:
+        return
+    reason = _serial_reason(app)
+    if reason is not None:
+        logger.warning(
+            f"Pages are read one at a time, and `max_memory` can't execute notebooks "
+            f"in parallel: {reason}."
+        )
+        return
+    _scheduler.pre_execute = True
+    if not getattr(cache.execute, "_jb_pre_executed", False):
+        cache.execute = _pre_executed(cache.execute)
+    app.builder.read = _restoring_parallel(app, app.builder.read)
+
+
+def _restoring_parallel(app, read):
+    """Wrap `Builder.read`, to restore the processes that `execute_notebooks`
+    leaves reading with, whether reading succeeds or not."""
+
+    @wraps(read)
+    def wrapped():
+        nproc = app.parallel
+        try:
+            return read()
+        finally:
+            app.parallel = nproc
+
+    return wrapped
+
+
+def execute_notebooks(app, env, docnames):
+    """Execute the notebooks of the pages to read in parallel, within the budget."""
+    if _scheduler is None or not _scheduler.pre_execute:
+        return
+    _scheduler.execute_parallel(docnames, app.parallel)
+    # Pages are read one at a time anyway, and this keeps Sphinx from warning that
+    # they can't be read in parallel (which fails builds with `-W`). Writing still
+    # uses all the processes, since reading restores them when it ends.
+    app.parallel = 1
+
+
+def record_page_start(app, docname, source):
+    if _scheduler is not None:
+        _scheduler.start_page(docname)
+
+
+def record_page_end(app, doctree):
+    if _scheduler is not None:
+        _scheduler.end_page(app.env, app.env.docname)
+
+
+def merge_page_memory(app, env, docnames, other):
+    """Collect the memory that pages needed in parallel read workers."""
+    if _scheduler is None:
+        return
+    memory = getattr(other, "jb_page_memory", {})
+    _scheduler.measured.update(
+        {docname: memory[docname] for docname in docnames if docname in memory}
+    )
+
+
+def finish_memory_scheduler(app, env):
+    """Save the memory that pages needed, and report how reading was scheduled."""
+    if _scheduler is None:
+        return
+    _scheduler.save_records()
+    measured = _scheduler.measured
+    if not measured:
+        return
+    largest = max(measured, key=measured.get)
+    message = (
+        f"Memory: {len(measured)} pages read, {largest} needed the most "
+        f"({measured[largest]:.0f}MB)"
+    )
+    if _scheduler.n_executed:
+        message += f", {_scheduler.n_executed} notebooks executed in parallel"
+    tasks = _scheduler.tasks
+    if tasks is not None:
+        message += (
+            f", up to {tasks.most_workers} workers at once, "
+            f"{tasks.throttled} waits for memory"
+        )
+    logger.info(message)
+
+
+def memory_over_budget():
+    """Whether the build uses more memory than `max_memory` allows right now."""
+    return _scheduler is not None and _scheduler.over_budget()
@@ -0,0 +1,329 @@
+"""Profile the memory that a build uses, by document, step and allocation site.
+
+With `profile_memory`, Python allocations are traced with `tracemalloc` while the
+book is built. For each document that is read and written, and for the steps of
+reading it (adding its toctree, converting its notebook and adding the outputs of
+the notebook), we record how much memory it allocated and kept, how high the
+allocations peaked, and how the memory of the process grew. The allocation sites
+of the memory that reading documents kept are also counted. At the end of the
+build, the pickled size of each part of the build environment is measured, and
+everything is written to a ranked report in the `_build` folder.
+
+Tracing allocations makes a build much slower, so this is only meant for finding
+out where memory goes.
+"""
+import os
+import pickle
+import tracemalloc
+from functools import wraps
+from pathlib import Path
+from sphinx.util import logging
+from .memory import _peak_memory, _process_tree_memory
+from .metrics import _peak_rss
+from .utils import ProcessStats
+
+logger = logging.getLogger(__name__)
+
+# The report (in the `_build` folder) of the memory profile
+MEMORY_PROFILE_FILE = "memory_profile.txt"
+
+# The folder (relative to the doctrees folder) where each process saves its records
+STATS_FOLDER = "memory_profile"
+
+# The number of documents, steps and allocation sites in each part of the report
+TOP_N = 25
+
+# The profiler of the current build, if memory is profiled
+_profiler = None
+
+
+def _mb(n_bytes):
+    return n_bytes / 1024 / 1024
+
+
+def _rss():
+    """The memory (in MB) of this process and its kernels (its peak, without psutil)."""
+    memory = _process_tree_memory(os.getpid())
+    return memory if memory is not None else _peak_memory()
+
+
+class _Frame:
+    """The memory of this process when a document or step started."""
+
+    def __init__(self):
+        # Measured first, since the first measurement may import psutil
+        self.rss = _rss()
+        self.current, self.peak = tracemalloc.get_traced_memory()
+
+
+class MemoryProfiler(ProcessStats):
+    """Record the memory that documents and steps use, in each process.
+
+    With parallel reads and writes, each worker process records its own documents.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ]
+
+    def _reset(self):
+        self._stack = []
+        self.records = {"read": {}, "write": {}, "steps": {}, "sites": {}}
+
+    def _stats(self):
+        return self.records
+
+    def _fold_peak(self):
+        """Add the peak so far to the open frames, and start measuring a new one.
+
+        Python 3.9+ can reset the peak, so that each frame gets its own. Before
+        that, the peak is the highest since tracing started.
+        """
+        _, peak = tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame.peak = max(frame.peak, peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    def start(self):
+        self._check_process()
+        self._fold_peak()
+        frame = _Frame()
+        self._stack.append(frame)
+        return frame
+
+    def stop(self, frame):
+        """The memory that was kept, the peak and the process's growth, in MB."""
+        self._fold_peak()
+        self._stack.remove(frame)
+        current, _ = tracemalloc.get_traced_memory()
+        return {
+            "kept": round(_mb(current - frame.current), 2),
+            "peak": round(_mb(frame.peak - frame.current), 2),
+            "rss": round(_rss() - frame.rss, 2),
+        }
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    def profile_read(self, read_doc):
+        """Wrap `Builder.read_doc`, to record each document and what it allocated."""
+
+        @wraps(read_doc)
+        def wrapped(docname):
+            frame = self.start()
+            before = self._snapshot()
+            try:
+                return read_doc(docname)
+            finally:
+                record = self.stop(frame)
+                sites = self.records["sites"]
+                for stat in self._snapshot().compare_to(before, "lineno"):
+                    if stat.size_diff > 0:
+                        trace = stat.traceback[0]
+                        site = f"{trace.filename}:{trace.lineno}"
+                        sites[site] = sites.get(site, 0) + stat.size_diff
+                self.records["read"][docname] = record
+
+        return wrapped
+
+    def profile_write(self, write_doc):
+        """Wrap `Builder.write_doc`, to record each document that is written."""
+
+        @wraps(write_doc)
+        def wrapped(docname, doctree):
+            frame = self.start()
+            try:
+                return write_doc(docname, doctree)
+            finally:
+                self.records["write"][docname] = self.stop(frame)
+
+        return wrapped
+
+    def add_step(self, step, docname, record):
+        steps = self.records["steps"].setdefault(step, {})
+        if docname in steps:
+            # A step may run more than once for a document
+            record = {key: steps[docname][key] + value for key, value in record.items()}
+        steps[docname] = record
+
+    def read_stats(self):
+        """Combine and remove the records of all processes."""
+        combined = {"read": {}, "write": {}, "steps": {}, "sites": {}}
+        for records in self.iter_stats():
+            combined["read"].update(records["read"])
+            combined["write"].update(records["write"])
+            for step, docs in records["steps"].items():
+                combined["steps"].setdefault(step, {}).update(docs)
+            for site, size in records["sites"].items():
+                combined["sites"][site] = combined["sites"].get(site, 0) + size
+        return combined
+
+
+def profiled_step(step, get_docname):
+    """Wrap a function that is a step of reading a document, to profile it.
+
+    `get_docname` gets the document from the function's arguments.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            frame = _profiler.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record = _profiler.stop(frame)
+                _profiler.add_step(step, get_docname(*args, **kwargs), record)
+
+        wrapped._jb_profiled = True
+        return wrapped
+
+    return decorator
+
+
+def environment_sizes(env):
+    """The pickled size (in bytes) of each part of the build environment.
+
+    The data of each domain is measured separately, e.g. `domaindata.std`.
+    """
+    sizes = {}
+    for key, value in env.__getstate__().items():
+        if key == "domaindata":
+            for name, data in value.items():
+                sizes[f"domaindata.{name}"] = len(pickle.dumps(data, -1))
+            continue
+        try:
+            sizes[key] = len(pickle.dumps(value, -1))
+        except Exception:
+            # Not pickled with the environment either, e.g. a wrapped method
+            continue
+    return sizes
+
+
+def _ranked(records, key):
+    return sorted(records.items(), key=lambda item: -(item[1][key] or 0))[:TOP_N]
+
+
+def format_report(records, env_sizes, peak_rss):
+    """A ranked report of the memory that a build used."""
+    lines = ["Memory profile of the build", "=" * 27, ""]
+    rss_self, rss_children = peak_rss
+    if rss_self is not None:
+        lines.append(
+            f"Peak memory: {rss_self:.0f}MB (main process), "
+            f"{rss_children:.0f}MB (largest finished subprocess)"
+        )
+    lines += [
+        "For each document and step: the memory (in MB) that its Python allocations",
+        "kept after it finished, their peak while it ran, and the growth of the",
+        "memory of its process (including kernels).",
+    ]
+    header = f"{'':>4} {'kept':>9} {'peak':>9} {'growth':>9}  document"
+    for phase, title in [("read", "reading"), ("write", "writing")]:
+        if not records[phase]:
+            continue
+        lines += ["", f"Heaviest documents when {title} (by peak)", "-" * 40, header]
+        for ii, (docname, rec) in enumerate(_ranked(records[phase], "peak"), 1):
+            lines.append(
+                f"{ii:>4} {rec['kept']:>9.2f} {rec['peak']:>9.2f} "
+                f"{rec['rss']:>9.2f}  {docname}"
+            )
+
+    for step, docs in sorted(records["steps"].items()):
+        total = sum(rec["kept"] for rec in docs.values())
+        lines += [
+            "",
+            f"Step `{step}`: {len(docs)} documents, {total:.2f}MB kept in total",
+            "-" * 40,
+            header,
+        ]
+        for ii, (docname, rec) in enumerate(_ranked(docs, "peak"), 1):
+            lines.append(
+                f"{ii:>4} {rec['kept']:>9.2f} {rec['peak']:>9.2f} "
+                f"{rec['rss']:>9.2f}  {docname}"
+            )
+
+    if records["sites"]:
+        sites = sorted(records["sites"].items(), key=lambda item: -item[1])[:TOP_N]
+        lines += ["", "Allocation sites of memory kept by reading documents", "-" * 40]
+        for ii, (site, size) in enumerate(sites, 1):
+            lines.append(f"{ii:>4} {_mb(size):>9.2f}MB  {site}")
+
+    if env_sizes:
+        total = sum(env_sizes.values())
+        lines += [
+            "",
+            f"Build environment, pickled: {_mb(total):.2f}MB",
+            "-" * 40,
+        ]
+        sizes = sorted(env_sizes.items(), key=lambda item: -item[1])
+        for name, size in sizes:
+            share = 100 * size / total if total else 0
+            lines.append(f"{_mb(size):>9.2f}MB {share:>5.1f}%  {name}")
+    return "\n".join(lines) + "\n"
+
+
+def _profile_notebook_steps():
+    """Profile myst-nb's conversion of notebooks and its adding of outputs.
+
+    Outputs are added from the execution cache, or by executing the notebook.
+    """
+    try:
+        from myst_nb import parser
+    except ImportError:
+        return
+    if not getattr(parser.string_to_notebook, "_jb_profiled", False):
+        parser.string_to_notebook = profiled_step(
+            "notebook conversion", lambda inputstring, env: env.docname
+        )(parser.string_to_notebook)
+    if not getattr(parser.add_notebook_outputs, "_jb_profiled", False):
+        parser.add_notebook_outputs = profiled_step(
+            "notebook outputs", lambda env, *args, **kwargs: env.docname
+        )(parser.add_notebook_outputs)
+
+
+def init_memory_profile(app):
+    """Start tracing allocations, if `profile_memory` is set."""
+    global _profiler
+    if not app.config["profile_memory"]:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _profiler = MemoryProfiler(Path(app.doctreedir, STATS_FOLDER))
+    # Remove records that an earlier, failed, build left behind
+    _profiler.read_stats()
+    builder = app.builder
+    builder.read_doc = _profiler.profile_read(builder.read_doc)
+    builder.write_doc = _profiler.profile_write(builder.write_doc)
+    _profile_notebook_steps()
+
+
+def write_memory_profile(app, exc):
+    """Write the report of the memory profile, and stop tracing allocations.
+
+    The report is also written if the build failed, e.g. to see where it was.
+    """
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.write_stats()
+    records = _profiler.read_stats()
+    _profiler = None
+    tracemalloc.stop()
+    try:
+        env_sizes = environment_sizes(app.env)
+    except Exception as err:
+        logger.warning(f"Could not measure the build environment: {err}")
+        env_sizes = {}
+    report = format_report(records, env_sizes, _peak_rss())
+    path_report = Path(app.outdir).parent.joinpath(MEMORY_PROFILE_FILE)
+    path_report.write_text(report)
+    logger.info(f"Memory profile written to {path_report}")
@@ -0,0 +1,229 @@
+"""Collect build metrics, and write them in machine-readable formats."""
+import os
+import sys
+import json
+from functools import wraps
+from time import perf_counter, time
+from pathlib import Path
+
+# Notebook execution counts in this process. Parallel read workers are forked, so
+# they copy these counts and reset them the first time they count something.
+_counts = {"pid": os.getpid(), "executed": 0, "cache_hits": 0}
+
+
+def _count(key):
+    if _counts["pid"] != os.getpid():
+        _counts.update(pid=os.getpid(), executed=0, cache_hits=0)
+    _counts[key] += 1
+
+
+def _counted(func, key):
+    """Wrap a function so that each successful call is counted as `key`."""
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        out = func(*args, **kwargs)
+        _count(key)
+        return out
+
+    wrapped._jb_counted = True
+    return wrapped
+
+
+def _peak_rss():
+    """The peak memory (in MB) of this process and of its finished subprocesses."""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # `ru_maxrss` is in bytes on macOS, and in kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(rss_self, 1), round(rss_children, 1)
+
+
+def _folder_size(path):
+    """The number of files in a folder and their total size in bytes."""
+    n_files = n_bytes = 0
+    for root, _, files in os.walk(path):
+        for ifile in files:
+            try:
+                n_bytes += os.path.getsize(os.path.join(root, ifile))
+                n_files += 1
+            except OSError:
+                pass
+    return n_files, n_bytes
+
+
+class BuildMetrics:
+    """Time the phases of a build, and count what it did.
+
+    Phases are timed with `start()` and `stop()`. `connect()` hooks into a Sphinx
+    application to time its read and write phases and count documents, notebook
+    executions and warnings.
+    """
+
+    def __init__(self):
+        self.started = time()
+        self._start = perf_counter()
+        self.phases = {}
+        self._phase_starts = {}
+        self.status = "succeeded"
+        self.builder = None
+        self.outdir = None
+        self.documents_read = 0
+        self.documents_written = 0
+        self.warnings = 0
+        self._counts_start = dict(executed=0, cache_hits=0)
+
+    def start(self, phase):
+        self._phase_starts[phase] = perf_counter()
+
+    def stop(self, phase):
+        if phase in self._phase_starts:
+            duration = perf_counter() - self._phase_starts.pop(phase)
+            self.phases[phase] = self.phases.get(phase, 0) + duration
+
+    def connect(self, app):
+        """Record metrics from a Sphinx application, before it builds."""
+        self.builder = app.builder.name
+        self.outdir = app.outdir
+        self._counts_start = {key: _counts[key] for key in ["executed", "cache_hits"]}
+
+        def before_read(app, env, docnames):
+            self.documents_read = len(docnames)
+
+        def record_counts(app, doctree):
+            app.env.jb_execution_counts = dict(_counts)
+
+        def merge_counts(app, env, docnames, other):
+            counts = getattr(other, "jb_execution_counts", None)
+            if counts and counts["pid"] != os.getpid():
+                _counts["executed"] += counts["executed"]
+                _counts["cache_hits"] += counts["cache_hits"]
+
+        def env_updated(app, env):
+            self.stop("read")
+            self.start("write")
+
+        def build_finished(app, exc):
+            self.stop("write")
+            self.warnings = app._warncount
+
+        app.connect("env-before-read-docs", before_read)
+        app.connect("doctree-read", record_counts)
+        app.connect("env-merge-info", merge_counts)
+        app.connect("env-updated", env_updated)
+        app.connect("build-finished", build_finished)
+
+        prepare_writing = app.builder.prepare_writing
+
+        def prepare_writing_counted(docnames):
+            self.documents_written = len(docnames)
+            return prepare_writing(docnames)
+
+        app.builder.prepare_writing = prepare_writing_counted
+
+        # Count notebooks that myst-nb and jupyter-cache execute, and cache hits
+        try:
+            from myst_nb import cache
+            from jupyter_cache.executors import basic
+            from jupyter_cache.cache.main import JupyterCacheBase
+        except ImportError:
+            return
+        if not getattr(cache.execute, "_jb_counted", False):
+            cache.execute = _counted(cache.execute, "executed")
+        if not getattr(basic.executenb, "_jb_counted", False):
+            basic.executenb = _counted(basic.executenb, "executed")
+        merge = JupyterCacheBase.merge_match_into_notebook
+        if not getattr(merge, "_jb_counted", False):
+            JupyterCacheBase.merge_match_into_notebook = _counted(merge, "cache_hits")
+
+    def to_dict(self):
+        """All metrics as a dictionary. Times are in seconds, and sizes in bytes."""
+        counts = _counts if _counts["pid"] == os.getpid() else {}
+        rss_self, rss_children = _peak_rss()
+        n_files, n_bytes = _folder_size(self.outdir) if self.outdir else (0, 0)
+        return {
+            "status": self.status,
+            "started": self.started,
+            "builder": self.builder,
+            "total_seconds": round(perf_counter() - self._start, 3),
+            "phase_seconds": {key: round(val, 3) for key, val in self.phases.items()},
+            "documents_read": self.documents_read,
+            "documents_written": self.documents_written,
+            "notebooks_executed": counts.get("executed", 0)
+            - self._counts_start["executed"],
+            "notebook_cache_hits": counts.get("cache_hits", 0)
+            - self._counts_start["cache_hits"],
+            "warnings": self.warnings,
+            "peak_rss_mb": rss_self,
+            "peak_rss_children_mb": rss_children,
+            "output_files": n_files,
+            "output_bytes": n_bytes,
+        }
+
+    def to_prometheus(self):
+        """All numeric metrics in the Prometheus text exposition format."""
+        metrics = self.to_dict()
+        phases = metrics["phase_seconds"]
+        samples = [
+            (
+                "build_success",
+                "Whether the build succeeded",
+                [({}, int(metrics["status"] == "succeeded"))],
+            ),
+            (
+                "build_timestamp_seconds",
+                "When the build started",
+                [({}, metrics["started"])],
+            ),
+            ("build_seconds", "Total build time", [({}, metrics["total_seconds"])]),
+            (
+                "build_phase_seconds",
+                "Time of each build phase",
+                [({"phase": phase}, seconds) for phase, seconds in phases.items()],
+            ),
+        ]
+        for key, help in [
+            ("documents_read", "Documents read"),
+            ("documents_written", "Documents written"),
+            ("notebooks_executed", "Notebooks executed"),
+            ("notebook_cache_hits", "Notebooks with outputs from the cache"),
+            ("warnings", "Warnings"),
+            ("peak_rss_mb", "Peak memory of the build process in MB"),
+            ("peak_rss_children_mb", "Peak memory of finished subprocesses in MB"),
+            ("output_files", "Files in the output folder"),
+            ("output_bytes", "Total size of the output folder in bytes"),
+        ]:
+            samples.append((key, help, [({}, metrics[key])]))
+
+        lines = []
+        for name, help, values in samples:
+            values = [(labels, value) for labels, value in values if value is not None]
+            if not values:
+                continue
+            lines.append(f"# HELP jupyter_book_{name} {help}")
+            lines.append(f"# TYPE jupyter_book_{name} gauge")
+            for labels, value in values:
+                labels = dict(builder=metrics["builder"], **labels)
+                labels = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"jupyter_book_{name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to `path`, as Prometheus text if it ends in `.prom`.
+
+        Otherwise, the metrics are written as JSON.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".prom":
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2) + "\n"
+        # Write a temporary file first so that collectors never read partial files
+        path_tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        path_tmp.write_text(text)
+        os.replace(path_tmp, path)
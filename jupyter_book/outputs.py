@@ -0,0 +1,257 @@
+"""Limit the size of notebook outputs before they are rendered into the book."""
+import os
+import json
+import posixpath
+from pathlib import Path
+import nbformat as nbf
+from sphinx.util import logging
+
+logger = logging.getLogger(__name__)
+
+# The folder (relative to the HTML output folder) where full outputs are saved
+FULL_OUTPUTS_FOLDER = "_outputs"
+
+# Images are saved in their own files rather than in the page, so they aren't limited
+UNLIMITED_MIMETYPE_PREFIX = "image/"
+
+# The start of the marker added to truncated outputs
+TRUNCATED_MARKER = "[... output truncated:"
+
+
+def _as_text(text):
+    return "".join(text) if isinstance(text, list) else text
+
+
+def _size(value):
+    """The number of characters of an output's text, or of its JSON data."""
+    if isinstance(value, (str, list)):
+        return len(_as_text(value))
+    return len(json.dumps(value))
+
+
+def truncate_text(text, max_size=None, max_lines=None):
+    """Return `text` cut to `max_lines` lines and `max_size` characters.
+
+    Returns None if the text is within both limits.
+    """
+    truncated = text
+    if max_lines:
+        lines = text.splitlines(keepends=True)
+        if len(lines) > max_lines:
+            truncated = "".join(lines[:max_lines])
+    if max_size and len(truncated) > max_size:
+        truncated = truncated[:max_size]
+    if truncated == text:
+        return None
+    return truncated
+
+
+def _truncation_marker(text, truncated):
+    n_lines = len(text.splitlines())
+    n_lines_shown = len(truncated.splitlines())
+    marker = f"{TRUNCATED_MARKER} showing {len(truncated)} of {len(text)} characters"
+    if n_lines_shown < n_lines:
+        marker += f", {n_lines_shown} of {n_lines} lines"
+    marker += "]"
+    if not truncated.endswith("\n"):
+        marker = "\n" + marker
+    return marker
+
+
+def _save_full_output(env, text, cell_index, output_index, suffix=".txt"):
+    """Save an output in the HTML folder, and return a link to it from this page."""
+    docname = env.docname
+    name = f"{docname.replace('/', '-')}-{cell_index}-{output_index}{suffix}"
+    path_output = Path(env.app.outdir).joinpath(FULL_OUTPUTS_FOLDER, name)
+    path_output.parent.mkdir(parents=True, exist_ok=True)
+    path_output.write_text(text, encoding="utf-8")
+    relpath = posixpath.join(FULL_OUTPUTS_FOLDER, name)
+    return posixpath.relpath(relpath, posixpath.dirname(docname) or ".")
+
+
+def _full_output_link(link):
+    """An output with a link to the full text of a truncated output."""
+    return nbf.v4.new_output(
+        "display_data",
+        data={
+            "text/html": (
+                f'<a class="full-output" href="{link}">Download the full output</a>'
+            ),
+            "text/plain": f"{TRUNCATED_MARKER} full output in {link}]",
+        },
+    )
+
+
+def _limit_output(env, output, cell_index, output_index):
+    """Truncate one output in place, if it is over the size limits.
+
+    Stream and plain-text outputs are cut down. Every other mimetype (e.g. HTML
+    tables) can't be cut without breaking it, so it is removed if it is over the
+    size limit, and replaced by a marker if the output has no plain text. Returns
+    whether the output was truncated, and an output that links to its full text
+    if `save_full_outputs` is enabled.
+    """
+    max_size = env.config["max_output_size"]
+    max_lines = env.config["max_output_lines"]
+    if output.get("output_type") == "stream":
+        data = {}
+        text = _as_text(output.get("text", ""))
+    else:
+        data = output.get("data", {})
+        text = _as_text(data.get("text/plain", ""))
+    if TRUNCATED_MARKER in text:
+        # This output has already been truncated
+        return False, None
+
+    too_large = [
+        mime
+        for mime, value in data.items()
+        if mime != "text/plain"
+        and not mime.startswith(UNLIMITED_MIMETYPE_PREFIX)
+        and max_size
+        and _size(value) > max_size
+    ]
+    truncated = truncate_text(text, max_size, max_lines)
+    if truncated is None and not too_large:
+        return False, None
+
+    removed = {mime: data.pop(mime) for mime in too_large}
+    suffix = ".txt"
+    if truncated is not None:
+        truncated += _truncation_marker(text, truncated)
+        if output.get("output_type") == "stream":
+            output["text"] = truncated
+        else:
+            data["text/plain"] = truncated
+    elif not text and not data:
+        # Only rich outputs were removed, so we save the first of them in full
+        mime, value = next(iter(removed.items()))
+        if isinstance(value, (str, list)):
+            text = _as_text(value)
+        else:
+            text = json.dumps(value)
+        suffix = ".html" if mime == "text/html" else ".txt"
+        marker = f"{TRUNCATED_MARKER} {mime} output of {len(text)} characters removed]"
+        data["text/plain"] = marker
+    else:
+        return True, None
+
+    if not env.config["save_full_outputs"]:
+        return True, None
+    link = _save_full_output(env, text, cell_index, output_index, suffix)
+    return True, _full_output_link(link)
+
+
+def _limit_cell_outputs(env, cell, cell_index):
+    """Truncate the outputs of a cell, and return how many were truncated."""
+    if cell.get("cell_type") != "code" or not cell.get("outputs"):
+        return 0
+    n_truncated = 0
+    outputs = []
+    for output_index, output in enumerate(cell["outputs"]):
+        outputs.append(output)
+        truncated, link = _limit_output(env, output, cell_index, output_index)
+        n_truncated += truncated
+        if link is not None:
+            outputs.append(link)
+    cell["outputs"] = outputs
+    return n_truncated
+
+
+def _has_limits(env):
+    return bool(env.config["max_output_size"] or env.config["max_output_lines"])
+
+
+def _report_truncated(env, n_truncated):
+    if n_truncated:
+        logger.info(f"Truncated {n_truncated} large outputs in {env.docname}")
+
+
+def limit_notebook_outputs(env, ntbk):
+    """Truncate the outputs of a notebook that are over the size limits.
+
+    This modifies `ntbk` in place, before it is converted to docutils nodes, so
+    large outputs are never stored in the doctree or written into the HTML. If
+    `save_full_outputs` is enabled, the full text is saved in the `_outputs/`
+    folder of the HTML output and linked to from under the truncated output.
+    """
+    if not _has_limits(env) or not ntbk:
+        return ntbk
+    n_truncated = 0
+    for cell_index, cell in enumerate(ntbk.cells):
+        n_truncated += _limit_cell_outputs(env, cell, cell_index)
+    _report_truncated(env, n_truncated)
+    return ntbk
+
+
+def read_limited_notebook(inputstring, env):
+    """Read an `.ipynb` notebook, truncating the outputs of each cell as it is read.
+
+    The outputs of each cell are limited as soon as the cell is decoded from JSON,
+    so the full text of large outputs is dropped before the notebook is built and
+    validated, rather than once the whole notebook is in memory.
+    """
+    cell_index = n_truncated = 0
+
+    def limit_cell(obj):
+        nonlocal cell_index, n_truncated
+        if "cell_type" in obj:
+            n_truncated += _limit_cell_outputs(env, obj, cell_index)
+            cell_index += 1
+        return obj
+
+    ntbk = nbf.reads(inputstring, nbf.NO_CONVERT, object_hook=limit_cell)
+    _report_truncated(env, n_truncated)
+    return ntbk
+
+
+def _limit_string_to_notebook(string_to_notebook):
+    """Wrap `myst_nb.parser.string_to_notebook`, to truncate outputs saved in files."""
+
+    def wrapped(inputstring, env):
+        extension = os.path.splitext(env.doc2path(env.docname))[1]
+        if extension == ".ipynb" and _has_limits(env):
+            return read_limited_notebook(inputstring, env)
+        return limit_notebook_outputs(env, string_to_notebook(inputstring, env))
+
+    wrapped._jb_limited = True
+    return wrapped
+
+
+def _limit_add_notebook_outputs(add_notebook_outputs):
+    """Wrap `myst_nb.parser.add_notebook_outputs`, to truncate executed outputs."""
+
+    def wrapped(env, ntbk, file_path=None):
+        return limit_notebook_outputs(env, add_notebook_outputs(env, ntbk, file_path))
+
+    wrapped._jb_limited = True
+    return wrapped
+
+
+def init_output_limits(app):
+    """Truncate large outputs as notebooks are read, if output limits are set.
+
+    Outputs are limited as soon as myst-nb has loaded them, from the notebook file
+    or from the execution cache or kernel, before they are parsed.
+    """
+    config = app.config
+    for key in ["max_output_size", "max_output_lines"]:
+        value = config[key]
+        if value is None:
+            continue
+        # `True` and `False` are integers in Python, but they aren't sizes
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f"`{key}` must be a positive integer, got {value!r}")
+    if not (config["max_output_size"] or config["max_output_lines"]):
+        return
+    try:
+        from myst_nb import parser
+    except ImportError:
+        return
+
+    if not getattr(parser.string_to_notebook, "_jb_limited", False):
+        parser.string_to_notebook = _limit_string_to_notebook(parser.string_to_notebook)
+    if not getattr(parser.add_notebook_outputs, "_jb_limited", False):
+        parser.add_notebook_outputs = _limit_add_notebook_outputs(
+            parser.add_notebook_outputs
+        )
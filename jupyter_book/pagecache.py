@@ -0,0 +1,539 @@
+"""Share the pages that a build reads and writes with other builds of the book.
+
+Each page that a build reads is stored in the page cache, with its doctree and its
+data in the build environment, under a hash of its source, its neighbourhood in
+the Table of Contents, the book's configuration and the versions of Sphinx, its
+extensions and other packages. Each page that a build writes is stored with its
+HTML, under a hash of the same inputs and of what the rest of the book contributes
+to the page (titles, navigation, cross-reference targets and numbers). Other
+builds with the same inputs, e.g. other CI/CD runners, restore these pages instead
+of reading or writing them.
+
+Entries are kept by a `PageCacheBackend`. `DirectoryBackend` keeps them in a folder,
+e.g. on a local or network disk. Other backends (e.g. for an object store) can be
+used with the `page_cache_backend` option.
+"""
+import os
+import re
+import glob
+import html
+import json
+import time
+import zlib
+import pickle
+from hashlib import sha256
+from pathlib import Path
+from urllib.parse import unquote
+from docutils import nodes
+from sphinx.environment import BuildEnvironment
+from sphinx.util import import_object, logging
+
+from .cachebundle import environment_fingerprint
+from .plan import _toc_pages, toc_neighbourhood_hash
+from .publish import _hash_file
+from .shard import _merge_env
+
+logger = logging.getLogger(__name__)
+
+# Changed when the format of entries changes, so that older entries aren't used
+PAGE_CACHE_VERSION = 1
+
+# Memory addresses in the `repr` of objects, which differ between builds
+_ADDRESS = re.compile(r" at 0x[0-9a-fA-F]+")
+
+# Links from a page to files in the output folder
+_LINKS = re.compile(r'(?:src|href)="([^"#?]+)')
+
+
+class PageCacheBackend:
+    """Where the page cache keeps its entries, as bytes under string keys.
+
+    Backends are created with the value of the `page_cache` option (e.g. a path or
+    a URL). Several builds may use the same backend at the same time.
+    """
+
+    def __init__(self, location):
+        self.location = location
+
+    def get(self, key):
+        """The data stored under `key`, or None if there is none."""
+        raise NotImplementedError
+
+    def put(self, key, data):
+        """Store `data` under `key`, replacing what was there."""
+        raise NotImplementedError
+
+
+class DirectoryBackend(PageCacheBackend):
+    """Keep entries as files in a folder, e.g. on a local or network disk.
+
+    Entries are written to a temporary file that is then renamed, so that builds
+    sharing the folder never read an entry that is only partly written.
+    """
+
+    def _path(self, key):
+        return Path(self.location).joinpath(key[:2], key)
+
+    def get(self, key):
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path_tmp = path.with_name(f"{key}.{os.getpid()}.tmp")
+        try:
+            path_tmp.write_bytes(data)
+            os.replace(path_tmp, path)
+        finally:
+            if path_tmp.exists():
+                path_tmp.unlink()
+
+
+def _portable(obj, srcdir):
+    """A JSON version of `obj` that is the same for every build with the same inputs.
+
+    Paths in the book are made relative to it, and sets and dicts are sorted.
+    """
+    if isinstance(obj, str):
+        return os.path.relpath(obj, srcdir) if obj.startswith(srcdir) else obj
+    if obj is None or isinstance(obj, (bool, int, float)):
+        return obj
+    if isinstance(obj, dict):
+        items = [
+            [_portable(key, srcdir), _portable(val, srcdir)] for key, val in obj.items()
+        ]
+        return sorted(items, key=lambda item: json.dumps(item[0]))
+    if isinstance(obj, (list, tuple)):
+        return [_portable(item, srcdir) for item in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted((_portable(item, srcdir) for item in obj), key=json.dumps)
+    if isinstance(obj, nodes.Node):
+        return str(obj)
+    return _ADDRESS.sub("", repr(obj))
+
+
+def _hash(obj, srcdir):
+    return sha256(json.dumps(_portable(obj, srcdir)).encode()).hexdigest()
+
+
+def _write_file(path, data):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def _relocate_bibliographies(bibtex_cache, docname, relocate):
+    """Change the paths of the .bib files of a page's bibliographies with `relocate`.
+
+    `sphinxcontrib.bibtex` stores them as absolute paths.
+    """
+    bibliographies = bibtex_cache._bibliographies.get(docname)
+    if bibliographies:
+        bibtex_cache._bibliographies[docname] = {
+            id_: info._replace(bibfiles=[relocate(path) for path in info.bibfiles])
+            for id_, info in bibliographies.items()
+        }
+
+
+def _relocate_dependencies(env, docname, relocate):
+    """Change the paths of the files that a page depends on with `relocate`.
+
+    Most are relative to the book, but some extensions (e.g. `sphinxcontrib.bibtex`)
+    add absolute paths.
+    """
+    if docname in env.dependencies:
+        env.dependencies[docname] = {
+            relocate(path) for path in env.dependencies[docname]
+        }
+
+
+def _linked_files(builder, path_page, text):
+    """Files in the output folder that a page links to, and that are written with
+    the page (e.g. rendered math, or a copy of its source), rather than copied by
+    the builder (e.g. static files, images and downloads).
+
+    Returns their paths, relative to the output folder.
+    """
+    outdir = Path(builder.outdir)
+    copied = {f"{builder.imagedir}/{name}" for name in builder.images.values()}
+    files = set()
+    for link in _LINKS.findall(text):
+        link = unquote(html.unescape(link))
+        if ":" in link or link.endswith(".html"):
+            continue
+        path = Path(os.path.normpath(os.path.join(os.path.dirname(path_page), link)))
+        try:
+            name = path.relative_to(outdir).as_posix()
+        except ValueError:
+            continue
+        if name.split("/")[0] in ["_static", "_downloads"] or name in copied:
+            continue
+        if path.is_file():
+            files.add(name)
+    return files
+
+
+class PageCache:
+    """Restore pages from a `PageCacheBackend`, and store the pages a build makes."""
+
+    def __init__(self, app, backend):
+        self.app = app
+        self.backend = backend
+        self.srcdir = str(app.srcdir)
+        self.path_build = Path(app.outdir).parent
+        self.counts = {"restored": 0, "read": 0, "reused": 0, "written": 0}
+        # The pages that were restored, and those that this build reads
+        self.restored = []
+        self.read_docnames = []
+        self._base = self._base_hash()
+        self._read_keys = {}
+        self._html_keys = {}
+        self._context = None
+
+    def _base_hash(self):
+        """A hash of what all pages depend on, apart from the rest of the book."""
+        app = self.app
+        config = {
+            item.name: item.value
+            for item in app.config
+            if item.rebuild in ["env", "html", True]
+        }
+        templates = {}
+        for path_templates in app.config["templates_path"]:
+            path_templates = Path(self.srcdir, path_templates)
+            for path in sorted(path_templates.rglob("*")):
+                if path.is_file():
+                    templates[str(path)] = _hash_file(path)
+        return _hash(
+            {
+                "version": PAGE_CACHE_VERSION,
+                "builder": app.builder.name,
+                "config": config,
+                "tags": sorted(app.tags),
+                "templates": templates,
+                "extensions": {
+                    name: ext.version for name, ext in app.extensions.items()
+                },
+                "environment": environment_fingerprint(),
+                # Pages refer to the outputs of notebooks by their path from the book
+                "build": os.path.relpath(self.path_build, self.srcdir),
+            },
+            self.srcdir,
+        )
+
+    def _dependency_hashes(self, dependencies):
+        hashes = {}
+        for dep in sorted(dependencies):
+            path = os.path.join(self.srcdir, dep)
+            hashes[dep] = _hash_file(path) if os.path.isfile(path) else None
+        return hashes
+
+    def read_key(self, docname):
+        """The key of a page as it is read, from its inputs."""
+        if docname not in self._read_keys:
+            self._read_keys[docname] = _hash(
+                {
+                    "base": self._base,
+                    "docname": docname,
+                    "source": _hash_file(self.app.env.doc2path(docname)),
+                    "toc": toc_neighbourhood_hash(_toc_pages(self.app), docname),
+                },
+                self.srcdir,
+            )
+        return self._read_keys[docname]
+
+    def context_hash(self):
+        """A hash of what the pages of the book contribute to the HTML of each page."""
+        if self._context is None:
+            env = self.app.env
+            bibtex_cache = getattr(env, "bibtex_cache", None)
+            if bibtex_cache is not None:
+                bibtex_cache = [
+                    bibtex_cache._bibliographies,
+                    bibtex_cache._cited,
+                    bibtex_cache._enum_count,
+                ]
+            context = {
+                "titles": env.titles,
+                "longtitles": env.longtitles,
+                "tocs": env.tocs,
+                "toctree_includes": env.toctree_includes,
+                "numbered_toctrees": env.numbered_toctrees,
+                "secnumbers": env.toc_secnumbers,
+                "fignumbers": env.toc_fignumbers,
+                "domains": env.domaindata,
+                "images": {name: unique for name, (_, unique) in env.images.items()},
+                "downloads": {name: dest for name, (_, dest) in env.dlfiles.items()},
+                "bibtex": bibtex_cache,
+            }
+            self._context = _hash(context, self.srcdir)
+        return self._context
+
+    def html_key(self, docname):
+        """The key of a page as it is written, from its inputs and the book's."""
+        if docname not in self._html_keys:
+            env = self.app.env
+            self._html_keys[docname] = _hash(
+                {
+                    "read": self.read_key(docname),
+                    "dependencies": self._dependency_hashes(env.dependencies[docname]),
+                    "context": self.context_hash(),
+                },
+                self.srcdir,
+            )
+        return self._html_keys[docname]
+
+    def _load(self, key):
+        try:
+            data = self.backend.get(key)
+            return None if data is None else pickle.loads(zlib.decompress(data))
+        except Exception as err:
+            logger.warning(f"Couldn't load page cache entry {key}: {err}")
+            return None
+
+    def _store(self, key, entry):
+        try:
+            data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+            self.backend.put(key, zlib.compress(data))
+        except Exception as err:
+            logger.warning(f"Couldn't store page cache entry {key}: {err}")
+
+    ##########################################################################
+    # Reading
+
+    def restore_doc(self, docname):
+        """Add a page from the cache to the environment, instead of reading it.
+
+        Returns whether the page was in the cache.
+        """
+        app, env = self.app, self.app.env
+        entry = self._load(self.read_key(docname))
+        if entry is None:
+            return False
+        other = entry["env"]
+        if getattr(other, "bibtex_cache", None) is not None:
+            _relocate_bibliographies(
+                other.bibtex_cache,
+                docname,
+                lambda path: os.path.join(self.srcdir, path),
+            )
+        dependencies = self._dependency_hashes(other.dependencies[docname])
+        if dependencies != entry["dependencies"]:
+            return False
+        _relocate_dependencies(
+            other, docname, lambda path: os.path.join(self.srcdir, path)
+        )
+
+        app.emit("env-purge-doc", env, docname)
+        env.clear_doc(docname)
+        _merge_env(env, [docname], other, app)
+        # As if the page was read now, as `Builder.read_doc` does
+        mtime = os.path.getmtime(env.doc2path(docname))
+        env.all_docs[docname] = max(time.time(), mtime)
+        for name, data in entry["files"].items():
+            _write_file(self.path_build.joinpath(name), data)
+        app.builder.write_doctree(docname, entry["doctree"])
+        self.restored.append(docname)
+        self.counts["restored"] += 1
+        return True
+
+    def _doc_env(self, docname):
+        """A build environment with only the data of one page."""
+        app, env = self.app, self.app.env
+        other = BuildEnvironment()
+        other.setup(app)
+        # Some domains (e.g. citation) only add parts of their data when used
+        for name, data in env.domaindata.items():
+            for key, value in data.items():
+                if key not in other.domaindata[name]:
+                    other.domaindata[name][key] = type(value)()
+        other.jb_toc_hashes, other.jb_read_times = {}, {}
+        bibtex_cache = getattr(env, "bibtex_cache", None)
+        if bibtex_cache is not None:
+            other.bibtex_cache = type(bibtex_cache)()
+        _merge_env(other, [docname], env, app)
+        _relocate_dependencies(
+            other,
+            docname,
+            lambda path: os.path.relpath(os.path.join(self.srcdir, path), self.srcdir),
+        )
+        if bibtex_cache is not None:
+            # Every build reads the .bib files itself
+            other.bibtex_cache.bibfiles = {}
+            _relocate_bibliographies(
+                other.bibtex_cache,
+                docname,
+                lambda path: os.path.relpath(path, self.srcdir),
+            )
+        # Only the data of the page is needed to merge it back
+        other.config = other.project = None
+        other.settings = {}
+        return other
+
+    def _generated_files(self, docname, other):
+        """The files that reading a page made in the `_build` folder (e.g. outputs
+        of notebooks), by their path from the `_build` folder."""
+        paths = {
+            Path(os.path.normpath(os.path.join(self.srcdir, filename)))
+            for filename in list(other.images) + list(other.dlfiles)
+        }
+        # myst-nb writes notebooks to `jupyter_execute/`, with their outputs in
+        # files named after the cell, e.g. `page_2_0.png`
+        path_doc = Path(docname)
+        path_outputs = self.path_build.joinpath("jupyter_execute", path_doc.parent)
+        outputs = re.compile(rf"{re.escape(path_doc.name)}(_\d+_\d+)?\.\w+")
+        paths.update(
+            path
+            for path in path_outputs.glob(f"{glob.escape(path_doc.name)}*")
+            if outputs.fullmatch(path.name)
+        )
+        files = {}
+        for path in paths:
+            try:
+                name = path.relative_to(self.path_build).as_posix()
+            except ValueError:
+                continue
+            if path.is_file():
+                files[name] = path.read_bytes()
+        return files
+
+    def store_read_pages(self):
+        """Store the pages that this build has read."""
+        env = self.app.env
+        for docname in self.read_docnames:
+            if docname not in env.all_docs or docname in env.reread_always:
+                continue
+            other = self._doc_env(docname)
+            doctree = env.get_doctree(docname)
+            doctree.settings.env = doctree.reporter = None
+            entry = {
+                "env": other,
+                "doctree": doctree,
+                "dependencies": self._dependency_hashes(other.dependencies[docname]),
+                "files": self._generated_files(docname, other),
+            }
+            self._store(self.read_key(docname), entry)
+            self.counts["read"] += 1
+
+    ##########################################################################
+    # Writing
+
+    def write_cached(self, docnames):
+        """Write the pages that are in the cache.
+
+        Returns the pages that have to be written.
+        """
+        builder, env = self.app.builder, self.app.env
+        missed = []
+        for docname in docnames:
+            entry = self._load(self.html_key(docname))
+            if entry is None:
+                missed.append(docname)
+                continue
+            # Register the page's images to be copied, and add it to the search index
+            builder.write_doc_serialized(docname, env.get_doctree(docname))
+            for name, data in entry["files"].items():
+                _write_file(Path(builder.outdir, name), data)
+            self.counts["reused"] += 1
+        return missed
+
+    def store_written_pages(self, docnames):
+        """Store the pages that this build has written, and the files they link to."""
+        builder = self.app.builder
+        for docname in docnames:
+            path_page = builder.get_outfilename(docname)
+            if not os.path.isfile(path_page):
+                continue
+            data = Path(path_page).read_bytes()
+            text = data.decode("utf-8", errors="replace")
+            files = {os.path.relpath(path_page, builder.outdir): data}
+            for name in _linked_files(builder, path_page, text):
+                files[name] = Path(builder.outdir, name).read_bytes()
+            self._store(self.html_key(docname), {"files": files})
+            self.counts["written"] += 1
+
+
+def _cached_writes(cache, write):
+    """Wrap `Builder._write_serial` or `_write_parallel`, to write pages that are
+    in the cache from it, and store the others once they are written."""
+
+    def write_cached(docnames, *args, **kwargs):
+        missed = cache.write_cached(docnames)
+        if missed:
+            write(missed, *args, **kwargs)
+        cache.store_written_pages(missed)
+
+    return write_cached
+
+
+def init_page_cache(app):
+    """Restore pages from the `page_cache`, and store the pages this build makes.
+
+    Like sharded builds, this wraps `BuildEnvironment.get_outdated_files`, so that
+    extensions (e.g. myst-nb executing notebooks) only see the pages to read.
+    """
+    location = app.config["page_cache"]
+    if not location or app.config["merge_shards"]:
+        return
+    backend = DirectoryBackend
+    if app.config["page_cache_backend"]:
+        backend = import_object(app.config["page_cache_backend"], "page_cache_backend")
+    cache = PageCache(app, backend(location))
+    app._jb_page_cache = cache
+
+    env = app.env
+    get_outdated_files = env.get_outdated_files
+
+    def get_cached_outdated_files(config_changed):
+        added, changed, removed = get_outdated_files(config_changed)
+        # Only wrap the first call, so the environment can still be pickled. Other
+        # wrappers (e.g. of sharded builds) may have removed this one already
+        env.__dict__.pop("get_outdated_files", None)
+        for docname in sorted(added | changed):
+            if cache.restore_doc(docname):
+                added.discard(docname)
+                changed.discard(docname)
+        return added, changed, removed
+
+    env.get_outdated_files = get_cached_outdated_files
+
+    builder = app.builder
+    if builder.name == "html":
+        builder._write_serial = _cached_writes(cache, builder._write_serial)
+        builder._write_parallel = _cached_writes(cache, builder._write_parallel)
+
+
+def record_read_docs(app, env, docnames):
+    """Keep the list of pages that this build reads."""
+    cache = getattr(app, "_jb_page_cache", None)
+    if cache is not None:
+        cache.read_docnames = docnames
+
+
+def store_read_pages(app, env):
+    """Store the pages that were read.
+
+    The restored pages are returned, so that Sphinx also writes the pages whose
+    toctrees include them.
+    """
+    cache = getattr(app, "_jb_page_cache", None)
+    if cache is None:
+        return
+    cache.store_read_pages()
+    return cache.restored
+
+
+def report_page_cache(app, exc):
+    """Report how many pages came from the page cache."""
+    cache = getattr(app, "_jb_page_cache", None)
+    if cache is None or exc is not None:
+        return
+    counts = cache.counts
+    logger.info(
+        f"Page cache: {counts['restored']} of {counts['restored'] + counts['read']} "
+        f"pages read and {counts['reused']} of {counts['reused'] + counts['written']} "
+        "written from the cache"
+    )
@@ -0,0 +1,191 @@
+"""Only load the JavaScript of runtime features (e.g. MathJax) on pages that use them.
+
+Sphinx and its extensions add their scripts to every page of a book, e.g. MathJax
+as soon as one page has math, or the scripts of widgets, Thebelab and the copy
+and toggle buttons. For each page, this works out which of these features its
+doctree uses, and leaves out the scripts of the others.
+"""
+from collections import Counter
+from pathlib import Path
+from docutils import nodes
+from sphinx.util import logging
+from .utils import ProcessStats
+
+logger = logging.getLogger(__name__)
+
+# The scripts of each runtime feature, by a part of their URL or file name
+FEATURE_SCRIPTS = {
+    "math": ["mathjax"],
+    "widgets": ["require.js", "require.min.js", "embed-amd", "@jupyter-widgets"],
+    "thebelab": ["thebelab", "thebe"],
+    "code": ["copybutton", "clipboard"],
+    "toggles": ["togglebutton"],
+}
+
+# Script types (of inline scripts) that configure a runtime feature
+FEATURE_SCRIPT_TYPES = {
+    "text/x-mathjax-config": "math",
+    "text/x-thebe-config": "thebelab",
+}
+
+# Text in raw HTML (e.g. notebook outputs) that shows a page uses a feature
+FEATURE_RAW_TEXT = {
+    "math": ["\\(", "\\[", "$$", "\\begin{"],
+    "widgets": ["application/vnd.jupyter.widget", "require(", "requirejs"],
+    "thebelab": ["thebe"],
+    "toggles": ["toggle"],
+}
+
+# The folder (relative to the doctrees folder) where each process saves its counts
+STATS_FOLDER = "page_scripts"
+
+
+def _script_feature(script):
+    """The runtime feature that a script belongs to, or None."""
+    attributes = getattr(script, "attributes", {})
+    if attributes.get("type") in FEATURE_SCRIPT_TYPES:
+        return FEATURE_SCRIPT_TYPES[attributes["type"]]
+    filename = str(getattr(script, "filename", script) or "").lower()
+    for feature, names in FEATURE_SCRIPTS.items():
+        if any(name in filename for name in names):
+            return feature
+    return None
+
+
+def page_features(doctree):
+    """The runtime features that a page uses, from its doctree."""
+    features = set()
+    for node in doctree.traverse():
+        name = type(node).__name__
+        if isinstance(node, (nodes.math, nodes.math_block)):
+            features.add("math")
+        elif name.startswith("JupyterWidget"):
+            features.add("widgets")
+        elif name == "CellNode":
+            # Code cells can be made executable, and may be hidden behind a toggle
+            features.update(["thebelab", "code", "toggles"])
+        elif isinstance(node, (nodes.literal_block, nodes.doctest_block)):
+            features.add("code")
+        elif isinstance(node, nodes.raw) and "html" in node.get("format", "").split():
+            text = node.astext()
+            for feature, parts in FEATURE_RAW_TEXT.items():
+                if any(part in text for part in parts):
+                    features.add(feature)
+        if isinstance(node, nodes.Element):
+            classes = node.get("classes", [])
+            if any("toggle" in cls or cls.startswith("tag_hide") for cls in classes):
+                features.add("toggles")
+            if "dropdown" in classes:
+                features.add("toggles")
+    return features
+
+
+def _script_name(script):
+    """A name for a script in the counts, e.g. its file name or URL."""
+    filename = getattr(script, "filename", script)
+    if filename:
+        return str(filename)
+    attributes = getattr(script, "attributes", {})
+    return f"<inline {attributes.get('type', 'script')}>"
+
+
+class PageScripts(ProcessStats):
+    """Count the scripts that pages load, before and after leaving some out.
+
+    With parallel writes, each worker process keeps its own counts.
+    """
+
+    def _reset(self):
+        self.pages = 0
+        self.pages_reduced = 0
+        self.before = Counter()
+        self.after = Counter()
+
+    def _stats(self):
+        if self.pages:
+            return {
+                "pages": self.pages,
+                "pages_reduced": self.pages_reduced,
+                "before": self.before,
+                "after": self.after,
+            }
+
+    def add_page(self, before, after):
+        self._check_process()
+        self.pages += 1
+        self.pages_reduced += len(after) < len(before)
+        self.before.update(_script_name(ii) for ii in before)
+        self.after.update(_script_name(ii) for ii in after)
+
+    def read_stats(self):
+        """Combine and remove the counts of all processes."""
+        self._reset()
+        for stats in self.iter_stats():
+            self.pages += stats["pages"]
+            self.pages_reduced += stats["pages_reduced"]
+            self.before.update(stats["before"])
+            self.after.update(stats["after"])
+
+
+def _script_weight(counts, outdir):
+    """The number of scripts, and the bytes of those in the output folder.
+
+    Scripts from other sites (e.g. MathJax from a CDN) are counted, but not sized.
+    """
+    n_bytes = 0
+    for name, count in counts.items():
+        path = Path(outdir, name.split("?")[0])
+        if "://" not in name and not name.startswith("<") and path.is_file():
+            n_bytes += path.stat().st_size * count
+    return sum(counts.values()), n_bytes
+
+
+def init_page_scripts(app):
+    """Count the scripts of each page, if `page_scripts` is `used`."""
+    page_scripts = app.config["page_scripts"]
+    if page_scripts not in ["all", "used"]:
+        raise ValueError(
+            f"`page_scripts` must be 'all' or 'used', got {page_scripts!r}"
+        )
+    if page_scripts != "used" or app.builder.format != "html":
+        return
+    app.builder._jb_page_scripts = PageScripts(Path(app.doctreedir, STATS_FOLDER))
+
+
+def prune_page_scripts(app, pagename, templatename, context, doctree):
+    """Leave out the scripts of the runtime features that a page doesn't use.
+
+    Pages without a doctree (e.g. the search page) keep all their scripts.
+    """
+    page_scripts = getattr(app.builder, "_jb_page_scripts", None)
+    if page_scripts is None or doctree is None or "script_files" not in context:
+        return
+    features = page_features(doctree)
+    before = context["script_files"]
+    # The list is shared by all pages, so it's replaced rather than changed
+    after = [ii for ii in before if _script_feature(ii) in features | {None}]
+    context["script_files"] = after
+    launch_buttons = context.get("theme_launch_buttons")
+    if isinstance(launch_buttons, dict) and "thebelab" not in features:
+        context["theme_launch_buttons"] = dict(launch_buttons, thebelab=False)
+    page_scripts.add_page(before, after)
+
+
+def report_page_scripts(app, exc):
+    """Report the weight of the scripts of each page, before and after."""
+    page_scripts = getattr(app.builder, "_jb_page_scripts", None)
+    if page_scripts is None or exc is not None:
+        return
+    page_scripts.write_stats()
+    page_scripts.read_stats()
+    if not page_scripts.pages:
+        return
+    pages = page_scripts.pages
+    n_before, bytes_before = _script_weight(page_scripts.before, app.outdir)
+    n_after, bytes_after = _script_weight(page_scripts.after, app.outdir)
+    logger.info(
+        f"Page scripts: {page_scripts.pages_reduced} of {pages} pages load fewer "
+        f"scripts, {n_before / pages:.1f} scripts ({bytes_before / pages / 1024:.1f}KB)"
+        f" per page before, {n_after / pages:.1f} ({bytes_after / pages / 1024:.1f}KB)"
+        " after"
+    )
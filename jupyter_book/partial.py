@@ -0,0 +1,140 @@
+"""Build only one entry of the Table of Contents, and the pages under it.
+
+The pages of the entry are read and written as usual. The root page and the
+parents of the entry are read too, since the navigation is built from their
+toctrees. Other pages aren't read: their data from the last build is kept, so that
+cross-references to them still resolve. Pages that have never been read get a
+stub with only their title, so that they are still listed in the navigation.
+"""
+from docutils import nodes
+from sphinx import addnodes
+from sphinx.util import logging
+from sphinx.util.docutils import new_document
+
+from .draft import reuse_navigation
+from .plan import _flatten_toc
+from .toc import _no_suffix, find_name
+from .utils import _filename_to_title
+
+logger = logging.getLogger(__name__)
+
+
+def _toc_parents(toc, name):
+    """The docnames of the parents of a TOC entry, from the root page down."""
+    entries = [(toc, [])]
+    while entries:
+        entry, parents = entries.pop()
+        docname = _no_suffix(entry.get("file"))
+        if docname == name:
+            return parents
+        for section in entry.get("sections", []):
+            entries.append((section, parents + [docname]))
+    return None
+
+
+def only_docnames(toc, only):
+    """The docnames of a TOC entry and its descendants, and of its parents.
+
+    Parameters
+    ----------
+    toc : dict
+        The book's Table of Contents, as `update_indexname` loads it.
+    only : str
+        The `file` of a TOC entry, with or without its suffix.
+
+    Returns
+    -------
+    docnames, parents : set, list
+    """
+    name = _no_suffix(str(only))
+    entry = find_name(toc, name)
+    if entry is None:
+        raise ValueError(f"Couldn't find {only!r} in the Table of Contents.")
+    return set(_flatten_toc(entry)), _toc_parents(toc, name)
+
+
+def _stub_doctree(app, docname, title):
+    """A doctree with only a title, for a page that hasn't been read."""
+    doctree = new_document(app.env.doc2path(docname))
+    section = nodes.section(ids=[nodes.make_id(title) or "stub"])
+    section += nodes.title(title, title)
+    doctree += section
+    return doctree
+
+
+def _add_stub(app, docname, title):
+    """Add a page to the environment's navigation, without reading it."""
+    env = app.env
+    reference = nodes.reference(
+        "", "", nodes.Text(title), internal=True, refuri=docname, anchorname=""
+    )
+    item = nodes.list_item("", addnodes.compact_paragraph("", "", reference))
+    env.tocs[docname] = nodes.bullet_list("", item)
+    env.toc_num_entries[docname] = 1
+    env.titles[docname] = env.longtitles[docname] = nodes.title(title, title)
+    # Section and figure numbering walk the doctrees of all pages in the TOC
+    app.builder.write_doctree(docname, _stub_doctree(app, docname, title))
+
+
+def init_partial_build(app):
+    """Read and write only the pages of the `only` TOC entry, if it is given.
+
+    Like sharded builds, this wraps `BuildEnvironment.get_outdated_files`, so that
+    extensions (e.g. myst-nb executing notebooks) only see the pages to read.
+    """
+    only = app.config["only"]
+    if not only:
+        return
+    if not app.config["globaltoc_path"]:
+        raise ValueError("Building only part of a book requires a Table of Contents.")
+    toc = app.config["globaltoc"]
+    docnames, parents = only_docnames(toc, only)
+    app._jb_only_read = docnames | set(parents) | {app.config["master_doc"]}
+    titles = {
+        docname: entry.get("title") or _filename_to_title(docname)
+        for docname, entry in _flatten_toc(toc).items()
+    }
+
+    env = app.env
+    get_outdated_files = env.get_outdated_files
+
+    def get_partial_outdated_files(config_changed):
+        # Only wrap the first call, so the environment can still be pickled
+        del env.get_outdated_files
+        added, changed, removed = get_outdated_files(config_changed)
+        skip = env.found_docs - app._jb_only_read
+        for docname in sorted(skip - set(env.all_docs)):
+            if docname in titles:
+                _add_stub(app, docname, titles[docname])
+        logger.info(
+            f"Building only {len(docnames)} pages under {only}, "
+            f"skipping {len(added & skip) + len(changed & skip)} outdated pages"
+        )
+        return added - skip, changed - skip, removed
+
+    env.get_outdated_files = get_partial_outdated_files
+
+    # Only write the pages of the entry, and the parents whose toctrees changed
+    builder = app.builder
+    write = builder.write
+
+    def write_partial(build_docnames, updated_docnames, method="update"):
+        if build_docnames is None or build_docnames == ["__all__"]:
+            build_docnames = env.found_docs
+        build_docnames = [ii for ii in build_docnames if ii in docnames]
+        updated_docnames = [ii for ii in updated_docnames if ii in app._jb_only_read]
+        return write(build_docnames, updated_docnames, method)
+
+    builder.write = write_partial
+
+    # Resolve the navigation once, as draft builds do, since it spans the whole book
+    if not app.config["draft"] and builder.format == "html":
+        builder._jb_navs = {}
+        app.connect("html-page-context", reuse_navigation)
+
+
+def filter_partial_docs(app, env, docnames):
+    """Don't read pages outside of the `only` entry that extensions asked for."""
+    only_read = getattr(app, "_jb_only_read", None)
+    if only_read is not None:
+        docnames[:] = [ii for ii in docnames if ii in only_read]
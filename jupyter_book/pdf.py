@@ -5,7 +5,7 @@ import asyncio
 from .utils import _error
 
 
-def html_to_pdf(html_file, pdf_file):
+def html_to_pdf(html_file, pdf_file, wait_for_mathjax=True):
     """
     Convert arbitrary HTML file to PDF using pyppeteer.
 
@@ -15,11 +15,16 @@ def html_to_pdf(html_file, pdf_file):
         A path to an HTML file to convert to PDF
     pdf_file : str
         A path to an output PDF file that will be created
+    wait_for_mathjax : bool
+        Whether to wait for the network to be idle so that MathJax can render.
+        This isn't needed if math was pre-rendered at build time.
     """
-    asyncio.get_event_loop().run_until_complete(_html_to_pdf(html_file, pdf_file))
+    asyncio.get_event_loop().run_until_complete(
+        _html_to_pdf(html_file, pdf_file, wait_for_mathjax)
+    )
 
 
-async def _html_to_pdf(html_file, pdf_file):
+async def _html_to_pdf(html_file, pdf_file, wait_for_mathjax=True):
     try:
         from pyppeteer import launch
     except ImportError:
@@ -35,7 +40,8 @@ async def _html_to_pdf(html_file, pdf_file):
     html_file = Path(html_file).resolve()
 
     # Waiting for networkidle0 seems to let mathjax render
-    await page.goto(f"file:///{html_file}", {"waitUntil": ["networkidle0"]})
+    wait_until = "networkidle0" if wait_for_mathjax else "load"
+    await page.goto(f"file:///{html_file}", {"waitUntil": [wait_until]})
     # Give it *some* margins to make it look a little prettier
     # I just made these up
     page_margins = {"left": "0in", "right": "0in", "top": ".5in", "bottom": ".5in"}
@@ -0,0 +1,259 @@
+"""Track what each page depends on, and plan which pages a build will re-read."""
+import os
+import json
+from time import perf_counter
+from hashlib import sha1
+from pathlib import Path
+from sphinx.environment import CONFIG_OK, CONFIG_CHANGED_REASON
+from sphinx.util import logging
+
+from .toc import _no_suffix
+from .utils import _message_box
+
+logger = logging.getLogger(__name__)
+
+# The start time of each document that is currently being read in this process
+_read_starts = {}
+
+
+def _flatten_toc(toc):
+    """Return a dictionary of {docname: TOC entry} for every page in the TOC."""
+    pages = {}
+    entries = [toc] if isinstance(toc, dict) else list(toc)
+    while entries:
+        entry = entries.pop()
+        if entry.get("file"):
+            pages[_no_suffix(entry["file"])] = entry
+        entries.extend(entry.get("sections", []))
+    return pages
+
+
+def toc_neighbourhood_hash(toc_pages, docname):
+    """A hash of the parts of the TOC that `add_toctree` uses for this page.
+
+    These are the files, titles and headers of the page's direct children, and the
+    page's own options. If this changes, the toctree generated for the page changes.
+    """
+    page = toc_pages.get(docname)
+    if page is None:
+        return None
+    neighbourhood = {
+        "sections": [
+            {key: ipage.get(key) for key in ["file", "title", "header"]}
+            for ipage in page.get("sections", [])
+        ],
+        "numbered": page.get("numbered"),
+        "expand_sections": "expand_sections" in page,
+    }
+    return sha1(json.dumps(neighbourhood, sort_keys=True).encode()).hexdigest()
+
+
+def _toc_pages(app):
+    """The flattened global TOC, computed once per build."""
+    if not app.config["globaltoc_path"]:
+        return {}
+    if getattr(app, "_jb_toc_pages", None) is None:
+        app._jb_toc_pages = _flatten_toc(app.config["globaltoc"])
+    return app._jb_toc_pages
+
+
+##############################################################################
+# Recording dependencies and timings in the build environment
+
+
+def init_build_records(app):
+    """Add our per-document records to the environment, if they aren't there."""
+    if not hasattr(app.env, "jb_toc_hashes"):
+        app.env.jb_toc_hashes = {}
+    if not hasattr(app.env, "jb_read_times"):
+        app.env.jb_read_times = {}
+
+
+def record_read_start(app, docname, source):
+    """Record the TOC neighbourhood of a page, and when we started reading it."""
+    app.env.jb_toc_hashes[docname] = toc_neighbourhood_hash(_toc_pages(app), docname)
+    _read_starts[docname] = perf_counter()
+
+
+def record_read_end(app, doctree):
+    """Record how long it took to read a page."""
+    docname = app.env.docname
+    if docname in _read_starts:
+        app.env.jb_read_times[docname] = perf_counter() - _read_starts.pop(docname)
+
+
+def purge_build_records(app, env, docname):
+    getattr(env, "jb_toc_hashes", {}).pop(docname, None)
+    getattr(env, "jb_read_times", {}).pop(docname, None)
+
+
+def merge_build_records(app, env, docnames, other):
+    """Merge records from parallel read workers."""
+    for docname in docnames:
+        if docname in other.jb_toc_hashes:
+            env.jb_toc_hashes[docname] = other.jb_toc_hashes[docname]
+        if docname in other.jb_read_times:
+            env.jb_read_times[docname] = other.jb_read_times[docname]
+
+
+def get_toc_outdated(app, builder, added, changed, removed):
+    """Return pages whose TOC neighbourhood has changed since they were last read.
+
+    Only these pages need to be re-read when `_toc.yml` changes, rather than the
+    whole book.
+    """
+    outdated = []
+    if not app.config["globaltoc_path"]:
+        return outdated
+    toc_pages = _toc_pages(app)
+    for docname, old_hash in app.env.jb_toc_hashes.items():
+        if docname in added or docname in changed:
+            continue
+        if toc_neighbourhood_hash(toc_pages, docname) != old_hash:
+            outdated.append(docname)
+    return outdated
+
+
+##############################################################################
+# Planning a build
+
+
+def _outdated_reason(env, docname):
+    """Why Sphinx considers a document to be outdated, or None if it is up to date.
+
+    This mirrors `BuildEnvironment.get_outdated_files`.
+    """
+    if docname not in env.all_docs:
+        return "new document"
+    if not os.path.isfile(os.path.join(env.doctreedir, docname + ".doctree")):
+        return "no cached doctree"
+    if docname in env.reread_always:
+        return "always re-read"
+    mtime = env.all_docs[docname]
+    if os.path.getmtime(env.doc2path(docname)) > mtime:
+        return "source changed"
+    for dep in env.dependencies[docname]:
+        deppath = os.path.join(env.srcdir, dep)
+        if not os.path.isfile(deppath) or os.path.getmtime(deppath) > mtime:
+            return f"dependency changed: {dep}"
+    return None
+
+
+def _execution_reason(app, docname):
+    """Whether myst-nb will execute a notebook when it is re-read."""
+    env = app.env
+    mode = app.config["jupyter_execute_notebooks"]
+    path = env.doc2path(docname)
+    if mode == "off" or path in getattr(env, "excluded_nb_exec_paths", []):
+        return None
+    if Path(path).suffix not in getattr(env, "allowed_nb_exec_suffixes", []):
+        return None
+    if mode == "force":
+        return "will execute"
+    try:
+        from myst_nb.converter import path_to_notebook
+        from jupyter_cache import get_cache
+
+        ntbk = path_to_notebook(path)
+        if mode == "auto":
+            code_cells = [ii for ii in ntbk.cells if ii.cell_type == "code"]
+            if any(not ii.get("outputs") for ii in code_cells):
+                return "will execute (missing outputs)"
+        elif mode == "cache":
+            path_cache = app.config["jupyter_cache"]
+            if not path_cache:
+                path_cache = Path(app.outdir).parent.joinpath(".jupyter_cache")
+            try:
+                get_cache(path_cache).match_cache_notebook(ntbk)
+            except KeyError:
+                return "execution cache miss"
+    except Exception as err:
+        logger.verbose(f"Could not check execution for {docname}: {err}")
+    return None
+
+
+def get_build_plan(app):
+    """Work out which documents a build would re-read, and why, without building.
+
+    Returns
+    -------
+    plan : list of dict
+        One entry per outdated document, with ``docname``, ``reasons`` (a list of
+        strings) and ``seconds`` (the time it took to read in the last build, or
+        None if unknown).
+    removed : list
+        Documents that were removed since the last build.
+    """
+    env = app.env
+    env.find_files(app.config, app.builder)
+    init_build_records(app)
+    reasons = {}
+
+    if env.config_status != CONFIG_OK:
+        reason = CONFIG_CHANGED_REASON[env.config_status] + env.config_status_extra
+        for docname in env.found_docs:
+            reasons[docname] = [reason]
+    else:
+        for docname in env.found_docs:
+            reason = _outdated_reason(env, docname)
+            if reason:
+                reasons[docname] = [reason]
+
+    # TOC neighbourhoods (the toctrees that `add_toctree` generates)
+    for docname in get_toc_outdated(app, app.builder, set(), set(), set()):
+        if docname in env.found_docs:
+            reasons.setdefault(docname, []).append("TOC neighbourhood changed")
+
+    plan = []
+    for docname in sorted(reasons):
+        execution = _execution_reason(app, docname)
+        if execution:
+            reasons[docname].append(execution)
+        plan.append(
+            {
+                "docname": docname,
+                "reasons": reasons[docname],
+                "seconds": env.jb_read_times.get(docname),
+            }
+        )
+    removed = sorted(set(env.all_docs) - env.found_docs)
+    return plan, removed
+
+
+def print_build_plan(app):
+    """Print which documents a build would re-read, why, and how long it may take."""
+    plan, removed = get_build_plan(app)
+    n_docs = len(app.env.found_docs)
+    if not plan and not removed:
+        _message_box(f"All {n_docs} documents are up to date. Nothing to re-read.")
+        return plan
+
+    # Estimate the time for documents we have no timing for with the average
+    times = list(app.env.jb_read_times.values())
+    average = sum(times) / len(times) if times else None
+    total = 0
+    lines = []
+    width = max([len(ii["docname"]) for ii in plan] + [10])
+    for item in plan:
+        seconds = item["seconds"]
+        if seconds is None and average is not None:
+            seconds = average
+            estimate = f"~{seconds:.1f}s"
+        elif seconds is None:
+            estimate = "unknown"
+        else:
+            estimate = f"{seconds:.1f}s"
+        total += seconds or 0
+        reasons = "; ".join(item["reasons"])
+        lines.append(f"{item['docname']:<{width}}  {estimate:>8}  {reasons}")
+    for docname in removed:
+        lines.append(f"{docname:<{width}}  {'':>8}  removed")
+    lines = "\n".join(lines)
+
+    msg = (
+        f"Build plan: {len(plan)} of {n_docs} documents will be re-read.\n"
+        f"Estimated read time (from the last build): {total:.1f}s\n\n"
+        f"{lines}"
+    )
+    _message_box(msg, color="blue")
+    return plan
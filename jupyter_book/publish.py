@@ -0,0 +1,246 @@
+"""Publish a built book, copying only the files that changed since the last time."""
+import os
+import re
+import json
+import shutil
+import tempfile
+import subprocess
+from hashlib import sha256
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# The file, in the HTML output and in the publish target, that lists every file
+# of the book with its hash
+MANIFEST_FILENAME = ".jupyter-book-manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _hash_file(path):
+    key = sha256()
+    with open(path, "rb") as ff:
+        for chunk in iter(lambda: ff.read(1 << 20), b""):
+            key.update(chunk)
+    return key.hexdigest()
+
+
+def _parse_manifest(text):
+    try:
+        manifest = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("files", {})
+
+
+def load_manifest(path_manifest):
+    """The files listed in a manifest, or an empty dict if there is none."""
+    path_manifest = Path(path_manifest)
+    if not path_manifest.exists():
+        return {}
+    return _parse_manifest(path_manifest.read_text())
+
+
+def build_manifest(path_output, previous=None):
+    """List the files in `path_output`, with their `hash`, `size` and `mtime`.
+
+    Files whose size and modification time are the same as in the `previous`
+    manifest aren't hashed again.
+    """
+    path_output = Path(path_output)
+    previous = previous or {}
+    files = {}
+    for root, dirs, filenames in os.walk(path_output):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = Path(root, filename)
+            name = path.relative_to(path_output).as_posix()
+            if name == MANIFEST_FILENAME:
+                continue
+            stat = path.stat()
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+            old = previous.get(name, {})
+            if old.get("size") == entry["size"] and old.get("mtime") == entry["mtime"]:
+                entry["hash"] = old["hash"]
+            else:
+                entry["hash"] = _hash_file(path)
+            files[name] = entry
+    return files
+
+
+def _dump_manifest(files):
+    return json.dumps({"version": MANIFEST_VERSION, "files": files}, indent=1)
+
+
+def write_manifest(path_output):
+    """Write the manifest of the files in `path_output`, and return its files."""
+    path_manifest = Path(path_output).joinpath(MANIFEST_FILENAME)
+    files = build_manifest(path_output, load_manifest(path_manifest))
+    path_tmp = path_manifest.with_name(path_manifest.name + ".tmp")
+    path_tmp.write_text(_dump_manifest(files))
+    os.replace(path_tmp, path_manifest)
+    return files
+
+
+def diff_manifests(new, old):
+    """The files of `new` that are missing from or different in `old`, and the
+    files of `old` that aren't in `new` any more."""
+    changed = [
+        name
+        for name, entry in new.items()
+        if old.get(name, {}).get("hash") != entry["hash"]
+    ]
+    stale = [name for name in old if name not in new]
+    return changed, stale
+
+
+def is_rsync_target(target):
+    """Whether `target` is an rsync destination, like `host:path` or `rsync://`."""
+    target = str(target)
+    if re.match(r"^[A-Za-z]:[\\/]", target):
+        # A Windows path like C:\book
+        return False
+    return target.startswith("rsync://") or bool(re.match(r"^[^/\\]+:", target))
+
+
+def _chunks(items, nchunks):
+    return [items[ii::nchunks] for ii in range(nchunks) if items[ii::nchunks]]
+
+
+class LocalTarget:
+    """Publish to a folder."""
+
+    def __init__(self, target):
+        self.path = Path(target)
+
+    def read_manifest(self):
+        return load_manifest(self.path.joinpath(MANIFEST_FILENAME))
+
+    def _copy(self, path_from, name):
+        path_to = self.path.joinpath(name)
+        path_to.parent.mkdir(parents=True, exist_ok=True)
+        # Copy next to the file first, so that readers never see half a file
+        path_tmp = path_to.with_name(f".{path_to.name}.{os.getpid()}.tmp")
+        shutil.copy2(path_from, path_tmp)
+        os.replace(path_tmp, path_to)
+
+    def copy(self, path_output, names, jobs):
+        with ThreadPoolExecutor(jobs) as pool:
+            futures = [
+                pool.submit(self._copy, path_output.joinpath(name), name)
+                for name in names
+            ]
+        for future in futures:
+            future.result()
+
+    def delete(self, names):
+        folders = set()
+        for name in names:
+            path = self.path.joinpath(name)
+            if path.is_file():
+                path.unlink()
+            folders.update(Path(name).parents)
+        # Remove the folders that are empty now, deepest first
+        for folder in sorted(folders, key=lambda ff: len(ff.parts), reverse=True):
+            path = self.path.joinpath(folder)
+            if folder.parts and path.is_dir() and not any(path.iterdir()):
+                path.rmdir()
+
+    def write_manifest(self, path_manifest):
+        self._copy(path_manifest, MANIFEST_FILENAME)
+
+
+class RsyncTarget:
+    """Publish to an rsync destination, e.g. a folder on a server over SSH."""
+
+    def __init__(self, target):
+        self.target = str(target).rstrip("/") + "/"
+
+    def _rsync(self, *args):
+        try:
+            result = subprocess.run(
+                ["rsync", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise RuntimeError("Publishing to an rsync destination requires rsync.")
+        if result.returncode:
+            raise RuntimeError(
+                f"rsync failed with exit code {result.returncode}:\n"
+                + result.stderr.decode(errors="replace")
+            )
+
+    def read_manifest(self):
+        with tempfile.TemporaryDirectory() as path_tmp:
+            try:
+                self._rsync("-q", self.target + MANIFEST_FILENAME, path_tmp + "/")
+            except RuntimeError:
+                # Nothing has been published yet
+                return {}
+            return load_manifest(Path(path_tmp, MANIFEST_FILENAME))
+
+    def _push(self, path_output, names, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as ff:
+            ff.write("\n".join(names) + "\n")
+        try:
+            self._rsync(
+                "-rlt", *args, f"--files-from={ff.name}", f"{path_output}/", self.target
+            )
+        finally:
+            os.remove(ff.name)
+
+    def copy(self, path_output, names, jobs):
+        # Each rsync process copies one share of the files
+        with ThreadPoolExecutor(jobs) as pool:
+            futures = [
+                pool.submit(self._push, path_output, chunk)
+                for chunk in _chunks(sorted(names), jobs)
+            ]
+        for future in futures:
+            future.result()
+
+    def delete(self, names):
+        # The stale files don't exist in an empty folder, so rsync deletes them
+        with tempfile.TemporaryDirectory() as path_empty:
+            self._push(path_empty, names, "--delete-missing-args")
+
+    def write_manifest(self, path_manifest):
+        self._rsync("-t", str(path_manifest), self.target + MANIFEST_FILENAME)
+
+
+def publish_book(path_output, target, jobs=None, dry_run=False):
+    """Publish the built book in `path_output` to `target`.
+
+    Only the files that are new or have changed since the last publish are
+    copied, and files that aren't part of the book any more are deleted. The
+    manifest of the book is copied last, so an interrupted publish is finished
+    the next time.
+
+    Returns
+    -------
+    changed, stale : list of str
+        The files that were copied, and those that were deleted.
+    """
+    path_output = Path(path_output)
+    path_manifest = path_output.joinpath(MANIFEST_FILENAME)
+    if not path_manifest.exists():
+        raise FileNotFoundError(
+            f"Couldn't find a manifest of the book in {path_output}. "
+            "Build the book's HTML first."
+        )
+    # Pick up files that were changed after the build
+    files = write_manifest(path_output)
+    if is_rsync_target(target):
+        target = RsyncTarget(target)
+    else:
+        target = LocalTarget(target)
+    changed, stale = diff_manifests(files, target.read_manifest())
+    if dry_run:
+        return changed, stale
+
+    jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+    if changed:
+        target.copy(path_output, changed, jobs)
+    if stale:
+        target.delete(stale)
+    target.write_manifest(path_manifest)
+    return changed, stale
@@ -0,0 +1,268 @@
+"""Split the reading of a book into shards, and merge the shards into one build.
+
+Each shard reads (and executes) only the pages of some of the book's top-level
+chapters, and saves its environment and doctrees. The merge step combines the
+environments of all shards, the same way Sphinx combines parallel read workers,
+and then writes the whole book so that cross-references, navigation and the
+search index are consistent.
+"""
+import json
+import pickle
+import shutil
+from pathlib import Path
+from sphinx.application import ENV_PICKLE_FILENAME
+from sphinx.util import logging
+
+from .plan import _flatten_toc
+from .toc import _no_suffix
+
+logger = logging.getLogger(__name__)
+
+# The file (in the doctrees folder) that lists the documents a shard has read
+SHARD_INFO_FILENAME = "shard.json"
+
+# Folders next to the doctrees folder with outputs that are needed to write pages
+SHARD_OUTPUT_FOLDERS = ["jupyter_execute"]
+
+
+def parse_shard(shard):
+    """Parse a shard given as "i/N" into (i, N), with i counting from 1."""
+    try:
+        index, n_shards = [int(ii) for ii in str(shard).split("/")]
+    except ValueError:
+        raise ValueError(f"Shard must be of the form 'i/N', got {shard!r}")
+    if not 1 <= index <= n_shards:
+        raise ValueError(f"Shard number must be between 1 and {n_shards}: {shard!r}")
+    return index, n_shards
+
+
+def assign_shards(toc, n_shards):
+    """Assign the pages of the book to shards, by top-level chapter.
+
+    Chapters are the `sections` under the root page of the TOC. They are assigned,
+    largest first, to the shard with the fewest pages so far. The root page is
+    always in the first shard.
+
+    Returns
+    -------
+    shards : list of sets
+        The docnames of each shard.
+    """
+    shards = [set() for _ in range(n_shards)]
+    shards[0].add(_no_suffix(toc["file"]))
+    chapters = [
+        list(_flatten_toc(chapter))
+        for chapter in toc.get("sections", [])
+        if chapter.get("file")
+    ]
+    for chapter in sorted(chapters, key=len, reverse=True):
+        smallest = min(range(n_shards), key=lambda ii: len(shards[ii]))
+        shards[smallest].update(chapter)
+    return shards
+
+
+def _shard_docnames(app, found_docs):
+    """The docnames that this shard should read.
+
+    Pages that aren't in the TOC are read by the first shard.
+    """
+    index, n_shards = parse_shard(app.config["shard"])
+    shards = assign_shards(app.config["globaltoc"], n_shards)
+    docnames = shards[index - 1] & found_docs
+    if index == 1:
+        in_toc = set().union(*shards)
+        docnames.update(found_docs - in_toc)
+    return docnames
+
+
+def _find_shard_doctrees(path):
+    """Find the doctrees folder of a shard, from its `_build` or output folder."""
+    path = Path(path)
+    for path_doctrees in [path, path / ".doctrees", path / "_build" / ".doctrees"]:
+        if path_doctrees.joinpath(SHARD_INFO_FILENAME).exists():
+            return path_doctrees
+    raise ValueError(f"Couldn't find a shard build in: {path}")
+
+
+def _merge_glue_data(data, docnames, otherdata):
+    """Merge myst-nb glue data, whose domain can't merge data itself.
+
+    Glue keys are stored by the docname of each page, or by the path of its output
+    notebook.
+    """
+    for path, keys in otherdata["docmap"].items():
+        path_doc = Path(path).with_suffix("").as_posix()
+        if any(
+            path_doc == docname or path_doc.endswith(f"/{docname}")
+            for docname in docnames
+        ):
+            data["docmap"][path] = keys
+            data["cache"].update({key: otherdata["cache"][key] for key in keys})
+
+
+# Merge functions for domains that don't implement `merge_domaindata`
+DOMAIN_MERGERS = {"glue": _merge_glue_data}
+
+
+def _merge_env(env, docnames, other, app):
+    """Merge info about `docnames` from another environment.
+
+    This is `BuildEnvironment.merge_info_from`, but also merges data of domains and
+    extensions that don't support parallel reads.
+    """
+    for docname in docnames:
+        env.all_docs[docname] = other.all_docs[docname]
+        env.included[docname] = other.included[docname]
+        if docname in other.reread_always:
+            env.reread_always.add(docname)
+
+    for domainname, domain in env.domains.items():
+        try:
+            domain.merge_domaindata(docnames, other.domaindata[domainname])
+        except NotImplementedError:
+            if domainname in DOMAIN_MERGERS:
+                DOMAIN_MERGERS[domainname](
+                    env.domaindata[domainname], docnames, other.domaindata[domainname]
+                )
+            else:
+                logger.warning(f"Can't merge data of the {domainname} domain")
+    _merge_bibtex_cache(env, docnames, other)
+    env.events.emit("env-merge-info", env, docnames, other)
+
+
+def _merge_bibtex_cache(env, docnames, other):
+    """Merge `sphinxcontrib.bibtex` data, which it doesn't merge itself."""
+    cache = getattr(env, "bibtex_cache", None)
+    other_cache = getattr(other, "bibtex_cache", None)
+    if cache is None or other_cache is None:
+        return
+    cache.bibfiles.update(other_cache.bibfiles)
+    for docname in docnames:
+        for attr in ["_bibliographies", "_cited", "_enum_count"]:
+            if docname in getattr(other_cache, attr):
+                getattr(cache, attr)[docname] = getattr(other_cache, attr)[docname]
+
+
+def _copy_folder(path_from, path_to):
+    """Copy all files from one folder into another, if it exists."""
+    if not path_from.is_dir() or path_from.resolve() == path_to.resolve():
+        return
+    for path in path_from.rglob("*"):
+        if path.is_file():
+            path_new = path_to.joinpath(path.relative_to(path_from))
+            path_new.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path, path_new)
+
+
+def merge_shards(app, paths):
+    """Merge the environments and doctrees of shard builds into this build.
+
+    Returns
+    -------
+    merged : set
+        The docnames that were merged, which don't need to be read again.
+    """
+    env = app.env
+    merged = set()
+    n_shards = None
+    for path in paths:
+        path_doctrees = _find_shard_doctrees(path)
+        info = json.loads(path_doctrees.joinpath(SHARD_INFO_FILENAME).read_text())
+        if n_shards is not None and info["n_shards"] != n_shards:
+            raise ValueError("All shards must be built with the same number of shards")
+        n_shards = info["n_shards"]
+
+        with open(path_doctrees.joinpath(ENV_PICKLE_FILENAME), "rb") as ff:
+            other = pickle.load(ff)
+        docnames = set(info["docnames"]) & env.found_docs
+        docnames -= merged
+        _merge_env(env, docnames, other, app)
+        for docname in docnames:
+            path_shard = path_doctrees.joinpath(docname + ".doctree")
+            path_doctree = Path(app.doctreedir, docname + ".doctree")
+            if path_doctree.resolve() == path_shard.resolve():
+                continue
+            path_doctree.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path_shard, path_doctree)
+        for folder in SHARD_OUTPUT_FOLDERS:
+            _copy_folder(
+                path_doctrees.parent.joinpath(folder),
+                Path(app.outdir).parent.joinpath(folder),
+            )
+        merged.update(docnames)
+        logger.info(
+            f"Merged {len(docnames)} documents from shard "
+            f"{info['shard']}/{info['n_shards']}"
+        )
+
+    missing = env.found_docs - merged
+    if missing:
+        logger.warning(
+            f"{len(missing)} documents were not in any shard, so they will be read "
+            f"now: {', '.join(sorted(missing))}"
+        )
+    return merged
+
+
+def init_shards(app):
+    """Read only this shard's pages, or merge shards before reading, if requested.
+
+    This wraps `BuildEnvironment.get_outdated_files`, which runs before the
+    `env-get-outdated` event, so that extensions (e.g. myst-nb executing notebooks)
+    only see the pages that this build will read.
+    """
+    shard = app.config["shard"]
+    merge = app.config["merge_shards"]
+    if not shard and not merge:
+        return
+    if not app.config["globaltoc_path"]:
+        raise ValueError("Sharded builds require a Table of Contents file.")
+
+    env = app.env
+    get_outdated_files = env.get_outdated_files
+
+    def get_shard_outdated_files(config_changed):
+        # Only wrap the first call, so the environment can still be pickled
+        del env.get_outdated_files
+        added, changed, removed = get_outdated_files(config_changed)
+        if shard:
+            # Every shard reads the root page, since Sphinx requires it
+            app._jb_shard_docnames = _shard_docnames(app, env.found_docs)
+            app._jb_shard_read = app._jb_shard_docnames | {app.config["master_doc"]}
+            skip = env.found_docs - app._jb_shard_read
+        else:
+            skip = merge_shards(app, merge)
+        return added - skip, changed - skip, removed
+
+    env.get_outdated_files = get_shard_outdated_files
+
+
+def filter_shard_docs(app, env, docnames):
+    """Don't read pages of other shards that other extensions asked to re-read."""
+    shard_read = getattr(app, "_jb_shard_read", None)
+    if shard_read is not None:
+        docnames[:] = [ii for ii in docnames if ii in shard_read]
+
+
+def read_shard(app):
+    """Read this shard's pages, and save the environment for `jupyter-book merge`.
+
+    Returns
+    -------
+    docnames : list
+        The docnames that this shard has read.
+    """
+    index, n_shards = parse_shard(app.config["shard"])
+    with logging.pending_warnings():
+        app.builder.read()
+    env = app.env
+    env.__dict__.pop("get_outdated_files", None)
+    docnames = sorted(app._jb_shard_docnames & set(env.all_docs))
+
+    path_doctrees = Path(app.doctreedir)
+    with open(path_doctrees.joinpath(ENV_PICKLE_FILENAME), "wb") as ff:
+        pickle.dump(env, ff, pickle.HIGHEST_PROTOCOL)
+    info = {"shard": index, "n_shards": n_shards, "docnames": docnames}
+    path_doctrees.joinpath(SHARD_INFO_FILENAME).write_text(json.dumps(info))
+    app.emit("build-finished", None)
+    return docnames
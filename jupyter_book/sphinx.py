@@ -1,4 +1,5 @@
 """Tools for interacting with Sphinx."""
+import os
 import sys
 import os.path as op
 import yaml
@@ -7,6 +8,12 @@ from sphinx.util.docutils import docutils_namespace, patch_docutils
 from sphinx.application import Sphinx
 from sphinx.cmd.build import handle_exception
 
+from .plan import print_build_plan
+from .shard import read_shard
+from .checkpoint import resume_from_checkpoint, save_checkpoint
+from .publish import write_manifest
+from .draft import draft_extensions
+
 
 REDIRECT_TEXT = """
 <meta http-equiv="Refresh" content="0; url={first_page}" />
@@ -61,6 +68,10 @@ def build_sphinx(
     verbosity=0,
     jobs=None,
     keep_going=False,
+    plan=False,
+    metrics=None,
+    resume=False,
+    draft=False,
 ):
     """Sphinx build "main" command-line entry.
 
@@ -74,6 +85,15 @@ def build_sphinx(
         A list of extra extensions to load into Sphinx. This must be done
         before Sphinx is initialized otherwise the extensions aren't properly
         initialized.
+    plan : bool
+        Print which documents would be re-read, and why, instead of building.
+    metrics : BuildMetrics | None
+        If given, the phases of the build are timed and counted in this object.
+    resume : bool
+        Continue reading from the checkpoint of an interrupted build, if any.
+    draft : bool
+        Build quickly for authoring, without the slow extensions and steps of a
+        full build, and with parallel jobs.
     """
 
     # Manual configuration overrides
@@ -82,6 +102,11 @@ def build_sphinx(
     config = DEFAULT_CONFIG.copy()
     config.update(confoverrides)
 
+    if draft:
+        config["extensions"] = draft_extensions(config["extensions"])
+        config["draft"] = True
+        jobs = jobs or os.cpu_count()
+
     if extra_extensions:
         if not isinstance(extra_extensions, list):
             extra_extensions = [extra_extensions]
@@ -114,6 +139,12 @@ def build_sphinx(
     if jobs is None:
         jobs = 1
 
+    if resume and not freshenv:
+        if resume_from_checkpoint(doctreedir):
+            print("Resuming from the checkpoint of the last build...")
+        else:
+            print("No checkpoint found, so building normally...")
+
     # Manually re-building files in filenames
     if filenames is None:
         filenames = []
@@ -151,6 +182,8 @@ def build_sphinx(
     app = None  # In case we fail, this allows us to handle the exception
     try:
         with patch_docutils(confdir), docutils_namespace():
+            if metrics is not None:
+                metrics.start("init")
             app = Sphinx(
                 sourcedir,
                 confdir,
@@ -178,6 +211,23 @@ def build_sphinx(
                     app.config.latex_documents[0], latexoverrides
                 )
                 app.config.latex_documents = [latex_documents]
+
+            if plan:
+                print_build_plan(app)
+                return app.statuscode
+
+            if metrics is not None:
+                metrics.stop("init")
+                metrics.connect(app)
+                metrics.start("read")
+
+            if app.config["shard"]:
+                # Only read this shard's pages, the rest is done by `merge`
+                read_shard(app)
+                if metrics is not None:
+                    metrics.stop("read")
+                return app.statuscode
+
             app.build(force_all, filenames)
 
             # Write an index.html file in the root to redirect to the first page
@@ -208,7 +258,17 @@ def build_sphinx(
                 first_page = first_page.split(".")[0] + ".html"
                 with open(path_index, "w") as ff:
                     ff.write(REDIRECT_TEXT.format(first_page=first_page))
+
+            # List the files of the book, so that `publish` only copies changes
+            if app.builder.format == "html" and not draft:
+                write_manifest(outputdir)
             return app.statuscode
     except (Exception, KeyboardInterrupt) as exc:
+        if app is not None:
+            # Save the documents that have been read, for `--resume`
+            try:
+                save_checkpoint(app)
+            except Exception:
+                pass
         handle_exception(app, debug_args, exc, error)
         return exc
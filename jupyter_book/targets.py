@@ -0,0 +1,185 @@
+"""Build several versions or languages of a book in one run, with shared caches."""
+import os
+import sys
+import time
+import subprocess
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+
+# Where caches are shared and targets are built, relative to the targets file
+SHARED_CACHE_FOLDER = "_build/.shared_cache"
+TARGETS_OUTPUT_FOLDER = "_build/targets"
+
+# The keys that each target in a targets file may have
+TARGET_KEYS = ["name", "path", "config", "path_output", "builder"]
+
+# Run `jupyter-book` with the same Python as this process
+_JUPYTER_BOOK = [sys.executable, "-c", "from jupyter_book.commands import main; main()"]
+
+
+def load_targets(path_targets):
+    """Read a targets file, and resolve the paths of its targets.
+
+    Paths are relative to the folder of the targets file.
+
+    Returns
+    -------
+    targets : list of dict
+        The `name`, `path` (of the book), `config` (an overlay of the book's
+        configuration, or None), `path_output` and `builder` of each target.
+    path_cache : Path
+        The folder of the caches that are shared by all targets.
+    jobs : int | None
+        How many targets to build at once, if the file says so.
+    """
+    path_targets = Path(path_targets).absolute()
+    root = path_targets.parent
+    data = yaml.safe_load(path_targets.read_text()) or {}
+    if isinstance(data, list):
+        data = {"targets": data}
+    if not isinstance(data, dict) or not data.get("targets"):
+        raise ValueError(f"Found no `targets` in {path_targets}")
+
+    targets = []
+    for target in data["targets"]:
+        if not isinstance(target, dict) or "name" not in target:
+            raise ValueError(f"Each target needs a `name`, got: {target!r}")
+        unknown = set(target) - set(TARGET_KEYS)
+        if unknown:
+            raise ValueError(
+                f"Unknown keys for target {target['name']!r}: {sorted(unknown)}. "
+                f"Must be one of {TARGET_KEYS}"
+            )
+        name = str(target["name"])
+        config = target.get("config")
+        if isinstance(config, str):
+            config = root.joinpath(config)
+        targets.append(
+            {
+                "name": name,
+                "path": root.joinpath(target.get("path", ".")),
+                "config": config,
+                "path_output": root.joinpath(
+                    target.get("path_output", f"{TARGETS_OUTPUT_FOLDER}/{name}")
+                ),
+                "builder": target.get("builder", "html"),
+            }
+        )
+    names = [target["name"] for target in targets]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Target names must be unique, found: {duplicates}")
+
+    path_cache = root.joinpath(data.get("cache", SHARED_CACHE_FOLDER))
+    return targets, path_cache, data.get("jobs")
+
+
+def merge_config(path_book, overlay):
+    """The book's `_config.yml`, updated with an overlay.
+
+    Like the default configuration is updated with a book's, sections (such as
+    `execute`) are updated key by key, and other values are replaced.
+    """
+    path_config = Path(path_book).joinpath("_config.yml")
+    config = {}
+    if path_config.exists():
+        config = yaml.safe_load(path_config.read_text()) or {}
+    if not isinstance(overlay, dict):
+        overlay = yaml.safe_load(Path(overlay).read_text()) or {}
+    for key, val in overlay.items():
+        if isinstance(config.get(key), dict) and isinstance(val, dict):
+            config[key].update(val)
+        else:
+            config[key] = val
+    return config
+
+
+def uses_execution_cache(target):
+    """Whether a target executes its notebooks with the (shared) execution cache."""
+    if target["config"] is None:
+        path_config = Path(target["path"]).joinpath("_config.yml")
+        config = {}
+        if path_config.exists():
+            config = yaml.safe_load(path_config.read_text()) or {}
+    else:
+        config = merge_config(target["path"], target["config"])
+    execute = config.get("execute") or {}
+    return execute.get("execute_notebooks") == "cache"
+
+
+def build_target(target, path_cache, extra_args=()):
+    """Build one target with `jupyter-book build`, and log its output to a file.
+
+    Returns
+    -------
+    returncode : int
+    seconds : float
+        How long the build took.
+    path_log : Path
+    """
+    path_build = Path(target["path_output"]).joinpath("_build")
+    path_build.mkdir(parents=True, exist_ok=True)
+    cmd = _JUPYTER_BOOK + [
+        "build",
+        str(target["path"]),
+        "--path-output",
+        str(target["path_output"]),
+        "--path-cache",
+        str(path_cache),
+        "--builder",
+        target["builder"],
+    ]
+    if target["config"] is not None:
+        path_config = path_build.joinpath("_config.yml")
+        config = merge_config(target["path"], target["config"])
+        path_config.write_text(yaml.safe_dump(config, sort_keys=False))
+        cmd += ["--config", str(path_config)]
+    cmd += list(extra_args)
+
+    path_log = path_build.joinpath("build.log")
+    start = time.perf_counter()
+    with open(path_log, "w") as ff:
+        returncode = subprocess.run(cmd, stdout=ff, stderr=subprocess.STDOUT).returncode
+    return returncode, time.perf_counter() - start, path_log
+
+
+def build_targets(targets, path_cache, jobs=None, extra_args=(), callback=None):
+    """Build targets in a pool of `jobs` processes that share `path_cache`.
+
+    The execution cache is one SQLite database, which only one process can write
+    to at a time, so targets that use it are built one after the other (while
+    the other targets are built alongside them).
+
+    `callback(target, returncode, seconds, path_log)` is called as each target
+    finishes.
+
+    Returns
+    -------
+    failed : list of str
+        The names of the targets that failed to build.
+    """
+    path_cache = Path(path_cache)
+    path_cache.mkdir(parents=True, exist_ok=True)
+    jobs = max(1, min(len(targets), jobs or os.cpu_count() or 1))
+    failed = []
+    cached = {target["name"] for target in targets if uses_execution_cache(target)}
+    cache_lock = threading.Lock()
+
+    def run(target):
+        if target["name"] in cached:
+            with cache_lock:
+                result = build_target(target, path_cache, extra_args)
+        else:
+            result = build_target(target, path_cache, extra_args)
+        returncode, seconds, path_log = result
+        if returncode:
+            failed.append(target["name"])
+        if callback is not None:
+            callback(target, returncode, seconds, path_log)
+
+    with ThreadPoolExecutor(jobs) as pool:
+        for future in [pool.submit(run, target) for target in targets]:
+            future.result()
+    return [target["name"] for target in targets if target["name"] in failed]
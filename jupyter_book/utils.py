@@ -1,8 +1,17 @@
+import os
+import re
+import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util as multiprocessing_util
+from glob import glob
 from pathlib import Path
 from textwrap import dedent
+import yaml
 from jupyter_client.kernelspec import find_kernel_specs
 
 SUPPORTED_FILE_SUFFIXES = [".ipynb", ".md", ".markdown", ".myst", ".Rmd", ".py"]
+MYST_FILE_SUFFIXES = [".md", ".markdown", ".myst"]
+MYST_SKIP_FOLDERS = ["_build", ".ipynb_checkpoints"]
 
 
 def _filename_to_title(filename, split_char="_"):
@@ -20,6 +29,90 @@ def _filename_to_title(filename, split_char="_"):
     return title
 
 
+##############################################################################
+# Build caches
+
+
+def cache_folder(app, name):
+    """The path of a build cache folder, e.g. `.math_cache`.
+
+    Caches are kept in the `_build` folder, unless `cache_path` is set to a folder
+    that is shared by several builds.
+    """
+    root = app.config["cache_path"] or Path(app.outdir).parent
+    return Path(root).joinpath(name)
+
+
+def init_cache_path(app, config):
+    """Keep the execution cache in `cache_path` too, unless `execute.cache` is set.
+
+    myst-nb only uses the execution cache when notebooks are executed with `cache`.
+    """
+    if not config["cache_path"] or config["jupyter_cache"]:
+        return
+    if config["jupyter_execute_notebooks"] != "cache":
+        return
+    path_cache = Path(config["cache_path"]).joinpath(".jupyter_cache")
+    path_cache.mkdir(parents=True, exist_ok=True)
+    config["jupyter_cache"] = str(path_cache)
+
+
+class ProcessStats:
+    """Counts that each process of a build keeps, to be combined at the end of it.
+
+    With parallel reads and writes, Sphinx forks worker processes, which each count
+    their own documents. A worker saves its counts to its own file in `path_stats`
+    once, as it exits, and the main process saves its own at the end of the build,
+    then combines them all with `iter_stats`.
+
+    Subclasses reset their counts in `_reset`, and return them (or None, if there
+    is nothing to save) from `_stats`.
+    """
+
+    def __init__(self, path_stats):
+        self.path_stats = Path(path_stats)
+        self.pid = os.getpid()
+        self._reset()
+
+    def _reset(self):
+        pass
+
+    def _stats(self):
+        return None
+
+    def _check_process(self):
+        """In a forked worker, start counting afresh, and save the counts on exit."""
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self._reset()
+            # Sphinx's workers are `multiprocessing` processes, which run these
+            # finalizers as they exit
+            multiprocessing_util.Finalize(None, self.write_stats, exitpriority=10)
+
+    def write_stats(self):
+        """Write this process's counts, so they can be combined after the build."""
+        stats = self._stats()
+        if os.getpid() != self.pid or stats is None:
+            return
+        self.path_stats.mkdir(parents=True, exist_ok=True)
+        path_file = self.path_stats.joinpath(f"{os.getpid()}.json")
+        path_tmp = path_file.with_suffix(".tmp")
+        path_tmp.write_text(json.dumps(stats))
+        os.replace(path_tmp, path_file)
+
+    def iter_stats(self):
+        """Yield and remove the counts that each process saved."""
+        if not self.path_stats.is_dir():
+            return
+        for path in self.path_stats.glob("*.json"):
+            try:
+                stats = json.loads(path.read_text())
+                path.unlink()
+            except (OSError, ValueError):
+                continue
+            yield stats
+
+
 ##############################################################################
 # CLI utilities
 
@@ -69,27 +162,19 @@ def _error(msg, kind=None):
 # MyST + Jupytext
 
 
-def init_myst_file(path, kernel, verbose=True):
-    """Initialize a file with a Jupytext header that marks it as MyST markdown.
+def _get_kernel(kernel=None, kernels=None):
+    """Return a valid kernel name, choosing the only installed kernel if none given.
 
     Parameters
     ----------
-    path : string
-        A path to a markdown file to be initialized for Jupytext
-    kernel : string
-        A kernel name to add to the markdown file. See a list of kernel names with
-        `jupyter kernelspec list`.
+    kernel : string | None
+        A kernel name. If None, the only installed kernel will be used.
+    kernels : list | None
+        A list of installed kernel names. If None, kernels will be discovered with
+        `find_kernel_specs`. Pass this in to avoid scanning for kernels repeatedly.
     """
-    try:
-        from jupytext.cli import jupytext
-    except ImportError:
-        raise ImportError(
-            "In order to use myst markdown features, " "please install jupytext first."
-        )
-    if not Path(path).exists():
-        raise FileNotFoundError(f"Markdown file not found: {path}")
-
-    kernels = list(find_kernel_specs().keys())
+    if kernels is None:
+        kernels = list(find_kernel_specs().keys())
     kernels_text = "\n".join(kernels)
     if kernel is None:
         if len(kernels) > 1:
@@ -106,9 +191,302 @@ def init_myst_file(path, kernel, verbose=True):
             f"Did not find kernel: {kernel}\nPlease specify one of the "
             f"installed kernels:\n\n{kernels_text}"
         )
+    return kernel
+
+
+def _has_myst_header(path, kernel):
+    """Whether a file already has a MyST Jupytext header with this kernel."""
+    text = Path(path).read_text()
+    if not text.startswith("---"):
+        return False
+    lines = text.split("\n")
+    try:
+        end = lines.index("---", 1)
+    except ValueError:
+        return False
+    try:
+        header = yaml.safe_load("\n".join(lines[1:end]))
+    except yaml.YAMLError:
+        return False
+    if not isinstance(header, dict):
+        return False
+    jupytext_config = header.get("jupytext") or {}
+    text_representation = jupytext_config.get("text_representation") or {}
+    kernelspec = header.get("kernelspec") or {}
+    return (
+        text_representation.get("format_name") == "myst"
+        and kernelspec.get("name") == kernel
+    )
+
+
+def _find_files(paths, suffixes, kind):
+    """Expand a list of files, folders and glob patterns into files of a kind."""
+    files = []
+    for ipath in paths:
+        ipath = str(ipath)
+        if Path(ipath).is_dir():
+            matches = [
+                str(ii)
+                for ii in sorted(Path(ipath).rglob("*"))
+                if ii.suffix in suffixes
+                and not any(part in MYST_SKIP_FOLDERS for part in ii.parts)
+            ]
+        elif Path(ipath).exists():
+            matches = [ipath]
+        else:
+            matches = sorted(glob(ipath, recursive=True))
+            if not matches:
+                raise FileNotFoundError(f"{kind} file not found: {ipath}")
+        for match in matches:
+            if match not in files:
+                files.append(match)
+    return files
+
+
+def _find_myst_files(paths):
+    """Expand a list of files, folders and glob patterns into markdown files."""
+    return _find_files(paths, MYST_FILE_SUFFIXES, "Markdown")
+
+
+def init_myst_file(path, kernel, verbose=True, kernels=None):
+    """Initialize a file with a Jupytext header that marks it as MyST markdown.
+
+    Parameters
+    ----------
+    path : string
+        A path to a markdown file to be initialized for Jupytext
+    kernel : string
+        A kernel name to add to the markdown file. See a list of kernel names with
+        `jupyter kernelspec list`.
+    kernels : list | None
+        A list of installed kernel names, if already known.
+    """
+    try:
+        from jupytext.cli import jupytext
+    except ImportError:
+        raise ImportError(
+            "In order to use myst markdown features, " "please install jupytext first."
+        )
+    if not Path(path).exists():
+        raise FileNotFoundError(f"Markdown file not found: {path}")
+
+    kernel = _get_kernel(kernel, kernels)
 
     args = (str(path), "-q", "--set-kernel", kernel, "--set-formats", "myst")
     jupytext(args)
 
     if verbose:
         print(f"Initialized file: {path}\nWith kernel: {kernel}")
+
+
+def _init_myst_file_worker(path, kernel, kernels):
+    """Initialize one file in a worker, returning its status and an error message."""
+    try:
+        if _has_myst_header(path, kernel):
+            return "skipped", None
+        init_myst_file(path, kernel, verbose=False, kernels=kernels)
+        return "converted", None
+    except Exception as exc:
+        return "failed", str(exc)
+
+
+def init_myst_files(paths, kernel, jobs=None, verbose=True):
+    """Initialize many files with a MyST Jupytext header, in parallel.
+
+    Kernels are only looked up once, and files that already have a MyST header
+    for this kernel are skipped.
+
+    Parameters
+    ----------
+    paths : list
+        Paths to markdown files, folders to search for markdown files,
+        or glob patterns.
+    kernel : string | None
+        A kernel name to add to the markdown files.
+    jobs : int | None
+        The number of processes to use. Defaults to the number of CPUs.
+    verbose : bool
+        Whether to print a summary when finished.
+
+    Returns
+    -------
+    summary : dict
+        A dictionary with ``converted``, ``skipped`` and ``failed`` lists of paths.
+    """
+    files = _find_myst_files(paths)
+    kernels = list(find_kernel_specs().keys())
+    kernel = _get_kernel(kernel, kernels)
+
+    summary = {"converted": [], "skipped": [], "failed": []}
+    errors = {}
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(files)))
+    if jobs == 1:
+        results = [_init_myst_file_worker(ii, kernel, kernels) for ii in files]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                _init_myst_file_worker,
+                files,
+                [kernel] * len(files),
+                [kernels] * len(files),
+            )
+            results = list(results)
+    for path, (status, error) in zip(files, results):
+        summary[status].append(path)
+        if error is not None:
+            errors[path] = error
+
+    if verbose:
+        msg = (
+            f"Kernel: {kernel}\n\n"
+            f"Converted: {len(summary['converted'])}\n"
+            f"Skipped (already initialized): {len(summary['skipped'])}\n"
+            f"Failed: {len(summary['failed'])}"
+        )
+        for path, error in errors.items():
+            msg += f"\n\n{path}\n    {error}"
+        color = "red" if errors else "green"
+        _message_box(msg, color=color)
+    return summary
+
+
+##############################################################################
+# Notebook outputs
+
+# Cell metadata that nbconvert's `ClearOutputPreprocessor` removes with outputs
+OUTPUT_METADATA_FIELDS = ["collapsed", "scrolled"]
+
+# Matches anything that may be an output, so that clean notebooks aren't parsed
+_MAYBE_OUTPUTS = re.compile(
+    r'"outputs":\s*\[\s*[^\]\s]|"execution_count":\s*\d|"(collapsed|scrolled)":'
+)
+
+
+def _clear_cells(ntbk):
+    """Remove the outputs of the code cells of a notebook, in place.
+
+    Returns whether the notebook had any outputs.
+    """
+    changed = False
+    for cell in ntbk.get("cells", []):
+        if cell.get("cell_type") != "code":
+            continue
+        if cell.get("outputs"):
+            cell["outputs"] = []
+            changed = True
+        if cell.get("execution_count") is not None:
+            cell["execution_count"] = None
+            changed = True
+        metadata = cell.get("metadata", {})
+        for field in OUTPUT_METADATA_FIELDS:
+            if field in metadata:
+                del metadata[field]
+                changed = True
+    return changed
+
+
+def clear_notebook_outputs(path, check=False):
+    """Remove the outputs of a notebook, as nbconvert's `ClearOutputPreprocessor` does.
+
+    The notebook is edited as JSON, and only written if it had outputs, in the
+    same format as `nbformat`.
+
+    Parameters
+    ----------
+    path : string
+        A path to a notebook.
+    check : bool
+        Only check whether the notebook has outputs, without removing them.
+
+    Returns
+    -------
+    had_outputs : bool
+    """
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if not _MAYBE_OUTPUTS.search(text):
+        return False
+    ntbk = json.loads(text)
+    if not _clear_cells(ntbk):
+        return False
+    if not check:
+        text = json.dumps(ntbk, sort_keys=True, indent=1, ensure_ascii=False)
+        path.write_text(text + "\n", encoding="utf-8")
+    return True
+
+
+def _clear_outputs_worker(path, check):
+    """Clear one notebook in a worker, returning its status and an error message."""
+    try:
+        if clear_notebook_outputs(path, check=check):
+            return "cleared", None
+        return "clean", None
+    except Exception as exc:
+        return "failed", str(exc)
+
+
+def clear_outputs(paths, jobs=None, check=False, verbose=True):
+    """Remove the outputs of many notebooks, in parallel.
+
+    Notebooks without outputs are skipped, without being rewritten.
+
+    Parameters
+    ----------
+    paths : list
+        Paths to notebooks, folders to search for notebooks, or glob patterns.
+    jobs : int | None
+        The number of processes to use. Defaults to the number of CPUs.
+    check : bool
+        Only list the notebooks that have outputs, without removing them.
+    verbose : bool
+        Whether to print a summary when finished.
+
+    Returns
+    -------
+    summary : dict
+        A dictionary with ``cleared`` (or, with ``check``, still with outputs),
+        ``clean`` and ``failed`` lists of paths.
+    """
+    files = _find_files(paths, [".ipynb"], "Notebook")
+
+    summary = {"cleared": [], "clean": [], "failed": []}
+    errors = {}
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(files)))
+    if jobs == 1:
+        results = [_clear_outputs_worker(ii, check) for ii in files]
+    else:
+        # Send notebooks in chunks, since most of them are quick to check
+        chunksize = max(1, len(files) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                _clear_outputs_worker,
+                files,
+                [check] * len(files),
+                chunksize=chunksize,
+            )
+            results = list(results)
+    for path, (status, error) in zip(files, results):
+        summary[status].append(path)
+        if error is not None:
+            errors[path] = error
+
+    if verbose:
+        if check:
+            msg = f"Notebooks with outputs: {len(summary['cleared'])}"
+            for path in summary["cleared"]:
+                msg += f"\n    {path}"
+        else:
+            msg = f"Cleared: {len(summary['cleared'])}"
+        msg += (
+            f"\nAlready clean: {len(summary['clean'])}\n"
+            f"Failed: {len(summary['failed'])}"
+        )
+        for path, error in errors.items():
+            msg += f"\n\n{path}\n    {error}"
+        color = "red" if errors or (check and summary["cleared"]) else "green"
+        _message_box(msg, color=color)
+    return summary
@@ -43,6 +43,7 @@ def yaml_to_sphinx(yaml, config):
     """Convert a Jupyter Book style config structure into a Sphinx docs structure."""
     sphinx_config = {
         "html_theme_options": {},
+        "html_math_renderer": "mathjax",
         "exclude_patterns": [
             "_build",
             "Thumbs.db",
@@ -85,11 +86,43 @@ def yaml_to_sphinx(yaml, config):
                     )
             theme_options["use_edit_page_button"] = html.get("use_edit_page_button")
 
+        if "highlight_cache_size" in html:
+            sphinx_config["highlight_cache_size"] = html.get("highlight_cache_size")
+
+        if "page_scripts" in html:
+            sphinx_config["page_scripts"] = html.get("page_scripts")
+
+        # Render math to SVG at build time instead of with MathJax in the browser
+        if html.get("prerender_math"):
+            sphinx_config["prerender_math"] = True
+            sphinx_config["html_math_renderer"] = "imgmath"
+            sphinx_config["imgmath_image_format"] = "svg"
+            sphinx_config["imgmath_use_preview"] = True
+
     execute = yaml.get("execute")
     if execute:
         sphinx_config["jupyter_execute_notebooks"] = execute.get("execute_notebooks")
         sphinx_config["jupyter_cache"] = execute.get("cache")
         sphinx_config["execution_excludepatterns"] = execute.get("exclude_patterns")
+        execute_keys = [
+            "max_output_size",
+            "max_output_lines",
+            "save_full_outputs",
+            "kernel_pool_size",
+            "kernel_warmup",
+            "kernel_max_uses",
+            "kernel_max_memory_growth",
+        ]
+        for key in execute_keys:
+            if key in execute:
+                sphinx_config[key] = execute.get(key)
+
+    images = yaml.get("images")
+    if images:
+        sphinx_config["optimize_images"] = images.get("optimize")
+        sphinx_config["image_quality"] = images.get("quality")
+        sphinx_config["image_widths"] = images.get("widths")
+        sphinx_config["latex_image_max_width"] = images.get("latex_max_width")
 
     # Update the theme options in the main config
     sphinx_config["html_theme_options"] = theme_options
@@ -70,6 +70,9 @@ setup(
         "sphinx": doc_reqs,
         "testing": test_reqs,
         "pdfhtml": "pyppeteer",
+        "memory": ["psutil"],
+        "compression": ["lz4", "zstandard"],
+        "images": ["Pillow"],
     },
     entry_points={
         "console_scripts": [
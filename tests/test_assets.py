@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from jupyter_book.assets import AssetCopier
+
+
+def test_asset_copier(tmpdir):
+    path = Path(tmpdir)
+    path_src = path.joinpath("src")
+    path_src.mkdir()
+    for name in ["a.css", "b.js", "c.png"]:
+        path_src.joinpath(name).write_text(name * 100)
+    path_out = path.joinpath("html", "_static")
+
+    copier = AssetCopier(path.joinpath("store"))
+    with copier.batch():
+        for name in ["a.css", "b.js", "c.png"]:
+            copier.copy(path_src.joinpath(name), path_out.joinpath(name))
+        # Later copies to the same file win
+        copier.copy(path_src.joinpath("a.css"), path_out.joinpath("b.js"))
+    assert path_out.joinpath("b.js").read_text() == "a.css" * 100
+    assert copier.counts["unchanged"] == 0
+    assert copier.bytes_written > 0
+
+    # Unchanged files aren't copied again, even if their times have changed
+    copier = AssetCopier(path.joinpath("store"))
+    path_src.joinpath("c.png").touch()
+    with copier.batch():
+        for name in ["a.css", "c.png"]:
+            copier.copy(path_src.joinpath(name), path_out.joinpath(name))
+    assert copier.counts["unchanged"] == 2
+    assert copier.bytes_written == 0
+
+    # Files in the store are linked rather than written again
+    path_out.joinpath("a.css").unlink()
+    copier.copy(path_src.joinpath("a.css"), path_out.joinpath("a.css"))
+    assert path_out.joinpath("a.css").read_text() == "a.css" * 100
+    if copier.use_store:
+        assert copier.bytes_written == 0
+        assert path_out.joinpath("a.css").stat().st_nlink == 3
+        # Files that no output links to are pruned
+        assert copier.prune() == 0
+        path_out.joinpath("c.png").unlink()
+        assert copier.prune() == 1
@@ -1,3 +1,6 @@
+import json
+import pickle
+import shutil
 from pathlib import Path
 from subprocess import run, PIPE
 import pytest
@@ -123,3 +126,278 @@ def test_build_page(tmpdir):
     run(f"jb page {path_page} --path-output {path_output}".split(), check=True)
     path_html = path_output.joinpath("_build", "html")
     assert path_html.joinpath("single_page.html").exists()
+
+
+def test_build_execute_exclude(tmpdir):
+    """Test excluding notebooks from execution when building from another folder."""
+    import nbformat as nbf
+
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    for name in ["run", "skipped"]:
+        ntbk = nbf.v4.new_notebook()
+        ntbk.metadata["kernelspec"] = {"name": "python3", "display_name": "Python 3"}
+        ntbk.metadata["language_info"] = {"name": "python", "file_extension": ".py"}
+        ntbk.cells = [
+            nbf.v4.new_markdown_cell(f"# {name}"),
+            nbf.v4.new_code_cell(f"print('{name}-' * 2)"),
+        ]
+        nbf.write(ntbk, str(path.joinpath(f"{name}.ipynb")))
+    with path.joinpath("_toc.yml").open("a") as ff:
+        ff.write("- file: run\n- file: skipped\n")
+    with path.joinpath("_config.yml").open("a") as ff:
+        ff.write("execute:\n  exclude_patterns: ['skip*']\n")
+
+    path_elsewhere = Path(tmpdir).joinpath("elsewhere")
+    path_elsewhere.mkdir()
+    run(f"jb build {path}".split(), cwd=path_elsewhere, check=True)
+    path_html = path.joinpath("_build", "html")
+    assert "run-run-" in path_html.joinpath("run.html").read_text()
+    assert "skipped-skipped-" not in path_html.joinpath("skipped.html").read_text()
+
+
+def test_build_bibtex_cache(tmpdir):
+    """Test re-using parsed bibliographies, until their .bib file changes."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    # .bib files in excluded folders aren't parsed
+    path.joinpath("drafts").mkdir()
+    path.joinpath("drafts", "drafts.bib").write_text("@misc{draft, title={Draft}}\n")
+    with path.joinpath("_config.yml").open("a") as ff:
+        ff.write("exclude_patterns: [drafts]\n")
+    run(f"jb build {path}".split(), check=True)
+    path_cache = path.joinpath("_build", ".bibtex_cache")
+    (path_pickle,) = path_cache.glob("*.pickle")
+
+    # Once the bibliographies are known, other .bib files aren't parsed either
+    path.joinpath("unused.bib").write_text("@misc{unused, title={Unused}}\n")
+    path.joinpath("syntax.md").touch()
+    run(f"jb build {path}".split(), check=True)
+    assert list(path_cache.glob("*.pickle")) == [path_pickle]
+
+    # A new environment loads the bibliography from the cache. We change the
+    # cached data, to see that it's used instead of parsing the .bib file.
+    data = pickle.loads(path_pickle.read_bytes())
+    data.entries["holdgraf_evidence_2014"].fields["title"] = "A cached title"
+    path_pickle.write_bytes(pickle.dumps(data))
+    shutil.rmtree(path.joinpath("_build", ".doctrees"))
+    run(f"jb build {path}".split(), check=True)
+    path_html = path.joinpath("_build", "html", "syntax.html")
+    assert "A cached title" in path_html.read_text()
+
+    # Editing the .bib file invalidates its cached data
+    path_bib = path.joinpath("references.bib")
+    path_bib.write_text(path_bib.read_text() + "\n")
+    run(f"jb build {path}".split(), check=True)
+    assert not path_pickle.exists()
+    assert len(list(path_cache.glob("*.pickle"))) == 1
+    assert "A cached title" not in path_html.read_text()
+
+
+def test_build_plan(tmpdir):
+    """Test that `--plan` reports outdated pages without building."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    run(f"jb build {path}".split(), check=True)
+
+    out = run(f"jb build {path} --plan".split(), stdout=PIPE, check=True)
+    assert "documents are up to date" in out.stdout.decode()
+
+    # Changing a page's TOC children only outdates that page
+    path_toc = path.joinpath("_toc.yml")
+    toc = path_toc.read_text()
+    toc = toc.replace("- file: notebooks", "- file: notebooks\n      title: NB")
+    path_toc.write_text(toc)
+    path.joinpath("markdown.md").touch()
+    out = run(f"jb build {path} --plan".split(), stdout=PIPE, check=True)
+    plan = out.stdout.decode()
+    assert "2 of 5 documents will be re-read" in plan
+    assert "TOC neighbourhood changed" in plan
+    assert "source changed" in plan
+
+
+def test_build_metrics(tmpdir):
+    """Test writing build metrics as JSON and Prometheus text."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    path_json = Path(tmpdir).joinpath("metrics.json")
+    path_prom = Path(tmpdir).joinpath("metrics.prom")
+    cmd = f"jb build {path} --metrics-file {path_json} --metrics-file {path_prom}"
+    run(cmd.split(), check=True)
+
+    metrics = json.loads(path_json.read_text())
+    assert metrics["status"] == "succeeded"
+    assert metrics["documents_read"] == 5
+    assert metrics["output_bytes"] > 0
+    assert set(metrics["phase_seconds"]) == {"init", "read", "write"}
+    assert 'jupyter_book_documents_read{builder="html"} 5' in path_prom.read_text()
+
+
+def test_build_shards(tmpdir):
+    """Test building a book in shards and merging them."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    path_shards = []
+    for ii in [1, 2]:
+        path_shard = Path(tmpdir).joinpath(f"shard{ii}")
+        run(f"jb build {path} --shard {ii}/2 --path-output {path_shard}".split())
+        path_shards.append(str(path_shard.joinpath("_build")))
+        assert not path_shard.joinpath("_build", "html", "intro.html").exists()
+
+    cmd = f"jb merge {path} {' '.join(path_shards)}"
+    out = run(cmd.split(), stdout=PIPE, stderr=PIPE, check=True)
+    assert "Merged" in out.stdout.decode()
+    assert "were not in any shard" not in out.stderr.decode()
+    path_html = path.joinpath("_build", "html")
+    for page in ["intro", "content", "markdown", "notebooks"]:
+        assert path_html.joinpath(f"{page}.html").exists()
+    assert "notebooks.html" in path_html.joinpath("markdown.html").read_text()
+    assert "markdown" in path_html.joinpath("searchindex.js").read_text()
+
+
+def test_build_resume(tmpdir):
+    """Test resuming a build from a checkpoint."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    run(f"jb build {path}".split(), check=True)
+    path_doctrees = path.joinpath("_build", ".doctrees")
+    # Checkpoints are removed once all pages have been read
+    assert not path_doctrees.joinpath("environment.checkpoint.pickle").exists()
+
+    # A checkpoint of a build that was interrupted before reading `markdown`
+    env = pickle.loads(path_doctrees.joinpath("environment.pickle").read_bytes())
+    env.all_docs.pop("markdown")
+    path_doctrees.joinpath("environment.checkpoint.pickle").write_bytes(
+        pickle.dumps(env)
+    )
+    out = run(f"jb build {path} --resume".split(), stdout=PIPE, check=True)
+    out = out.stdout.decode()
+    assert "Resuming from the checkpoint" in out
+    assert "1 added" in out
+    assert not path_doctrees.joinpath("environment.checkpoint.pickle").exists()
+
+
+def test_build_max_memory(tmpdir):
+    """Test reading pages in parallel within a memory budget."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    out = run(f"jb build {path} --max-memory 4G".split(), stdout=PIPE, check=True)
+    assert "Memory: 5 pages read" in out.stdout.decode()
+    path_records = path.joinpath("_build", ".doctrees", "memory.json")
+    records = json.loads(path_records.read_text())
+    assert set(records) == {"intro", "content", "markdown", "notebooks", "syntax"}
+
+    out = run(f"jb build {path} --max-memory lots".split(), stderr=PIPE)
+    assert out.returncode != 0
+    assert "Memory must be a size" in out.stderr.decode()
+
+
+def test_build_profile_memory(tmpdir):
+    """Test the report of the memory that a build uses."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    run(f"jb build {path} --profile-memory".split(), check=True)
+    report = path.joinpath("_build", "memory_profile.txt").read_text()
+    assert "Heaviest documents when reading" in report
+    assert "Heaviest documents when writing" in report
+    assert "Step `add_toctree`" in report
+    assert "Allocation sites" in report
+    assert "domaindata.std" in report
+    assert "notebooks" in report
+    path_stats = path.joinpath("_build", ".doctrees", "memory_profile")
+    assert not list(path_stats.glob("*.json"))
+
+
+def test_build_targets(tmpdir):
+    """Test building several targets of a book with shared caches."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    path_targets = Path(tmpdir).joinpath("targets.yml")
+    path_targets.write_text(
+        "targets:\n"
+        "  - name: en\n"
+        "    path: mybook\n"
+        "  - name: fr\n"
+        "    path: mybook\n"
+        "    config:\n"
+        "      title: Mon livre\n"
+    )
+    run(f"jb build-targets {path_targets} --jobs 2".split(), check=True)
+    path_out = Path(tmpdir).joinpath("_build")
+    html_en = path_out.joinpath("targets/en/_build/html/intro.html").read_text()
+    html_fr = path_out.joinpath("targets/fr/_build/html/intro.html").read_text()
+    assert "Mon livre" not in html_en
+    assert "Mon livre" in html_fr
+    # Caches are shared, instead of in each target's `_build` folder
+    assert path_out.joinpath(".shared_cache", ".highlight_cache").is_dir()
+    assert not path_out.joinpath("targets/en/_build/.highlight_cache").exists()
+
+
+def test_build_draft(tmpdir):
+    """Test draft builds, which skip the slow parts of a build."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    run(f"jb build {path} --draft".split(), check=True)
+    path_draft = path.joinpath("_build", "draft")
+    assert path_draft.joinpath("html", "intro.html").exists()
+    assert path_draft.joinpath(".doctrees", "environment.pickle").exists()
+    assert not path_draft.joinpath("html", "searchindex.js").exists()
+    assert not path.joinpath("_build", "html").exists()
+    # The navigation is the same as in a full build
+    run(f"jb build {path}".split(), check=True)
+
+    def get_nav(path_html):
+        html = path_html.read_text()
+        html = html[html.index("bd-docs-nav") :]
+        return html[: html.index("</nav>")]
+
+    for page in ["intro", "content", "markdown", "notebooks"]:
+        nav_full = get_nav(path.joinpath("_build", "html", f"{page}.html"))
+        assert get_nav(path_draft.joinpath("html", f"{page}.html")) == nav_full
+
+
+def test_build_only(tmpdir):
+    """Test building one entry of the TOC and the pages under it."""
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    run(f"jb build {path} --only content.md".split(), check=True)
+    path_html = path.joinpath("_build", "html")
+    for page in ["intro", "content", "markdown", "notebooks"]:
+        assert path_html.joinpath(f"{page}.html").exists()
+    assert not path_html.joinpath("syntax.html").exists()
+    # Pages that weren't built are still in the navigation
+    assert 'href="syntax.html"' in path_html.joinpath("content.html").read_text()
+    # A full build afterwards reads them
+    run(f"jb build {path}".split(), check=True)
+    assert path_html.joinpath("syntax.html").exists()
+
+    out = run(f"jb build {path} --only missing".split(), stderr=PIPE)
+    assert out.returncode != 0
+    assert "Couldn't find 'missing'" in out.stderr.decode()
+
+
+def test_build_page_cache(tmpdir):
+    """Test restoring pages that another build has read and written."""
+    path_cache = Path(tmpdir).joinpath("page_cache")
+    path = Path(tmpdir).joinpath("mybook").absolute()
+    run(f"jb create {path}".split())
+    path_other = Path(tmpdir).joinpath("other", "mybook").absolute()
+    shutil.copytree(path, path_other)
+
+    out = run(f"jb build {path} --page-cache {path_cache}".split(), stdout=PIPE)
+    assert "Page cache: 0 of 5 pages read and 0 of 5 written" in out.stdout.decode()
+    # Another copy of the book restores all its pages from the cache
+    cmd = f"jb build {path_other} --page-cache {path_cache}"
+    out = run(cmd.split(), stdout=PIPE, check=True)
+    assert "Page cache: 5 of 5 pages read and 5 of 5 written" in out.stdout.decode()
+    path_html = path_other.joinpath("_build", "html")
+    for page in ["intro", "content", "markdown", "notebooks"]:
+        html = path.joinpath("_build", "html", f"{page}.html").read_text()
+        assert path_html.joinpath(f"{page}.html").read_text() == html
+    assert "markdown" in path_html.joinpath("searchindex.js").read_text()
+
+    # A changed page is read and written again
+    path_md = path_other.joinpath("markdown.md")
+    path_md.write_text(path_md.read_text() + "\nA new paragraph.\n")
+    out = run(cmd.split(), stdout=PIPE, check=True)
+    assert "A new paragraph" in path_html.joinpath("markdown.html").read_text()
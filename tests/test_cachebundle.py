@@ -0,0 +1,96 @@
+import io
+import json
+import tarfile
+from pathlib import Path
+
+import nbformat as nbf
+import pytest
+
+from jupyter_book import cachebundle
+from jupyter_book.cachebundle import export_cache, find_cache_path, import_cache
+
+
+def _executed_notebook(path):
+    ntbk = nbf.v4.new_notebook()
+    ntbk.metadata["kernelspec"] = {"name": "python3", "display_name": "Python 3"}
+    cell = nbf.v4.new_code_cell("print(1)", execution_count=1)
+    cell.outputs = [nbf.v4.new_output("stream", text="1\n")]
+    ntbk.cells = [cell]
+    # jupyter-cache can only hash notebooks without cell IDs (nbformat 4.4)
+    ntbk.nbformat_minor = 4
+    cell.pop("id", None)
+    nbf.write(ntbk, str(path))
+
+
+def test_cache_export_import(tmpdir):
+    from jupyter_cache import get_cache
+
+    path = Path(tmpdir)
+    path_book = path.joinpath("book")
+    path_book.mkdir()
+    _executed_notebook(path_book.joinpath("page.ipynb"))
+    path_book.joinpath("page_0.png").write_bytes(b"PNG")
+    path_cache = find_cache_path(path_book)
+    assert path_cache == path_book.joinpath("_build", ".jupyter_cache")
+    get_cache(str(path_cache)).cache_notebook_file(
+        str(path_book.joinpath("page.ipynb")),
+        artifacts=[str(path_book.joinpath("page_0.png"))],
+        check_validity=False,
+    )
+    path_archive = path.joinpath("cache.tar.gz")
+    assert export_cache(path_cache, path_archive, path_book) == 1
+
+    # The notebook is found in a cache of the book somewhere else
+    path_other = path.joinpath("other")
+    path_other_cache = find_cache_path(path_other)
+    summary = import_cache(path_other_cache, path_archive, path_other)
+    assert summary == {"imported": 1, "skipped": 0}
+    cache = get_cache(str(path_other_cache))
+    ntbk = nbf.read(str(path_book.joinpath("page.ipynb")), nbf.NO_CONVERT)
+    record = cache.match_cache_notebook(ntbk)
+    assert record.uri == str(path_other.absolute().joinpath("page.ipynb"))
+    bundle = cache.get_cache_bundle(record.pk)
+    assert [str(ii) for ii in bundle.artifacts.relative_paths] == ["page_0.png"]
+
+    # Cached notebooks aren't imported again
+    with open(path_archive, "rb") as ff:
+        summary = import_cache(path_other_cache, ff, path_other)
+    assert summary == {"imported": 0, "skipped": 1}
+
+
+def test_cache_import_environment(tmpdir, monkeypatch):
+    path = Path(tmpdir)
+    path_archive = path.joinpath("cache.tar.xz")
+    path.joinpath("empty").mkdir()
+    export_cache(path.joinpath("empty"), path_archive)
+
+    info = cachebundle.environment_info()
+    info["packages"] = info["packages"] + ["another-package==1.0"]
+    monkeypatch.setattr(cachebundle, "environment_info", lambda: info)
+    with pytest.raises(ValueError, match="different environment"):
+        import_cache(path.joinpath("cache"), path_archive)
+    summary = import_cache(path.joinpath("cache"), path_archive, any_environment=True)
+    assert summary == {"imported": 0, "skipped": 0}
+
+
+@pytest.mark.parametrize(
+    "name", ["/tmp/outside.txt", "../outside.txt", "abc/../../outside.txt", "/"]
+)
+def test_cache_import_unsafe(tmpdir, name):
+    path = Path(tmpdir)
+    path_archive = path.joinpath("cache.tar.gz")
+    manifest = {
+        "version": cachebundle.BUNDLE_VERSION,
+        "fingerprint": cachebundle.environment_fingerprint(),
+    }
+    with tarfile.open(path_archive, "w:gz") as tar:
+        cachebundle._add_bytes(
+            tar, cachebundle.MANIFEST_NAME, json.dumps(manifest).encode()
+        )
+        info = tarfile.TarInfo(name)
+        info.size = 4
+        tar.addfile(info, io.BytesIO(b"evil"))
+
+    with pytest.raises(ValueError, match="Unsafe file"):
+        import_cache(path.joinpath("cache"), path_archive)
+    assert not path.joinpath("outside.txt").exists()
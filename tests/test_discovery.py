@@ -0,0 +1,87 @@
+from pathlib import Path
+import os
+import pickle
+from sphinx.util.matching import Matcher
+
+from jupyter_book.discovery import (
+    ExcludeMatcher,
+    ExecutionExcludes,
+    SnapshotProject,
+    snapshot_files,
+)
+
+
+def test_exclude_matcher():
+    matcher = ExcludeMatcher(["_build", "drafts/*.md", "**.ipynb_checkpoints", "a.md"])
+    assert matcher("_build")
+    assert matcher("a.md")
+    assert matcher("drafts/b.md")
+    assert matcher("sub/.ipynb_checkpoints")
+    assert not matcher("drafts/sub/b.md")
+    assert not matcher("sub/a.md")
+    assert not matcher("intro.md")
+    assert not ExcludeMatcher([])("intro.md")
+
+
+def test_exclude_matcher_like_sphinx():
+    # Globs are matched exactly like Sphinx's own `exclude_patterns`
+    patterns = ["**/_build", "d?afts/*.md", "[!_]*.txt", "[^a]b.md", "[oops", "**.pyc"]
+    paths = ["a/_build", "drafts/x.md", "dr/afts/x.md", "a.txt", "_a.txt", "^b.md"]
+    paths += ["cb.md", "[oops", "sub/x.pyc", "sub/a.txt"]
+    matcher, sphinx_matcher = ExcludeMatcher(patterns), Matcher(patterns)
+    for path in paths:
+        assert matcher(path) == sphinx_matcher(path), path
+
+
+def test_snapshot_files(tmpdir):
+    path = Path(tmpdir).joinpath("book")
+    for ifile in ["intro.md", "sub/a.ipynb", "sub/deep/b.md", "_build/html/c.md"]:
+        path.joinpath(ifile).parent.mkdir(parents=True, exist_ok=True)
+        path.joinpath(ifile).write_text("")
+    path_snapshot = Path(tmpdir).joinpath("discovery.pickle")
+    matcher = ExcludeMatcher(["_build"])
+    # Listings of folders that were modified just now aren't re-used
+    old = path.joinpath("sub").stat().st_mtime - 10
+    os.utime(path.joinpath("sub"), (old, old))
+
+    files = snapshot_files(path, matcher, path_snapshot)
+    assert files == ["intro.md", "sub/a.ipynb", "sub/deep/b.md"]
+    assert path_snapshot.exists()
+
+    # Folders whose modification time hasn't changed aren't listed again
+    path.joinpath("sub", "new.md").write_text("")
+    os.utime(path.joinpath("sub"), (old, old))
+    assert "sub/new.md" not in snapshot_files(path, matcher, path_snapshot)
+
+    # Folders that have changed are listed again
+    os.utime(path.joinpath("sub"), (old + 1, old + 1))
+    assert "sub/new.md" in snapshot_files(path, matcher, path_snapshot)
+
+
+def test_snapshot_project(tmpdir, caplog):
+    path = Path(tmpdir)
+    for ifile in ["intro.md", "page.md", "page.ipynb", "_build/c.md"]:
+        path.joinpath(ifile).parent.mkdir(parents=True, exist_ok=True)
+        path.joinpath(ifile).write_text("")
+    suffixes = {".md": "myst-nb", ".ipynb": "myst-nb"}
+    project = SnapshotProject(str(path), suffixes)
+    assert project.discover(["_build"]) == {"intro", "page"}
+    # Documents found in several files are reported, like Sphinx does
+    warnings = [record.getMessage() for record in caplog.records]
+    assert len(warnings) == 1
+    assert 'multiple files found for the document "page"' in warnings[0]
+    assert "['page.ipynb', 'page.md']" in warnings[0]
+
+
+def test_execution_excludes(tmpdir):
+    srcdir = str(Path(tmpdir).joinpath("book"))
+    excludes = ExecutionExcludes(["/elsewhere/a.ipynb"], srcdir, ["skip*.ipynb"])
+    # Paths that myst-nb found, and paths in the book, in any sub-folder
+    assert "/elsewhere/a.ipynb" in excludes
+    assert os.path.join(srcdir, "skip1.ipynb") in excludes
+    assert os.path.join(srcdir, "sub", "skip2.ipynb") in excludes
+    assert os.path.join(srcdir, "run.ipynb") not in excludes
+    assert os.path.join(srcdir, os.pardir, "skip3.ipynb") not in excludes
+    # It is kept in the pickled environment
+    excludes = pickle.loads(pickle.dumps(excludes))
+    assert os.path.join(srcdir, "skip1.ipynb") in excludes
@@ -0,0 +1,60 @@
+import pickle
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from docutils.utils import new_document
+from docutils import nodes
+from sphinx.environment import BuildEnvironment
+from sphinx.project import Project
+from jupyter_book.doctrees import (
+    MAGIC_BYTES,
+    _codec,
+    dump_doctree,
+    init_doctree_storage,
+    load_doctree,
+)
+
+
+def test_doctree_compression(tmpdir):
+    doctree = new_document("test")
+    doctree.settings.env = None
+    doctree.reporter = None
+    doctree += nodes.paragraph(text="Some text " * 100)
+    for compression in [None, "zlib"]:
+        path = Path(tmpdir).joinpath(f"{compression}.doctree")
+        dump_doctree(doctree, path, compression)
+        assert load_doctree(path).astext() == doctree.astext()
+    path_plain = Path(tmpdir).joinpath("None.doctree")
+    path_zlib = Path(tmpdir).joinpath("zlib.doctree")
+    assert path_zlib.read_bytes().startswith(MAGIC_BYTES["zlib"])
+    assert path_zlib.stat().st_size < path_plain.stat().st_size
+
+
+def test_doctree_compression_missing(monkeypatch):
+    # An import of a missing package fails
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    with pytest.raises(ImportError, match=r"jupyter-book\[compression\]"):
+        _codec("zstd")
+
+
+def test_init_doctree_storage(tmpdir):
+    env = BuildEnvironment()
+    env.doctreedir = str(tmpdir)
+    env.project = Project(str(tmpdir), {".md": "markdown"})
+    builder = SimpleNamespace(doctreedir=str(tmpdir))
+    app = SimpleNamespace(
+        env=env, builder=builder, config={"doctree_compression": "zlib"}
+    )
+    init_doctree_storage(app)
+    doctree = new_document("page")
+    doctree += nodes.paragraph(text="Some text")
+    builder.write_doctree("page", doctree)
+    assert Path(tmpdir, "page.doctree").read_bytes().startswith(MAGIC_BYTES["zlib"])
+
+    # Only the build's environment reads compressed doctrees, also once pickled
+    assert env.get_doctree("page").astext() == "Some text"
+    assert BuildEnvironment.get_doctree.__module__ == "sphinx.environment"
+    env = pickle.loads(pickle.dumps(env))
+    assert env.get_doctree("page").astext() == "Some text"
@@ -0,0 +1,55 @@
+"""Testing the cache of highlighted code blocks."""
+import logging
+from pathlib import Path
+from sphinx import highlighting
+from sphinx.highlighting import PygmentsBridge
+from jupyter_book.highlight import HighlightCache
+
+
+def test_highlight_cache(tmpdir, monkeypatch):
+    path_cache = Path(tmpdir).joinpath(".highlight_cache")
+    path_cache.mkdir()
+    highlighter = PygmentsBridge("html", "sphinx")
+    path_stats = Path(tmpdir).joinpath("highlight_stats")
+    cache = HighlightCache(path_cache, highlighter, path_stats)
+    highlighter.highlight_block = cache.highlight_block
+
+    source = "print('hi')"
+    html = highlighter.highlight_block(source, "python")
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert highlighter.highlight_block(source, "python") == html
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A different lexer or options is a different entry
+    highlighter.highlight_block(source, "python", linenos=True)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # Hit counts are combined from the stats files, which aren't in the cache
+    cache.write_stats()
+    assert list(path_stats.glob("*.json"))
+    assert cache.read_stats() == (1, 2)
+
+    # The cache is pruned to its maximum size
+    assert cache.prune(0) == 2
+    highlighter.highlight_block(source, "python")
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # Blocks with highlighting warnings aren't cached
+    highlighter.highlight_block("$$$ ???", "python")
+    highlighter.highlight_block("$$$ ???", "python")
+    assert (cache.hits, cache.misses) == (1, 5)
+
+    # Other messages of the highlighter don't keep blocks out of the cache
+    monkeypatch.setattr(highlighting.logger.logger, "level", logging.DEBUG)
+
+    def highlight_block(source, lang, **kwargs):
+        highlighting.logger.info("Highlighting %s", lang)
+        return html
+
+    cache._highlight_block = highlight_block
+    highlighter.highlight_block("x = 1", "python")
+    highlighter.highlight_block("x = 1", "python")
+    assert (cache.hits, cache.misses) == (2, 6)
+
+    # Warnings are only counted while a block is highlighted
+    assert not highlighting.logger.logger.filters
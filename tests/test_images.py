@@ -0,0 +1,44 @@
+from pathlib import Path
+import json
+
+import pytest
+from jupyter_book.images import ImageOptimizer, optimize_image
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _make_image(path, size=(1200, 800)):
+    img = Image.new("RGB", size, "white")
+    for ii in range(0, size[0], 4):
+        img.paste((ii % 255, 100, 200), (ii, 0, ii + 2, size[1]))
+    img.save(path)
+
+
+def test_optimize_image(tmpdir):
+    path_src = Path(tmpdir).joinpath("plot.png")
+    _make_image(path_src)
+    path_out = Path(tmpdir).joinpath("out")
+    info = optimize_image(path_src, path_out, widths=[400, 2000])
+    assert info == {"width": 1200, "variants": [400]}
+    assert path_out.joinpath("image.png").stat().st_size <= path_src.stat().st_size
+    assert Image.open(path_out.joinpath("image-400w.png")).size == (400, 267)
+    assert json.loads(path_out.joinpath("info.json").read_text()) == info
+
+
+def test_image_optimizer_cache(tmpdir):
+    paths = []
+    for ii in range(2):
+        paths.append(Path(tmpdir).joinpath(f"plot{ii}.jpg"))
+        _make_image(paths[-1], (1200 + ii, 800))
+    optimizer = ImageOptimizer(Path(tmpdir).joinpath("cache"), max_width=600)
+    folders = optimizer.optimize(paths, parallel=2)
+    assert set(folders) == set(paths)
+    for path in paths:
+        assert optimizer.info(path)["width"] == 600
+        assert Image.open(folders[path].joinpath("image.jpg")).size[0] == 600
+
+    # Cached images are found by their content, and aren't optimized again
+    optimizer = ImageOptimizer(Path(tmpdir).joinpath("cache"), max_width=600)
+    mtime = folders[paths[0]].joinpath("image.jpg").stat().st_mtime
+    assert optimizer.optimize(paths) == folders
+    assert folders[paths[0]].joinpath("image.jpg").stat().st_mtime == mtime
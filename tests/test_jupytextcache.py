@@ -0,0 +1,54 @@
+from pathlib import Path
+
+from jupyter_book.jupytextcache import JupytextCache
+
+TEXT = """---
+jupytext:
+  text_representation:
+    format_name: myst
+kernelspec:
+  name: python3
+---
+
+# A notebook
+
+```{code-cell} ipython3
+print(1)
+```
+"""
+
+
+def test_jupytext_cache(tmpdir):
+    calls = []
+
+    def reads(text, fmt=None, **kwargs):
+        calls.append(text)
+        return {"cells": [text], "fmt": fmt}
+
+    path_stats = Path(tmpdir).joinpath("stats")
+    cache = JupytextCache(tmpdir, reads, "1.0", path_stats)
+    ntbk = cache.reads(TEXT, "myst")
+    assert ntbk == {"cells": [TEXT], "fmt": "myst"}
+    # Each call gets its own copy, which can be modified
+    ntbk["cells"].append("new cell")
+    assert cache.reads(TEXT, "myst") == {"cells": [TEXT], "fmt": "myst"}
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(calls) == 1
+
+    # Converted notebooks are kept across builds
+    cache = JupytextCache(tmpdir, reads, "1.0", path_stats)
+    cache.reads(TEXT, "myst")
+    assert len(calls) == 1
+    # ...but not for other formats, texts or Jupytext versions
+    cache.reads(TEXT, "md")
+    cache.reads(TEXT + "\nMore text.\n", "myst")
+    JupytextCache(tmpdir, reads, "2.0", path_stats).reads(TEXT, "myst")
+    assert len(calls) == 4
+    # Notebooks in the ipynb format are not cached
+    cache.reads("{}", "ipynb")
+    cache.reads("{}", "ipynb")
+    assert len(calls) == 6
+
+    cache.write_stats()
+    assert cache.read_stats()[:2] == (1, 2)
+    assert not list(path_stats.iterdir())
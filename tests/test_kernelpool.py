@@ -0,0 +1,26 @@
+import nbformat as nbf
+
+from jupyter_book.kernelpool import KernelPool
+
+
+def test_kernel_pool(tmpdir):
+    """Kernels are re-used and reset between notebooks, and recycled after use."""
+    ntbk = nbf.v4.new_notebook(
+        cells=[
+            nbf.v4.new_code_cell("print('x' in dir())"),
+            nbf.v4.new_code_cell("x = 1"),
+            nbf.v4.new_code_cell("import os; print(os.getcwd())"),
+        ]
+    )
+    ntbk.metadata.kernelspec = {"name": "python3", "language": "python"}
+    pool = KernelPool(1, warmup="import json", max_uses=2)
+    try:
+        for ii in range(3):
+            pool.execute(ntbk, cwd=str(tmpdir))
+            assert ntbk.cells[0].outputs[0]["text"] == "False\n"
+            assert ntbk.cells[0].execution_count == 1
+            assert ntbk.cells[2].outputs[0]["text"] == f"{tmpdir}\n"
+    finally:
+        pool.shutdown()
+    assert pool.started == 2
+    assert pool.reused == 1
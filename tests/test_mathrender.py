@@ -0,0 +1,89 @@
+"""Testing the cache of pre-rendered math."""
+from hashlib import sha1
+from pathlib import Path
+from types import SimpleNamespace
+from sphinx.ext import imgmath
+from jupyter_book import mathrender
+
+
+def _config(**values):
+    config = {
+        "imgmath_image_format": "svg",
+        "imgmath_font_size": 12,
+        "imgmath_latex_preamble": "",
+        "imgmath_use_preview": True,
+        "imgmath_latex": "latex",
+        "imgmath_latex_args": [],
+        "imgmath_dvisvgm": "dvisvgm",
+        "imgmath_dvisvgm_args": ["--no-fonts"],
+        "imgmath_dvipng": "dvipng",
+        "imgmath_dvipng_args": [],
+        "templates_path": [],
+    }
+    config.update(values)
+    return SimpleNamespace(**config)
+
+
+def _translator(path_build, path_cache, config):
+    builder = SimpleNamespace(
+        config=config,
+        confdir=str(path_build),
+        outdir=str(path_build.joinpath("html")),
+        imagedir="_images",
+        _jb_math_cache_path=path_cache,
+    )
+    return SimpleNamespace(builder=builder)
+
+
+def _latex(math, config):
+    return imgmath.generate_latex_macro("svg", math, config)
+
+
+def test_math_cache(tmpdir, monkeypatch):
+    rendered = []
+
+    def render_math(self, math):
+        # Like imgmath, only run LaTeX if the image isn't in the output folder
+        filename = f"{sha1(_latex(math, self.builder.config).encode()).hexdigest()}.svg"
+        path_out = Path(self.builder.outdir, "_images", "math", filename)
+        if not path_out.exists():
+            rendered.append(math)
+            path_out.parent.mkdir(parents=True, exist_ok=True)
+            path_out.write_text(f"<svg>{math}</svg>")
+        return f"_images/math/{filename}", None
+
+    monkeypatch.setattr(mathrender, "_render_math", render_math)
+    path_cache = Path(tmpdir).joinpath(".math_cache")
+    path_cache.mkdir()
+    config = _config()
+
+    # The first build renders the formula and stores the image in the cache
+    first = _translator(Path(tmpdir).joinpath("first"), path_cache, config)
+    relfn, _ = mathrender.render_math_cached(first, "x^2")
+    assert rendered == ["x^2"]
+    assert len(list(path_cache.glob("*.svg"))) == 1
+
+    # A clean build re-uses the cached image instead of rendering it again
+    second = _translator(Path(tmpdir).joinpath("second"), path_cache, config)
+    assert mathrender.render_math_cached(second, "x^2")[0] == relfn
+    assert rendered == ["x^2"]
+    path_out = Path(second.builder.outdir).joinpath(relfn)
+    assert path_out.read_text() == "<svg>x^2</svg>"
+
+    # Another formula is rendered
+    mathrender.render_math_cached(second, "y^2")
+    assert rendered == ["x^2", "y^2"]
+    assert len(list(path_cache.glob("*.svg"))) == 2
+
+
+def test_math_cache_key():
+    config = _config()
+    key = mathrender._math_cache_key(_latex("x^2", config), config)
+    assert mathrender._math_cache_key(_latex("x^2", config), config) == key
+
+    # The formula, the preamble and the converter's options all change the key
+    assert mathrender._math_cache_key(_latex("x^3", config), config) != key
+    preamble = _config(imgmath_latex_preamble=r"\usepackage{amssymb}")
+    assert mathrender._math_cache_key(_latex("x^2", preamble), preamble) != key
+    args = _config(imgmath_dvisvgm_args=[])
+    assert mathrender._math_cache_key(_latex("x^2", args), args) != key
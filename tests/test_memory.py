@@ -0,0 +1,142 @@
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import nbformat as nbf
+import pytest
+from myst_nb import cache
+
+from jupyter_book import memory
+from jupyter_book.memory import MemoryAwareTasks, MemoryScheduler, parse_memory
+
+
+def test_parse_memory():
+    assert parse_memory("800") == 800
+    assert parse_memory("800M") == 800
+    assert parse_memory("12G") == 12 * 1024
+    assert parse_memory("1.5GB") == 1.5 * 1024
+    assert parse_memory("512k") == 0.5
+    for text in ["", "0", "twelve", "12X"]:
+        with pytest.raises(ValueError):
+            parse_memory(text)
+
+
+def _task(arg):
+    time.sleep(0.2)
+    return arg
+
+
+def test_memory_aware_tasks():
+    results = []
+
+    def collect(arg, result):
+        results.append(result)
+
+    # Only one task of 60MB fits in 100MB at a time, though 4 could run
+    tasks = MemoryAwareTasks(4, budget=100, base=0)
+    for ii in range(3):
+        tasks.add_task(_task, ii, collect, memory=60)
+    tasks.join()
+    assert sorted(results) == [0, 1, 2]
+    assert tasks.most_workers == 1
+    assert tasks.throttled == 2
+    assert tasks.reserved == {}
+
+    # Small tasks run in parallel, up to the number of workers
+    tasks = MemoryAwareTasks(2, budget=100, base=0)
+    for ii in range(4):
+        tasks.add_task(_task, ii, collect, memory=10)
+    tasks.join()
+    assert tasks.most_workers == 2
+    assert tasks.throttled == 0
+
+
+def _notebook(path, code, outputs=()):
+    ntbk = nbf.v4.new_notebook()
+    ntbk.metadata["kernelspec"] = {"name": "python3", "display_name": "Python 3"}
+    ntbk.cells = [nbf.v4.new_markdown_cell("# A notebook"), nbf.v4.new_code_cell(code)]
+    ntbk.cells[1].outputs = list(outputs)
+    nbf.write(ntbk, str(path))
+
+
+def test_execute_parallel(tmpdir, monkeypatch):
+    path = Path(tmpdir)
+    for name in ["nb1", "nb2", "nb3"]:
+        _notebook(path.joinpath(f"{name}.ipynb"), f"print({name!r})")
+    output = nbf.v4.new_output("stream", text="done")
+    _notebook(path.joinpath("done.ipynb"), "print('done')", [output])
+    path.joinpath("page.md").write_text("# Not a notebook\n")
+
+    def execute(ntbk, **kwargs):
+        # Slow enough that the workers overlap
+        time.sleep(1)
+        text = f"{ntbk.cells[1].source} in {os.getpid()}"
+        ntbk.cells[1].outputs = [nbf.v4.new_output("stream", text=text)]
+        ntbk.metadata["language_info"] = {"name": "python"}
+        return ntbk
+
+    monkeypatch.setattr(cache, "execute", execute)
+    docnames = ["nb1", "nb2", "nb3", "done"]
+    paths = {docname: str(path.joinpath(f"{docname}.ipynb")) for docname in docnames}
+    paths["page"] = str(path.joinpath("page.md"))
+    env = SimpleNamespace(
+        doc2path=paths.get,
+        excluded_nb_exec_paths=[],
+        allowed_nb_exec_suffixes=[".ipynb", ".md"],
+    )
+    app = SimpleNamespace(
+        doctreedir=str(path),
+        env=env,
+        config={"jupyter_execute_notebooks": "auto"},
+        verbosity=0,
+    )
+    scheduler = MemoryScheduler(app, budget=4096)
+    scheduler.execute_parallel(docnames + ["page"], nproc=2)
+
+    # More than one worker executed notebooks at once, each in its own process
+    assert scheduler.tasks.most_workers == 2
+    assert scheduler.n_executed == 3
+    texts = [ntbk.cells[1].outputs[0].text for ntbk in scheduler.executed.values()]
+    pids = {int(text.split(" in ")[1]) for text in texts}
+    assert len(pids) == 3 and os.getpid() not in pids
+    # `done` already has its outputs, so it isn't executed in `auto` mode, and
+    # `page` isn't a notebook
+    assert len(scheduler.executed) == 3
+    assert set(scheduler.measured) == {"nb1", "nb2", "nb3", "done"}
+
+    # Reading a page takes the outputs of its notebook instead of executing it
+    monkeypatch.setattr(memory, "_scheduler", scheduler)
+    calls = []
+    wrapped = memory._pre_executed(lambda ntbk, **kwargs: calls.append(ntbk))
+    ntbk = wrapped(nbf.read(env.doc2path("nb2"), nbf.NO_CONVERT))
+    assert ntbk.cells[1].outputs[0].text.startswith("print('nb2') in ")
+    assert ntbk.metadata["language_info"] == {"name": "python"}
+    assert not calls
+    # ...once: other notebooks with the same code are executed as usual
+    wrapped(nbf.read(env.doc2path("nb2"), nbf.NO_CONVERT))
+    assert len(calls) == 1
+
+
+def test_serial_reason(monkeypatch):
+    import myst_nb
+
+    app = SimpleNamespace(parallel=2, config={"jupyter_execute_notebooks": "auto"})
+    monkeypatch.setattr(memory, "parallel_available", True)
+    monkeypatch.setattr(myst_nb, "__version__", "0.7.1")
+    assert memory._serial_reason(app) is None
+    # myst-nb's private functions may change in other versions
+    monkeypatch.setattr(myst_nb, "__version__", "0.99.0")
+    assert "myst-nb 0.99.0 isn't supported" in memory._serial_reason(app)
+
+
+def test_restoring_parallel():
+    app = SimpleNamespace(parallel=4)
+
+    def read():
+        app.parallel = 1
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        memory._restoring_parallel(app, read)()
+    assert app.parallel == 4
@@ -0,0 +1,45 @@
+import tracemalloc
+
+from jupyter_book.memprofile import MemoryProfiler, format_report
+
+
+def test_memory_profiler(tmpdir):
+    tracemalloc.start()
+    try:
+        profiler = MemoryProfiler(tmpdir)
+        kept = []
+
+        def write_doc(docname, doctree):
+            kept.append(bytearray(2 * 1024 * 1024))
+            bytearray(8 * 1024 * 1024)
+
+        profiler.profile_write(write_doc)("big", None)
+        profiler.profile_write(lambda docname, doctree: None)("small", None)
+    finally:
+        tracemalloc.stop()
+    records = profiler.records["write"]
+    assert 1.9 < records["big"]["kept"] < 2.5
+    assert records["big"]["peak"] >= records["big"]["kept"]
+    assert abs(records["small"]["kept"]) < 0.1
+
+    # Records are combined from the files of each process
+    profiler.write_stats()
+    combined = profiler.read_stats()
+    assert combined["write"] == records
+    assert not list(tmpdir.listdir())
+
+    records = {
+        "read": {"a": {"kept": 1, "peak": 5, "rss": 2}},
+        "write": combined["write"],
+        "steps": {"add_toctree": {"a": {"kept": 0.1, "peak": 0.2, "rss": 0}}},
+        "sites": {"module.py:10": 3 * 1024 * 1024},
+    }
+    report = format_report(records, {"titles": 100, "domaindata.std": 300}, (50, 10))
+    lines = report.splitlines()
+    # Documents are ranked by their peak
+    assert lines.index(next(ii for ii in lines if ii.endswith("big"))) < lines.index(
+        next(ii for ii in lines if ii.endswith("small"))
+    )
+    assert "Step `add_toctree`: 1 documents" in report
+    assert "3.00MB  module.py:10" in report
+    assert "75.0%  domaindata.std" in report
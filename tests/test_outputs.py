@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+import nbformat as nbf
+import pytest
+
+from jupyter_book.outputs import (
+    truncate_text,
+    limit_notebook_outputs,
+    read_limited_notebook,
+    init_output_limits,
+)
+
+
+def test_truncate_text():
+    text = "".join(f"{ii}\n" for ii in range(100))
+    assert truncate_text(text, max_size=1000, max_lines=200) is None
+    assert truncate_text(text, max_lines=3) == "0\n1\n2\n"
+    assert truncate_text(text, max_size=5) == "0\n1\n2"
+
+
+def test_limit_notebook_outputs(tmpdir):
+    config = {"max_output_size": 50, "max_output_lines": 5, "save_full_outputs": True}
+    app = SimpleNamespace(outdir=str(tmpdir))
+    env = SimpleNamespace(config=config, docname="sub/page", app=app)
+    long_text = "".join(f"{ii}\n" for ii in range(100))
+    ntbk = nbf.v4.new_notebook(
+        cells=[
+            nbf.v4.new_code_cell(
+                "",
+                outputs=[
+                    nbf.v4.new_output("stream", name="stdout", text=long_text),
+                    nbf.v4.new_output(
+                        "execute_result",
+                        data={"text/plain": "small", "text/html": "<b>" * 100},
+                    ),
+                ],
+            )
+        ]
+    )
+    limit_notebook_outputs(env, ntbk)
+    outputs = ntbk.cells[0].outputs
+    assert outputs[0]["text"].startswith("0\n1\n2\n3\n4\n[... output truncated:")
+    assert "../_outputs/sub-page-0-0.txt" in outputs[1]["data"]["text/html"]
+    assert tmpdir.join("_outputs", "sub-page-0-0.txt").read() == long_text
+    assert outputs[2]["data"] == {"text/plain": "small"}
+
+    # Truncating again doesn't change anything
+    limit_notebook_outputs(env, ntbk)
+    assert len(ntbk.cells[0].outputs) == 3
+
+
+def test_limit_rich_outputs(tmpdir):
+    """Outputs without plain text are limited too, by each of their mimetypes."""
+    config = {"max_output_size": 50, "max_output_lines": None}
+    config["save_full_outputs"] = True
+    env = SimpleNamespace(
+        config=config, docname="page", app=SimpleNamespace(outdir=str(tmpdir))
+    )
+    html = "<table>" + "<tr><td>1</td></tr>" * 100 + "</table>"
+    ntbk = nbf.v4.new_notebook(
+        cells=[
+            nbf.v4.new_code_cell(
+                "",
+                outputs=[
+                    nbf.v4.new_output("display_data", data={"text/html": html}),
+                    nbf.v4.new_output("display_data", data={"image/png": "i" * 100}),
+                ],
+            )
+        ]
+    )
+    # Outputs are truncated as each cell is read from the notebook's JSON
+    ntbk = read_limited_notebook(nbf.writes(ntbk), env)
+    outputs = ntbk.cells[0].outputs
+    assert outputs[0]["data"]["text/plain"].startswith("[... output truncated:")
+    assert "text/html" not in outputs[0]["data"]
+    assert tmpdir.join("_outputs", "page-0-0.html").read() == html
+    assert "_outputs/page-0-0.html" in outputs[1]["data"]["text/html"]
+    # Images are saved in their own files, so they aren't limited
+    assert outputs[2]["data"] == {"image/png": "i" * 100}
+
+
+def test_output_limits_config():
+    for value in [True, False, -1, "100"]:
+        config = {"max_output_size": value, "max_output_lines": None}
+        with pytest.raises(ValueError):
+            init_output_limits(SimpleNamespace(config=config))
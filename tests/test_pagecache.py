@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+from jupyter_book.pagecache import DirectoryBackend, _relocate_dependencies
+
+
+def test_directory_backend(tmpdir):
+    backend = DirectoryBackend(str(tmpdir))
+    key = "ab" + "0" * 62
+    assert backend.get(key) is None
+    backend.put(key, b"page")
+    assert backend.get(key) == b"page"
+    assert Path(tmpdir).joinpath("ab", key).exists()
+    backend.put(key, b"new page")
+    assert backend.get(key) == b"new page"
+    # No temporary files are left behind
+    assert [path.name for path in Path(tmpdir).joinpath("ab").iterdir()] == [key]
+
+
+def test_relocate_dependencies():
+    srcdir = os.path.abspath("book")
+    # sphinxcontrib-bibtex adds absolute paths, other dependencies are relative
+    deps = {os.path.join(srcdir, "refs.bib"), "images/plot.png"}
+    env = SimpleNamespace(dependencies={"intro": deps})
+    _relocate_dependencies(
+        env, "intro", lambda path: os.path.relpath(os.path.join(srcdir, path), srcdir)
+    )
+    assert env.dependencies["intro"] == {"refs.bib", os.path.join("images", "plot.png")}
+
+    # Another checkout of the book makes them absolute in its own folder
+    other = os.path.abspath("other")
+    _relocate_dependencies(env, "intro", lambda path: os.path.join(other, path))
+    assert env.dependencies["intro"] == {
+        os.path.join(other, "refs.bib"),
+        os.path.join(other, "images", "plot.png"),
+    }
+    _relocate_dependencies(env, "missing", str.upper)
+    assert "missing" not in env.dependencies
@@ -0,0 +1,47 @@
+from docutils import nodes
+from docutils.utils import new_document
+
+from jupyter_book.pagescripts import PageScripts, page_features, _script_feature
+
+
+def _doctree(*children):
+    doctree = new_document("page")
+    section = nodes.section()
+    section += nodes.paragraph(text="Some prose.")
+    for child in children:
+        section += child
+    doctree += section
+    return doctree
+
+
+def test_page_features():
+    assert page_features(_doctree()) == set()
+    assert page_features(_doctree(nodes.math_block(text="x^2"))) == {"math"}
+    assert page_features(_doctree(nodes.literal_block(text="print(1)"))) == {"code"}
+    raw = nodes.raw(text="<span>\\(x^2\\)</span>", format="html")
+    assert page_features(_doctree(raw)) == {"math"}
+    toggle = nodes.container(classes=["toggle"])
+    assert page_features(_doctree(toggle)) == {"toggles"}
+
+
+def test_script_feature():
+    mathjax = "https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.5/latest.js"
+    assert _script_feature(mathjax) == "math"
+    assert _script_feature("_static/clipboard.min.js") == "code"
+    assert _script_feature("_static/togglebutton.js") == "toggles"
+    assert _script_feature("_static/jquery.js") is None
+    assert _script_feature("_static/doctools.js") is None
+
+
+def test_page_scripts_stats(tmpdir):
+    page_scripts = PageScripts(tmpdir)
+    before = ["_static/jquery.js", "_static/togglebutton.js"]
+    page_scripts.add_page(before, before[:1])
+    page_scripts.add_page(before, before)
+    # Counts are only saved when asked, once per process
+    assert not tmpdir.listdir()
+    page_scripts.write_stats()
+    page_scripts.read_stats()
+    assert (page_scripts.pages, page_scripts.pages_reduced) == (2, 1)
+    assert page_scripts.after == {"_static/jquery.js": 2, "_static/togglebutton.js": 1}
+    assert not tmpdir.listdir()
@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from jupyter_book.publish import (
+    MANIFEST_FILENAME,
+    is_rsync_target,
+    publish_book,
+    write_manifest,
+)
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_publish_local(tmpdir):
+    path_html = Path(tmpdir).joinpath("html")
+    path_site = Path(tmpdir).joinpath("site")
+    for name in ["index.html", "intro.html", "sub/page.html", "_static/a.css"]:
+        _write(path_html.joinpath(name), name)
+    write_manifest(path_html)
+
+    changed, stale = publish_book(path_html, path_site)
+    assert sorted(changed) == [
+        "_static/a.css",
+        "index.html",
+        "intro.html",
+        "sub/page.html",
+    ]
+    assert stale == []
+    assert path_site.joinpath(MANIFEST_FILENAME).exists()
+    assert path_site.joinpath("sub", "page.html").read_text() == "sub/page.html"
+
+    # Nothing has changed
+    assert publish_book(path_html, path_site) == ([], [])
+
+    # Only changed files are copied, and removed files are deleted
+    _write(path_html.joinpath("intro.html"), "new intro")
+    path_html.joinpath("sub", "page.html").unlink()
+    path_html.joinpath("sub").rmdir()
+    path_site.joinpath("other.txt").write_text("not part of the book")
+    write_manifest(path_html)
+    assert publish_book(path_html, path_site, dry_run=True) == (
+        ["intro.html"],
+        ["sub/page.html"],
+    )
+    assert path_site.joinpath("sub", "page.html").exists()
+    assert publish_book(path_html, path_site) == (["intro.html"], ["sub/page.html"])
+    assert path_site.joinpath("intro.html").read_text() == "new intro"
+    assert not path_site.joinpath("sub").exists()
+    assert path_site.joinpath("other.txt").exists()
+
+
+def test_is_rsync_target():
+    assert is_rsync_target("user@host:/var/www/book")
+    assert is_rsync_target("rsync://host/module/book")
+    assert not is_rsync_target("/var/www/book")
+    assert not is_rsync_target("C:\\book")
+    assert not is_rsync_target("site")
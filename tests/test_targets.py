@@ -0,0 +1,94 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from jupyter_book.targets import load_targets, merge_config
+
+
+def test_load_targets(tmpdir):
+    path_targets = Path(tmpdir).joinpath("targets.yml")
+    path_targets.write_text(
+        "cache: cache\n"
+        "jobs: 2\n"
+        "targets:\n"
+        "  - name: v1\n"
+        "    path: versions/v1\n"
+        "  - name: fr\n"
+        "    config: _config_fr.yml\n"
+        "    builder: pdfhtml\n"
+    )
+    targets, path_cache, jobs = load_targets(path_targets)
+    assert path_cache == Path(tmpdir).joinpath("cache")
+    assert jobs == 2
+    assert targets[0] == {
+        "name": "v1",
+        "path": Path(tmpdir).joinpath("versions", "v1"),
+        "config": None,
+        "path_output": Path(tmpdir).joinpath("_build", "targets", "v1"),
+        "builder": "html",
+    }
+    assert targets[1]["path"] == Path(tmpdir)
+    assert targets[1]["config"] == Path(tmpdir).joinpath("_config_fr.yml")
+    assert targets[1]["builder"] == "pdfhtml"
+
+    path_targets.write_text("targets:\n  - name: v1\n  - name: v1\n")
+    with pytest.raises(ValueError, match="unique"):
+        load_targets(path_targets)
+    path_targets.write_text("targets:\n  - name: v1\n    title: Book\n")
+    with pytest.raises(ValueError, match="Unknown keys"):
+        load_targets(path_targets)
+
+
+def test_merge_config(tmpdir):
+    Path(tmpdir).joinpath("_config.yml").write_text(
+        "title: My book\nexecute:\n  execute_notebooks: cache\n  timeout: 30\n"
+    )
+    config = merge_config(tmpdir, {"title": "Mon livre", "execute": {"timeout": 60}})
+    assert config == {
+        "title": "Mon livre",
+        "execute": {"execute_notebooks": "cache", "timeout": 60},
+    }
+
+
+def test_build_targets_cache_serial(tmpdir, monkeypatch):
+    from jupyter_book import targets as targets_module
+
+    Path(tmpdir).joinpath("_config.yml").write_text(
+        "execute:\n  execute_notebooks: cache\n"
+    )
+    targets = [
+        {"name": name, "path": Path(tmpdir), "config": config, "path_output": None}
+        for name, config in [
+            ("cache1", None),
+            ("cache2", {"title": "Mon livre"}),
+            ("off1", {"execute": {"execute_notebooks": "off"}}),
+            ("off2", {"execute": {"execute_notebooks": "off"}}),
+        ]
+    ]
+    assert [targets_module.uses_execution_cache(tt) for tt in targets] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+
+    lock = threading.Lock()
+    running = []
+    overlaps = []
+
+    def build_target(target, path_cache, extra_args):
+        with lock:
+            running.append(target["name"])
+            overlaps.append(sorted(running))
+        time.sleep(0.2)
+        with lock:
+            running.remove(target["name"])
+        return 0, 0.2, None
+
+    monkeypatch.setattr(targets_module, "build_target", build_target)
+    failed = targets_module.build_targets(targets, Path(tmpdir).joinpath("c"), jobs=4)
+    assert failed == []
+    # The targets that use the execution cache are never built at the same time
+    assert not any({"cache1", "cache2"} <= set(names) for names in overlaps)
+    assert any(len(names) > 1 for names in overlaps)
@@ -1,7 +1,15 @@
+import multiprocessing
+import os
 from pathlib import Path
 from subprocess import run, PIPE
 import pytest
-from jupyter_book.utils import init_myst_file
+import nbformat as nbf
+from jupyter_book.utils import (
+    ProcessStats,
+    init_myst_file,
+    init_myst_files,
+    clear_outputs,
+)
 
 
 def test_myst_init(tmpdir):
@@ -30,3 +38,96 @@ def test_myst_init(tmpdir):
     with pytest.raises(Exception) as err:
         init_myst_file(path.joinpath("MISSING"), kernel="python3")
     assert "Markdown file not found:" in str(err)
+
+
+def test_myst_init_many(tmpdir):
+    """Test adding myst metadata to a folder of text files."""
+    path = Path(tmpdir).joinpath("book").absolute()
+    path.joinpath("sub").mkdir(parents=True)
+    for name in ["one.md", "two.md", "sub/three.md"]:
+        path.joinpath(name).write_text("TEST")
+    path.joinpath("notmarkdown.txt").write_text("TEST")
+
+    summary = init_myst_files([path], kernel="python3", verbose=False)
+    assert len(summary["converted"]) == 3
+    assert not summary["skipped"] and not summary["failed"]
+    assert "format_name: myst" in path.joinpath("sub", "three.md").read_text()
+    assert path.joinpath("notmarkdown.txt").read_text() == "TEST"
+
+    # Already-initialized files are skipped, and globs are expanded
+    summary = init_myst_files(
+        [str(path.joinpath("*.md"))], kernel="python3", verbose=False
+    )
+    assert len(summary["skipped"]) == 2
+    assert not summary["converted"]
+
+    # Missing glob
+    with pytest.raises(Exception) as err:
+        init_myst_files([str(path.joinpath("*.missing"))], kernel="python3")
+    assert "Markdown file not found:" in str(err)
+
+
+def test_clear_outputs(tmpdir):
+    """Test removing the outputs of a folder of notebooks."""
+    path = Path(tmpdir).joinpath("book").absolute()
+    path.joinpath("sub").mkdir(parents=True)
+    ntbk = nbf.v4.new_notebook()
+    cell = nbf.v4.new_code_cell("print(1)", execution_count=1)
+    cell.outputs = [nbf.v4.new_output("stream", text="1\n")]
+    cell.metadata["scrolled"] = True
+    ntbk.cells = [nbf.v4.new_markdown_cell('"outputs": [1]'), cell]
+    nbf.write(ntbk, str(path.joinpath("sub", "outputs.ipynb")))
+    ntbk.cells = ntbk.cells[:1]
+    nbf.write(ntbk, str(path.joinpath("clean.ipynb")))
+    mtime = path.joinpath("clean.ipynb").stat().st_mtime_ns
+
+    summary = clear_outputs([path], check=True, verbose=False)
+    assert summary["cleared"] == [str(path.joinpath("sub", "outputs.ipynb"))]
+    assert summary["clean"] == [str(path.joinpath("clean.ipynb"))]
+    out = run(f"jb clear-outputs {path} --check".split(), stdout=PIPE)
+    assert out.returncode == 1
+
+    summary = clear_outputs([path], jobs=2, verbose=False)
+    assert len(summary["cleared"]) == 1
+    cell = nbf.read(str(path.joinpath("sub", "outputs.ipynb")), nbf.NO_CONVERT).cells[1]
+    assert cell.outputs == [] and cell.execution_count is None
+    assert "scrolled" not in cell.metadata
+    # Clean notebooks aren't rewritten
+    assert path.joinpath("clean.ipynb").stat().st_mtime_ns == mtime
+    out = run(f"jb clear-outputs {path} --check".split(), stdout=PIPE)
+    assert out.returncode == 0
+
+
+class _Counts(ProcessStats):
+    def _reset(self):
+        self.count = 0
+
+    def _stats(self):
+        return {"count": self.count} if self.count else None
+
+    def add(self):
+        self._check_process()
+        self.count += 1
+
+
+def test_process_stats(tmpdir):
+    counts = _Counts(Path(tmpdir).joinpath("stats"))
+    counts.add()
+
+    def work():
+        counts.add()
+        counts.add()
+        # Nothing is saved until the worker exits
+        assert not counts.path_stats.joinpath(f"{os.getpid()}.json").exists()
+
+    context = multiprocessing.get_context("fork")
+    procs = [context.Process(target=work) for _ in range(2)]
+    for proc in procs:
+        proc.start()
+        proc.join()
+        assert proc.exitcode == 0
+    # Each worker saved its own counts, and the main process saves its own
+    assert len(list(counts.path_stats.glob("*.json"))) == 2
+    counts.write_stats()
+    assert sorted(stats["count"] for stats in counts.iter_stats()) == [1, 2, 2]
+    assert not list(counts.path_stats.glob("*.json"))